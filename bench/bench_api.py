@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Load test dell'API dei marker su un CSV sintetico.
+
+Il server gira in un processo separato (come nel bot) e il client apre N
+connessioni keep-alive per ogni scenario, misurando richieste al secondo e
+latenza. Lo scenario "fredda" misura la prima richiesta dopo un'invalidazione.
+
+Uso: python bench/bench_api.py [--markers 100000] [--connections 32] [--duration 5]
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from api import MarkerAPI
+from marker_store import write_csv
+from stats import MarkerStats
+from storage import open_store
+
+def make_csv(path, count):
+    rng = np.random.default_rng(1)
+    lats = rng.uniform(36.6, 47.1, count)
+    lons = rng.uniform(6.6, 18.5, count)
+    types = rng.choice(['Mehstastic', 'MeshCore', 'Altro'], count)
+    freqs = rng.choice(['433 MHz', '868 MHz'], count)
+    write_csv(path, [{
+        'lat': f"{lats[i]:.6f}", 'lon': f"{lons[i]:.6f}", 'name': f"Nodo {i}", 'desc': 'Nodo di prova',
+        'node_type': types[i], 'frequency': freqs[i], 'link': '', 'ID': str(100000 + i % 5000),
+        'user': f"utente{i % 5000}", 'timestamp': str(1700000000 + i * 60),
+    } for i in range(count)])
+
+async def serve(csv_path, port):
+    store = open_store('csv', csv_path)
+    stats = MarkerStats()
+    stats.rebuild(store.all())
+    api = MarkerAPI(store, stats)
+    await api.start('127.0.0.1', port)
+    print('pronto', flush=True)
+    # Una riga su stdin invalida la cache (come una scrittura del bot)
+    loop = asyncio.get_running_loop()
+    while await loop.run_in_executor(None, sys.stdin.readline):
+        api.invalidate()
+        print('invalidato', flush=True)
+
+# -------------- CLIENT --------------
+
+async def request(reader, writer, path, extra=''):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: bench\r\nAccept-Encoding: gzip\r\n{extra}\r\n".encode('latin-1'))
+    status_line = await reader.readline()
+    length, etag = 0, None
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+        elif name.lower() == 'etag':
+            etag = value.strip()
+    await reader.readexactly(length)
+    return int(status_line.split()[1]), length, etag
+
+async def worker(port, path, extra, deadline, latencies, sizes):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=1 << 20)
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            status, length, _ = await request(reader, writer, path, extra)
+            assert status in (200, 304), (path, status)
+            latencies.append(time.perf_counter() - start)
+            sizes.append(length)
+    finally:
+        writer.close()
+
+async def scenario(name, port, path, connections, duration, extra=''):
+    latencies, sizes = [], []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(port, path, extra, deadline, latencies, sizes) for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    print(f"{name:<28} {len(latencies) / elapsed:>9.0f} req/s   p50 {np.percentile(ms, 50):7.2f} ms   "
+          f"p99 {np.percentile(ms, 99):7.2f} ms   {np.mean(sizes) / 1024:9.1f} KiB")
+
+async def run(port, args, server):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=1 << 20)
+    start = time.perf_counter()
+    _, length, etag = await request(reader, writer, '/api/markers')
+    print(f"Prima risposta completa (fredda): {(time.perf_counter() - start) * 1000:.0f} ms, {length / 1024:.0f} KiB gzip")
+    writer.close()
+
+    key = quote(f"{100000}|{1700000000}|Nodo 0")
+    print(f"\n{args.markers} marker, {args.connections} connessioni, {args.duration} s per scenario")
+    await scenario('/api/markers (gzip)', port, '/api/markers', args.connections, args.duration)
+    await scenario('/api/markers 304', port, '/api/markers', args.connections, args.duration, f"If-None-Match: {etag}\r\n")
+    await scenario('bbox Brescia', port, '/api/markers?bbox=45.3,9.8,45.9,10.6', args.connections, args.duration)
+    await scenario('type + freq + since', port, '/api/markers?type=MeshCore&freq=868&since=2023-12-01', args.connections, args.duration)
+    await scenario('/api/markers/<chiave>', port, f'/api/markers/{key}', args.connections, args.duration)
+    await scenario('/api/stats', port, '/api/stats', args.connections, args.duration)
+
+    # Dopo un'invalidazione le richieste concorrenti attendono una sola serializzazione
+    server.stdin.write('\n')
+    server.stdin.flush()
+    server.stdout.readline()
+    start = time.perf_counter()
+    connections = [await asyncio.open_connection('127.0.0.1', port, limit=1 << 20) for _ in range(args.connections)]
+    await asyncio.gather(*(request(r, w, '/api/markers') for r, w in connections))
+    print(f"\n{args.connections} richieste concorrenti dopo un'invalidazione: {(time.perf_counter() - start) * 1000:.0f} ms")
+    for _, w in connections:
+        w.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markers', type=int, default=100000)
+    parser.add_argument('--connections', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--port', type=int, default=8781)
+    parser.add_argument('--serve', metavar='CSV', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve(args.serve, args.port))
+        return
+
+    directory = tempfile.mkdtemp(prefix='api-')
+    csv_path = os.path.join(directory, 'dati.csv')
+    make_csv(csv_path, args.markers)
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', csv_path, '--port', str(args.port)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True
+    )
+    try:
+        server.stdout.readline()
+        asyncio.run(run(args.port, args, server))
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
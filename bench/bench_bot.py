@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""Benchmark del livello dati e degli handler del bot su dati.csv sintetici.
+
+Per ogni dimensione genera un dati.csv con BOM e righe malformate (vuote, senza
+coordinate o ID, troppo corte o lunghe, latitudine non numerica) e, in un processo
+separato per dimensione (il bot carica i marker all'import), misura read_markers,
+safe_write_markers, clean_text e i flussi completi /add, /rename, /delete e il
+pulsante Statistiche del menu admin. I flussi passano per l'Application di
+python-telegram-bot con Update fittizi e un Bot che risponde in locale, senza rete.
+
+I risultati sono in JSON, da confrontare tra commit con --compare.
+
+Uso: python bench/bench_bot.py [--sizes 1000,10000,100000,1000000] [--flows 20]
+                               [--output risultati.json] [--compare precedente.json]
+"""
+
+import argparse
+import asyncio
+import collections
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot')
+
+# Righe malformate inserite ogni MALFORMED_EVERY righe, a rotazione
+MALFORMED_EVERY = 97
+MALFORMED = [
+    '',
+    ',10.210000,SenzaLat,,MeshCore,868 MHz,,100001,utente,1700000000',
+    '45.500000,10.210000,SenzaID,,MeshCore,868 MHz,,,utente,1700000000',
+    '45.500000,10.210000,Corta',
+    '45.500000,10.210000,Lunga,,MeshCore,868 MHz,,100001,utente,1700000000,extra,extra',
+    'abc,10.210000,LatNonNumerica,,MeshCore,868 MHz,,100001,utente,1700000000',
+]
+
+NODE_TYPES = ["Mehstastic", "MeshCore", "Altro"]
+FREQUENCIES = ["433 MHz", "868 MHz"]
+
+def generate_csv(path, rows):
+    """Scrive rows righe (valide e malformate) con BOM e CRLF, come il CSV del bot. Restituisce le righe malformate."""
+    rnd = random.Random(rows)
+    malformed = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link', 'ID', 'user', 'timestamp'])
+        for i in range(rows):
+            if i % MALFORMED_EVERY == MALFORMED_EVERY - 1:
+                f.write(MALFORMED[malformed % len(MALFORMED)] + '\r\n')
+                malformed += 1
+                continue
+            uid = str(100000 + rnd.randrange(max(1, rows // 3)))
+            # Alcune descrizioni con virgole, a capo ed emoji tra virgolette
+            desc = "Tetto, 12 m\nantenna 📡" if i % 50 == 0 else "Nodo sintetico"
+            writer.writerow([
+                f"{rnd.uniform(36.6, 47.1):.6f}", f"{rnd.uniform(6.6, 18.5):.6f}", f"Nodo{i}", desc,
+                rnd.choice(NODE_TYPES), rnd.choice(FREQUENCIES), "https://example.org" if i % 7 == 0 else "",
+                uid, f"user{uid}", str(1700000000 + i),
+            ])
+    return malformed
+
+def summarize(samples):
+    ms = np.array(samples) * 1000
+    return {
+        'n': len(ms),
+        'mean_ms': round(float(ms.mean()), 4),
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'min_ms': round(float(ms.min()), 4),
+    }
+
+def measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def scaled(repeat, rows):
+    """Ripetizioni ridotte sui file grandi, almeno 3."""
+    return max(3, min(repeat, repeat * 10000 // max(rows, 1)))
+
+# -------------- BOT FITTIZIO --------------
+
+BOT_USER = {'id': 4242, 'is_bot': True, 'first_name': 'LoRaBS', 'username': 'lorabs_bench_bot'}
+
+def make_stub_request():
+    from telegram.request import BaseRequest
+
+    class StubRequest(BaseRequest):
+        """Risponde in locale alle chiamate della Bot API e registra i testi inviati.
+
+        latency (secondi) simula il tempo di rete di ogni chiamata.
+        """
+
+        def __init__(self, latency=0):
+            self.latency = latency
+            self.calls = collections.Counter()
+            self.sent = []  # (chat_id, testo) di sendMessage ed editMessageText
+            self._message_id = 0
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, **timeouts):
+            endpoint = url.rsplit('/', 1)[-1]
+            params = request_data.parameters if request_data is not None else {}
+            self.calls[endpoint] += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if endpoint == 'getMe':
+                result = BOT_USER
+            elif endpoint in ('sendMessage', 'editMessageText'):
+                self.sent.append((int(params['chat_id']), params.get('text')))
+                self._message_id += 1
+                result = {
+                    'message_id': self._message_id, 'date': int(time.time()), 'text': params.get('text', ''),
+                    'chat': {'id': int(params['chat_id']), 'type': 'private'}, 'from': BOT_USER,
+                }
+            else:
+                result = True
+            return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+    return StubRequest
+
+class FakeUpdates:
+    """Costruisce Update di Telegram (messaggi, comandi, pulsanti) come li invierebbe il server."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.next_id = 0
+
+    def _user(self, uid):
+        return {'id': uid, 'is_bot': False, 'first_name': f"Utente{uid}", 'username': f"utente{uid}"}
+
+    def _update(self, payload):
+        from telegram import Update
+        self.next_id += 1
+        return Update.de_json(dict(payload, update_id=self.next_id), self.bot)
+
+    def message(self, uid, text):
+        message = {
+            'message_id': self.next_id + 1, 'date': int(time.time()), 'text': text,
+            'chat': {'id': uid, 'type': 'private'}, 'from': self._user(uid),
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return self._update({'message': message})
+
+    def button(self, uid, data):
+        return self._update({'callback_query': {
+            'id': str(self.next_id + 1), 'chat_instance': str(uid), 'data': data, 'from': self._user(uid),
+            'message': {
+                'message_id': 1, 'date': int(time.time()), 'text': "Menu admin",
+                'chat': {'id': uid, 'type': 'private'}, 'from': BOT_USER,
+            },
+        }})
+
+# -------------- MISURE (processo figlio) --------------
+
+async def run_flows(bot, flows):
+    from telegram.ext import ApplicationBuilder, JobQueue, PicklePersistence, PersistenceInput
+
+    StubRequest = make_stub_request()
+    request = StubRequest()
+    app = (
+        ApplicationBuilder()
+        .token("123456:BENCH")
+        .request(request)
+        .get_updates_request(StubRequest())
+        .job_queue(JobQueue())
+        .persistence(PicklePersistence(
+            bot.CONVERSATIONS_FILE,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False)
+        ))
+        .build()
+    )
+    bot.register_handlers(app)
+    fake = FakeUpdates(app.bot)
+    results = {}
+
+    # Avvio come in post_init, senza API, metriche e copertura
+    start = time.perf_counter()
+    await bot.publish_snapshot()
+    results['publish_snapshot'] = summarize([time.perf_counter() - start])
+    publish_task = asyncio.create_task(bot.publish_worker())
+    await asyncio.to_thread(bot.search_index.rebuild)
+    bot.writer.start()
+    bot.dispatcher.start(app.bot)
+    await app.initialize()
+    await app.start()
+
+    async def flow(uid, steps, expected):
+        sent = len(request.sent)
+        start = time.perf_counter()
+        for step in steps:
+            await app.process_update(step())
+        elapsed = time.perf_counter() - start
+        replies = [text for chat_id, text in request.sent[sent:] if chat_id == uid]
+        assert replies and replies[-1].startswith(expected), (steps, replies[-1:])
+        return elapsed
+
+    uids = [900000 + i for i in range(flows)]
+    samples = collections.defaultdict(list)
+    for uid in uids:
+        samples['/add'].append(await flow(uid, [
+            lambda: fake.message(uid, '/add'),
+            lambda: fake.message(uid, '45.5412'),
+            lambda: fake.message(uid, '10.2118'),
+            lambda: fake.message(uid, f"Bench{uid % 1000}"),
+            lambda: fake.message(uid, 'MeshCore'),
+            lambda: fake.message(uid, '868 MHz'),
+            lambda: fake.message(uid, 'Sul tetto, 10 m'),
+            lambda: fake.message(uid, 'No'),
+        ], bot.MESSAGES["marker_added"]))
+    for uid in uids:
+        samples['/rename'].append(await flow(uid, [
+            lambda: fake.message(uid, '/rename'),
+            lambda: fake.message(uid, '1'),
+            lambda: fake.message(uid, f"Nuovo{uid % 1000}"),
+        ], bot.MESSAGES["name_updated"]))
+    for uid in uids:
+        samples['/delete'].append(await flow(uid, [
+            lambda: fake.message(uid, '/delete'),
+            lambda: fake.message(uid, '1'),
+        ], bot.MESSAGES["no_markers_left"]))
+    admin = bot.ADMIN_IDS[0]
+    for _ in uids:
+        samples['stats'].append(await flow(admin, [lambda: fake.button(admin, 'stats')], "📊"))
+
+    await app.stop()
+    await app.shutdown()
+    await bot.writer.stop()
+    await bot.publish_queue.join()
+    publish_task.cancel()
+    await bot.dispatcher.stop()
+
+    results.update({name: summarize(values) for name, values in samples.items()})
+    results['telegram_calls'] = dict(request.calls)
+    return results
+
+def run_child(flows, repeat):
+    sys.path.insert(0, BOT_DIR)
+    start = time.perf_counter()
+    import bot
+    import logging
+    import_s = time.perf_counter() - start
+    logging.getLogger().setLevel(logging.WARNING)
+    from marker_store import read_csv
+
+    markers = bot.read_markers()
+    heavy = scaled(repeat, len(markers))  # letture e scritture dell'intero file
+    samples = [bot.clean_text(text) for text in ("Tetto, 12 m 📡", '"Nodo <b>prova</b>"', "Ripetitore @ 868 MHz!")]
+    texts = [f"{random.choice(samples)} {i}" for i in range(10000)]
+    results = {
+        'loaded': len(markers),
+        'import_s': round(import_s, 3),
+        'timings': {
+            'read_csv': measure(lambda: read_csv(bot.FILE), heavy),
+            'read_markers': measure(bot.read_markers, repeat),
+            'safe_write_markers': measure(lambda: bot.safe_write_markers(markers), heavy),
+            'clean_text': measure(lambda: [bot.clean_text(t) for t in texts], repeat),
+        },
+    }
+    results['timings']['clean_text']['calls'] = len(texts)
+    results['flows'] = asyncio.run(run_flows(bot, scaled(flows, len(markers))))
+    results['handlers'] = {
+        labels[0]: {'count': count, 'mean_ms': round(total / count * 1000, 4)}
+        for labels, (_, total, count) in sorted(bot.handler_seconds.series().items())
+    }
+    json.dump(results, sys.stdout)
+
+# -------------- CONFRONTO --------------
+
+def print_table(results, previous=None):
+    for size, data in results['sizes'].items():
+        print(f"\n{size} righe ({data['loaded']} valide, {data['malformed']} malformate, "
+              f"{data['file_bytes'] / 1048576:.1f} MiB, import {data['import_s']} s)", file=sys.stderr)
+        rows = {**data['timings'], **{k: v for k, v in data['flows'].items() if 'p50_ms' in v}}
+        old = (previous or {}).get('sizes', {}).get(size, {})
+        old_rows = {**old.get('timings', {}), **old.get('flows', {})}
+        for name, stats in rows.items():
+            line = f"  {name:<20} p50 {stats['p50_ms']:>10.3f} ms   p95 {stats['p95_ms']:>10.3f} ms"
+            if name in old_rows and old_rows[name].get('p50_ms'):
+                line += f"   {stats['p50_ms'] / old_rows[name]['p50_ms']:>6.2f}x"
+            print(line, file=sys.stderr)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--flows', type=int, default=20, help="utenti per flusso (ridotti sui file grandi)")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help="file JSON dei risultati (default stdout)")
+    parser.add_argument('--compare', help="risultati JSON di un altro commit da confrontare")
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_child(args.flows, args.repeat)
+        return
+
+    import telegram
+    results = {
+        'commit': git_commit(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'python_telegram_bot': telegram.__version__,
+        'sizes': {},
+    }
+    for size in (int(s) for s in args.sizes.split(',')):
+        directory = tempfile.mkdtemp(prefix='bench-bot-')
+        try:
+            os.makedirs(os.path.join(directory, 'shared'))
+            path = os.path.join(directory, 'shared', 'dati.csv')
+            start = time.perf_counter()
+            malformed = generate_csv(path, size)
+            generate_s = time.perf_counter() - start
+            file_bytes = os.path.getsize(path)
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--run', '--flows', str(args.flows), '--repeat', str(args.repeat)],
+                cwd=directory, stdout=subprocess.PIPE, text=True, env=dict(os.environ, BOT_TOKEN='')
+            )
+            if child.returncode:
+                raise SystemExit(f"Benchmark fallito con {size} righe")
+            data = json.loads(child.stdout)
+            data.update({'rows': size, 'malformed': malformed, 'file_bytes': file_bytes, 'generate_s': round(generate_s, 3)})
+            results['sizes'][str(size)] = data
+            print(f"{size} righe completate", file=sys.stderr)
+        finally:
+            shutil.rmtree(directory)
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    print_table(results, previous)
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Benchmark dell'overlay di copertura: ricostruzione completa vs aggiornamento incrementale.
+
+Controlla anche che dopo una serie di aggiunte ed eliminazioni le tile coincidano
+con quelle di una ricostruzione da zero, e che un riavvio non ricalcoli nulla.
+
+Uso: python bench/bench_coverage.py [--markers 500] [--updates 20]
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from coverage import CoverageBuilder
+
+def make_marker(i, lat, lon, frequency):
+    return {
+        'lat': f"{lat:.6f}", 'lon': f"{lon:.6f}", 'name': f"Nodo{i}", 'desc': '',
+        'node_type': 'MeshCore', 'frequency': frequency, 'link': '',
+        'ID': str(1000 + i % 50), 'user': 'bench', 'timestamp': str(1700000000 + i),
+    }
+
+def read_tiles(root):
+    tiles = {}
+    for path in glob.glob(os.path.join(root, '*', '*', '*.png')):
+        with open(path, 'rb') as f:
+            tiles[os.path.relpath(path, root)] = f.read()
+    return tiles
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--markers', type=int, default=500)
+    parser.add_argument('--updates', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    # Marker concentrati nel bresciano, come i dati reali, più alcuni sparsi in Italia
+    local = args.markers * 4 // 5
+    lats = np.concatenate([rng.normal(45.55, 0.15, local), rng.uniform(37.0, 46.5, args.markers - local)])
+    lons = np.concatenate([rng.normal(10.22, 0.2, local), rng.uniform(7.0, 18.0, args.markers - local)])
+    frequencies = rng.choice(['868 MHz', '433 MHz'], args.markers, p=[0.8, 0.2])
+    markers = [make_marker(i, lat, lon, f) for i, (lat, lon, f) in enumerate(zip(lats, lons, frequencies))]
+
+    directory = tempfile.mkdtemp(prefix='coverage-')
+    builder = CoverageBuilder(directory)
+    start = time.perf_counter()
+    builder.rebuild(markers)
+    rebuild_s = time.perf_counter() - start
+    total_tiles = len(read_tiles(builder.root))
+    print(f"Ricostruzione: {rebuild_s:.2f} s, {total_tiles} tile per {args.markers} marker")
+
+    # Aggiornamenti singoli, come un /add o un'eliminazione da Telegram
+    current = list(markers)
+    timings, rendered = {'add': [], 'delete': []}, []
+    for i in range(args.updates):
+        if i % 2 == 0:
+            marker = make_marker(args.markers + i, rng.normal(45.55, 0.15), rng.normal(10.22, 0.2), '868 MHz')
+            current.append(marker)
+            change = ('add', (marker,), marker)
+        else:
+            marker = current.pop(int(rng.integers(len(current))))
+            change = ('delete', (), marker)
+        start = time.perf_counter()
+        done, _ = builder.update([change])
+        timings[change[0]].append(time.perf_counter() - start)
+        rendered.append(done)
+    rename = current[0]
+    done, reused = builder.update([('rename', (rename['ID'], rename['name'], 'Nuovo'), rename)])
+    assert done == 0 and reused == 0, "la rinomina non deve toccare le tile"
+    current[0] = dict(rename, name='Nuovo')
+    print(f"Aggiunta: {np.mean(timings['add']) * 1000:.1f} ms, eliminazione: {np.mean(timings['delete']) * 1000:.1f} ms medi, "
+          f"{np.mean(rendered):.1f} tile ricalcolate su {total_tiles}")
+
+    # Confronto con una ricostruzione da zero
+    incremental = read_tiles(builder.root)
+    fresh_dir = tempfile.mkdtemp(prefix='coverage-')
+    CoverageBuilder(fresh_dir).rebuild(current)
+    fresh = read_tiles(os.path.join(fresh_dir, 'coverage'))
+    assert incremental.keys() == fresh.keys(), "insieme di tile diverso dalla ricostruzione"
+    assert all(incremental[k] == fresh[k] for k in fresh), "contenuto delle tile diverso dalla ricostruzione"
+    assert all(data.startswith(b'\x89PNG') for data in fresh.values())
+
+    # Riavvio: l'indice pubblicato evita di ricalcolare le tile
+    restarted = CoverageBuilder(directory)
+    start = time.perf_counter()
+    done, reused = restarted.rebuild(current)
+    restart_s = time.perf_counter() - start
+    assert done == 0 and reused > 0, (done, reused)
+    assert read_tiles(restarted.root) == incremental
+    print(f"Riavvio: {restart_s:.2f} s senza ricalcolo delle tile")
+
+    shutil.rmtree(directory)
+    shutil.rmtree(fresh_dir)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Benchmark del MessageDispatcher (bot/dispatcher.py) con un annuncio a molte chat.
+
+Il Bot è fittizio e risponde subito, il limite globale è altissimo: il tempo misurato
+è quello di scelta della chat da servire, accodamento e limiti per chat. Verifica
+anche che ogni chat riceva i suoi messaggi in ordine, che il limite per chat sia
+rispettato e che i bucket delle chat servite vengano eliminati. Con più messaggi per
+chat del burst tutte le chat sono in attesa: è il caso in cui la scansione di tutte le
+chat a ogni invio (prima dell'heap) diventava quadratica.
+
+Uso: python bench/bench_dispatcher.py [--sizes 1000,10000,50000]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from dispatcher import MessageDispatcher
+
+class FakeBot:
+    def __init__(self):
+        self.received = {}  # chat_id -> [(istante, testo)]
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        self.received.setdefault(chat_id, []).append((time.monotonic(), text))
+
+async def wait_empty(dispatcher):
+    while dispatcher.pending() or dispatcher._inflight:
+        await asyncio.sleep(0.01)
+
+async def broadcast(chats):
+    bot = FakeBot()
+    dispatcher = MessageDispatcher(global_rate=10 ** 9, per_chat_rate=1, per_chat_burst=3)
+    dispatcher.start(bot)
+
+    start = time.perf_counter()
+    dispatcher.broadcast(range(chats), "Annuncio")
+    await wait_empty(dispatcher)
+    elapsed = time.perf_counter() - start
+    assert dispatcher.sent == chats and len(bot.received) == chats
+
+    # Più messaggi per chat del burst: tutte le chat restano in attesa del proprio bucket
+    # (minimo un secondo per il quarto messaggio)
+    await asyncio.sleep(3.1)
+    start = time.perf_counter()
+    for i in range(4):
+        dispatcher.broadcast(range(chats), f"Annuncio {i}")
+    await wait_empty(dispatcher)
+    throttled = time.perf_counter() - start
+    assert dispatcher.sent == 5 * chats
+
+    # Una chat con più messaggi del burst: in ordine e al massimo per_chat_rate al secondo
+    for i in range(5):
+        dispatcher.send(-1, f"messaggio {i}")
+    await wait_empty(dispatcher)
+    times = [t for t, _ in bot.received[-1]]
+    assert [text for _, text in bot.received[-1]] == [f"messaggio {i}" for i in range(5)]
+    # 3 subito (burst), poi uno al secondo
+    assert times[-1] - times[0] >= 2 - 0.05, "limite per chat non rispettato"
+
+    # I bucket delle chat servite e ormai pieni vengono eliminati
+    await asyncio.sleep(3.1)
+    dispatcher._prune_buckets()
+    buckets = len(dispatcher._buckets)
+    await dispatcher.stop()
+    return elapsed, throttled, buckets
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    args = parser.parse_args()
+
+    print(f"{'chat':>8}{'1 messaggio':>13}{'per messaggio':>15}{'4 messaggi':>12}{'bucket rimasti':>16}")
+    for chats in (int(s) for s in args.sizes.split(',')):
+        elapsed, throttled, buckets = asyncio.run(broadcast(chats))
+        print(f"{chats:>8}{elapsed:>12.2f}s{elapsed / chats * 1e6:>13.1f}us{throttled:>11.2f}s{buckets:>16}")
+        assert buckets == 0
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Cambi di filtro nella pagina web: gruppi per (frequenza, tipo) contro la ricostruzione del cluster.
+
+Pubblica lo snapshot come il bot (con i conteggi per gruppo) e lo passa a
+bench/filter_changes.js, che esegue applyFilters della pagina su un cluster
+fittizio. Per ogni passo riporta i marker aggiunti o rimossi dal cluster (il
+lavoro di ricalcolo di Leaflet.markercluster) contro il vecchio filter +
+clearLayers + addLayers; controlla che i marker visibili siano gli
+stessi, che la barra di stato usi i conteggi dello snapshot e che i delta
+aggiornino solo il gruppo interessato. Serve Node.
+
+Uso: python bench/bench_filter_buckets.py [--sizes 10000,100000]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from bench_bot import generate_csv
+from marker_store import read_csv
+from snapshot import SnapshotPublisher
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'filter_changes.js')
+
+def describe(filters):
+    return ', '.join(value for value in (filters['frequency'], filters['node_type']) if value) or 'nessun filtro'
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000')
+    args = parser.parse_args()
+    node = shutil.which('node')
+    if not node:
+        sys.exit("Node non disponibile")
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        directory = tempfile.mkdtemp(prefix='filters-')
+        try:
+            csv_path = os.path.join(directory, 'dati.csv')
+            generate_csv(csv_path, size)
+            SnapshotPublisher(directory).publish(read_csv(csv_path), 1)
+            result = json.loads(subprocess.run(
+                [node, SCRIPT, directory], capture_output=True, text=True, check=True
+            ).stdout)
+        finally:
+            shutil.rmtree(directory)
+
+        print(f"\n{result['markers']} marker in {result['buckets']} gruppi")
+        print(f"  {'filtri':<26}{'visibili':>9}{'marker al cluster':>19}{'prima':>9}")
+        for step in result['steps']:
+            rebuilt = "  (cluster svuotato)" if step['rebuilt'] else ""
+            print(f"  {describe(step['filters']):<26}{step['visible']:>9}{step['touched']:>19}{step['old_touched']:>9}{rebuilt}")
+            assert step['correct'], f"marker visibili errati con {describe(step['filters'])}"
+            assert str(step['visible']) in step['status'], step['status']
+        assert result['delta_ok'], "delta non applicati al gruppo giusto"
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Benchmark dell'indice di ricerca per nome (bot/search.py) contro la scansione lineare.
+
+Genera marker con nomi realistici (località italiane con accenti, nomi ripetuti tra
+utenti), pubblica snapshot e search.json come il bot e misura costruzione e
+dimensione dell'indice e latenza delle query: SearchIndex.search in Python (/find)
+e querySearchIndex della pagina in Node, contro il filter + includes su tutti i
+marker fatto prima a ogni tasto. Controlla che i candidati dell'indice siano
+esattamente i nomi che contengono la query e che pagina e bot diano gli stessi risultati.
+Misura anche l'aggiornamento dell'indice del bot dopo una scrittura e verifica che dia
+gli stessi risultati di un indice ricostruito da zero.
+
+Uso: python bench/bench_search.py [--sizes 10000,100000] [--repeat 20]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+import brotli
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from changelog import marker_key
+from search import MarkerSearchIndex, SearchIndex, SearchIndexPublisher, fold
+from snapshot import SnapshotPublisher
+
+SEARCHER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'search_queries.js')
+
+PREFIXES = ["Monte", "Colle", "Torre", "Passo", "Rifugio", "Cascina", "Ponte", "Villa", "Borgo", "Nodo"]
+PLACES = [
+    "Città Alta", "Forlì", "Cantù", "Sant'Angelo", "Perù", "Cimone", "Brescia", "Sirmione",
+    "Valtrompia", "Gardone", "Lumezzane", "Montichiari", "Salò", "Desenzano", "Iseo", "Darfo",
+    "Pisogne", "Lovere", "Clusone", "Bergamo", "Crema", "Lodi", "Chiari", "Rovato", "Palazzolo",
+]
+QUERIES = ["ci", "sa", "citta", "CITTÀ", "forli", "monte c", "alta 1", "sant'an", "rifugio salo", "zzz"]
+
+def marker_names(count, rnd):
+    """Nomi realistici: prefisso, località e a volte un numero; alcuni ripetuti tra utenti."""
+    names = []
+    for i in range(count):
+        if names and rnd.random() < 0.1:
+            names.append(rnd.choice(names))
+            continue
+        name = f"{rnd.choice(PREFIXES)} {rnd.choice(PLACES)}"
+        if rnd.random() < 0.7:
+            name += f" {rnd.randrange(1, 500)}"
+        names.append(name if rnd.random() < 0.8 else name.upper())
+    return names
+
+def make_markers(count):
+    rnd = random.Random(count)
+    return [
+        {
+            'lat': f"{rnd.uniform(36.6, 47.1):.6f}", 'lon': f"{rnd.uniform(6.6, 18.5):.6f}", 'name': name,
+            'desc': '', 'node_type': 'MeshCore', 'frequency': '868 MHz', 'link': '',
+            'ID': str(100000 + i), 'user': f"user{i}", 'timestamp': str(1700000000 + i),
+        }
+        for i, name in enumerate(marker_names(count, rnd))
+    ]
+
+def median_ms(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - start)
+    return float(np.median(samples)) * 1000, result
+
+def expand(results, limit=10):
+    """Un nome per marker, come i risultati della pagina."""
+    return [name for name, markers in results for _ in markers][:limit]
+
+def normalized(results):
+    """Risultati confrontabili tra indici costruiti in modo diverso (ordine dei marker libero)."""
+    return [(fold(name), sorted(marker_key(m) for m in markers)) for name, markers in results]
+
+def incremental(markers, writes=200):
+    """Aggiornamento con le modifiche di ogni scrittura (bot) contro la ricostruzione completa.
+
+    Applica aggiunte, rinomine ed eliminazioni casuali e verifica che l'indice aggiornato
+    dia gli stessi risultati di uno ricostruito da zero sui marker finali.
+    """
+    rnd = random.Random(len(markers))
+    current = list(markers)
+    live = MarkerSearchIndex(types.SimpleNamespace(all=lambda: list(current)))
+    live.rebuild()
+    names = marker_names(writes, rnd)
+    samples = []
+    for i in range(writes):
+        kind = rnd.choice(('add', 'rename', 'delete'))
+        if kind == 'add':
+            marker = dict(rnd.choice(current), name=names[i], timestamp=str(1800000000 + i))
+            current.append(marker)
+            change = ('add', (marker,), marker)
+        else:
+            marker = current.pop(rnd.randrange(len(current)))
+            if kind == 'rename':
+                current.append(dict(marker, name=names[i]))
+                change = ('rename', (marker['ID'], None, names[i]), marker)
+            else:
+                change = ('delete', (marker['ID'], None), marker)
+        start = time.perf_counter()
+        live.apply([change])
+        samples.append(time.perf_counter() - start)
+
+    rebuilt = SearchIndex(current)
+    for term in QUERIES:
+        assert normalized(live.search(term, 50)) == normalized(rebuilt.search(term, 50)), \
+            f"indice aggiornato e ricostruito danno risultati diversi per {term!r}"
+    return float(np.median(samples)) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    node = shutil.which('node')
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        markers = make_markers(size)
+        build_ms, index = median_ms(lambda: SearchIndex(markers), 3)
+        print(f"\n{size} marker, {len(index)} nomi distinti, {len(index.grams)} n-grammi, costruzione {build_ms:.0f} ms")
+        print(f"aggiornamento dopo una scrittura: {incremental(markers):.3f} ms (invece della costruzione)")
+
+        directory = tempfile.mkdtemp(prefix='search-')
+        try:
+            SnapshotPublisher(directory).publish(markers, 1)
+            SearchIndexPublisher(directory).publish(markers, 1)
+            with open(os.path.join(directory, 'search.json'), 'rb') as f:
+                data = f.read()
+            print(f"search.json: {len(data) / 1024:.0f} KiB, gzip {len(gzip.compress(data, 6)) / 1024:.0f} KiB, "
+                  f"brotli {len(brotli.compress(data, quality=5)) / 1024:.0f} KiB")
+
+            page = {}
+            if node:
+                output = subprocess.run(
+                    [node, SEARCHER, directory, json.dumps(QUERIES), str(args.repeat)],
+                    capture_output=True, text=True, check=True
+                ).stdout
+                page = json.loads(output)
+                print(f"pagina: preparazione dell'indice {page['load_ms']:.1f} ms")
+                page = {q['term']: q for q in page['queries']}
+            else:
+                print("(Node non disponibile: solo le misure in Python)")
+
+            print(f"{'query':<16}{'risultati':>10}{'bot indice':>12}{'bot scan':>10}"
+                  f"{'pagina idx':>12}{'(1a volta)':>11}{'pagina scan':>12}")
+            for term in QUERIES:
+                query = fold(term)
+                index_ms, results = median_ms(lambda: index.search(term), args.repeat)
+                scan_ms, _ = median_ms(lambda: [m for m in markers if term.lower() in m['name'].lower()][:10], args.repeat)
+
+                # I candidati dell'indice devono essere esattamente i nomi che contengono la query
+                expected = {i for i, folded in enumerate(index.folded) if query in folded}
+                assert set(index.candidates(query)) == expected, f"candidati errati per {term!r}"
+
+                line = f"{term:<16}{len(expand(results)):>10}{index_ms:>10.3f}ms{scan_ms:>8.2f}ms"
+                if term in page:
+                    q = page[term]
+                    assert q['results'] == expand(results), f"pagina e bot danno risultati diversi per {term!r}"
+                    line += f"{q['index_ms']:>10.3f}ms{q['cold_ms']:>9.2f}ms{q['scan_ms']:>10.2f}ms"
+                print(line)
+        finally:
+            shutil.rmtree(directory)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Confronto tra i formati dei marker per la pagina web: dati.csv, snapshot.json e snapshot.bin.
+
+Per ogni dimensione pubblica lo snapshot con SnapshotPublisher (come il bot) e
+riporta le dimensioni (grezza, gzip, brotli come servite da http-server) e, se
+Node è disponibile, il tempo di decodifica con le funzioni della pagina
+(bench/decode_formats.js): parseCSV, JSON.parse + snapshotToRows, e per il binario
+la decodifica nel worker, la copia delle stringhe verso la pagina e binaryToRows,
+l'unica parte che resta sul thread principale. Controlla anche che le righe
+ricostruite dal binario coincidano con quelle del JSON.
+
+Uso: python bench/bench_snapshot_formats.py [--sizes 1000,10000,100000] [--repeat 10]
+"""
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import brotli
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from bench_bot import generate_csv
+from marker_store import read_csv
+from snapshot import SnapshotPublisher
+
+DECODER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'decode_formats.js')
+
+def sizes(path):
+    """Dimensioni in KiB: file, variante .gz e .br (precompresse o calcolate come le servirebbe http-server)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    compressed = []
+    for suffix, compress in (('.gz', lambda d: gzip.compress(d, 9)), ('.br', lambda d: brotli.compress(d, quality=11))):
+        if os.path.exists(path + suffix):
+            compressed.append(os.path.getsize(path + suffix))
+        else:
+            compressed.append(len(compress(data)))
+    return [len(data) / 1024] + [size / 1024 for size in compressed]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    node = shutil.which('node')
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        directory = tempfile.mkdtemp(prefix='formats-')
+        try:
+            csv_path = os.path.join(directory, 'dati.csv')
+            generate_csv(csv_path, size)
+            SnapshotPublisher(directory, binary=True).publish(read_csv(csv_path), 1)
+
+            print(f"\n{size} righe{'':<16}{'KiB':>10}{'gzip':>10}{'brotli':>10}")
+            for name in ('dati.csv', 'snapshot.json', 'snapshot.bin'):
+                raw, gz, br = sizes(os.path.join(directory, name))
+                print(f"  {name:<24}{raw:>10.0f}{gz:>10.0f}{br:>10.0f}")
+
+            if not node:
+                print("  (Node non disponibile: nessun tempo di decodifica)")
+                continue
+            timings = json.loads(subprocess.run(
+                [node, DECODER, directory, str(args.repeat)], capture_output=True, text=True, check=True
+            ).stdout)
+            assert timings['mismatches'] == 0, f"{timings['mismatches']} righe diverse tra binario e JSON"
+            assert timings['binary_rows']['rows'] == timings['json']['rows']
+            main_thread = {
+                'CSV (parseCSV)': timings['csv']['ms'],
+                'JSON (parse + righe)': timings['json']['ms'],
+                'binario (copia + righe)': timings['binary_copy']['ms'] + timings['binary_rows']['ms'],
+            }
+            print(f"  decodifica nel worker (binario): {timings['binary_worker']['ms']:.1f} ms")
+            for name, ms in main_thread.items():
+                print(f"  thread principale, {name:<24}{ms:>9.1f} ms")
+        finally:
+            shutil.rmtree(directory)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Benchmark query k-NN e per raggio: scansione lineare vs GridIndex.
+
+Uso: python bench/bench_spatial.py [--points 100000] [--queries 200] [--k 5] [--radius 10]
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from spatial import EARTH_RADIUS_KM, GridIndex
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--points', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--radius', type=float, default=10.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    lats = rng.uniform(36.6, 47.1, args.points)
+    lons = rng.uniform(6.6, 18.5, args.points)
+    queries = list(zip(rng.uniform(36.6, 47.1, args.queries), rng.uniform(6.6, 18.5, args.queries)))
+    points = list(zip(lats.tolist(), lons.tolist()))
+
+    start = time.perf_counter()
+    grid = GridIndex(lats, lons)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # Prima: scansione lineare in Python, come farebbe un controllo su read_markers()
+    linear_queries = queries[:max(1, args.queries // 20)]
+    start = time.perf_counter()
+    for qlat, qlon in linear_queries:
+        sorted((haversine(qlat, qlon, lat, lon), i) for i, (lat, lon) in enumerate(points))[:args.k]
+    knn_linear = (time.perf_counter() - start) / len(linear_queries) * 1000
+
+    start = time.perf_counter()
+    for qlat, qlon in linear_queries:
+        [i for i, (lat, lon) in enumerate(points) if haversine(qlat, qlon, lat, lon) <= args.radius]
+    radius_linear = (time.perf_counter() - start) / len(linear_queries) * 1000
+
+    # Dopo: indice a griglia vettoriale
+    start = time.perf_counter()
+    for qlat, qlon in queries:
+        grid.nearest(qlat, qlon, args.k)
+    knn_grid = (time.perf_counter() - start) / len(queries) * 1000
+
+    start = time.perf_counter()
+    for qlat, qlon in queries:
+        grid.within(qlat, qlon, args.radius)
+    radius_grid = (time.perf_counter() - start) / len(queries) * 1000
+
+    print(f"{args.points} punti, costruzione indice: {build_ms:.1f} ms")
+    print(f"{'query':<24}{'lineare':>12}{'griglia':>12}  (ms/query)")
+    print(f"{'k-NN (k=' + str(args.k) + ')':<24}{knn_linear:>12.2f}{knn_grid:>12.3f}")
+    print(f"{'raggio ' + str(args.radius) + ' km':<24}{radius_linear:>12.2f}{radius_grid:>12.3f}")
+
+if __name__ == '__main__':
+    main()
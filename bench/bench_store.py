@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Benchmark latenza per comando: rilettura CSV (prima) vs MarkerStore (dopo).
+
+Uso: python bench/bench_store.py [--rows 50000] [--repeat 20]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from marker_store import MarkerStore, read_csv, write_csv
+
+NODE_TYPES = ["Mehstastic", "MeshCore", "Altro"]
+FREQUENCIES = ["433 MHz", "868 MHz"]
+
+def generate_markers(rows, users):
+    rnd = random.Random(42)
+    markers = []
+    for i in range(rows):
+        uid = str(100000 + rnd.randrange(users))
+        markers.append({
+            'lat': f"{rnd.uniform(36.6, 47.1):.6f}",
+            'lon': f"{rnd.uniform(6.6, 18.5):.6f}",
+            'name': f"Nodo{i}",
+            'desc': "Marker sintetico",
+            'node_type': rnd.choice(NODE_TYPES),
+            'frequency': rnd.choice(FREQUENCIES),
+            'link': "",
+            'ID': uid,
+            'user': f"user{uid}",
+            'timestamp': str(1700000000 + i),
+        })
+    return markers
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'dati.csv')
+        markers = generate_markers(args.rows, users=max(1, args.rows // 3))
+        write_csv(path, markers)
+        uid = markers[len(markers) // 2]['ID']
+        name = markers[len(markers) // 2]['name']
+
+        # Prima: ogni handler rilegge e riparsa tutto il CSV
+        before = {
+            'add (limite per utente)': lambda: len([m for m in read_csv(path) if m['ID'] == uid]),
+            'add_name (duplicati)': lambda: any(m['name'].lower() == name.lower() for m in read_csv(path) if m['ID'] == uid),
+            'list/rename/delete': lambda: [m for m in read_csv(path) if m['ID'] == uid],
+        }
+
+        # Dopo: lookup sugli indici in memoria
+        store = MarkerStore(path)
+        store.refresh()
+        after = {
+            'add (limite per utente)': lambda: store.count_user(uid),
+            'add_name (duplicati)': lambda: store.has_name(uid, name),
+            'list/rename/delete': lambda: store.by_user(uid),
+        }
+
+        print(f"{args.rows} righe, media su {args.repeat} ripetizioni (ms/comando)")
+        print(f"{'comando':<28}{'prima':>12}{'dopo':>12}")
+        for command in before:
+            t_before = timeit(before[command], args.repeat)
+            t_after = timeit(after[command], args.repeat)
+            print(f"{command:<28}{t_before:>12.3f}{t_after:>12.4f}")
+
+if __name__ == '__main__':
+    main()
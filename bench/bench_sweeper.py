@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Benchmark e verifica della pulizia dei nodi inattivi (bot/sweeper.py).
+
+1. Costo di un controllo: con n marker (timestamp distribuiti su due anni) e k
+   scaduti, misura l'estrazione dall'heap (pop_due + mark_notified) contro la
+   scansione completa dei marker che servirebbe senza indice.
+2. Flusso completo con gli handler reali e un Bot fittizio: richieste di
+   conferma (un messaggio per utente, con i pulsanti), risposte mantieni/rimuovi
+   e rimozione in blocco dei nodi senza risposta, in un'unica scrittura.
+
+Uso: python bench/bench_sweeper.py [--sizes 10000,100000,1000000] [--due 100] [--rows 300]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from bench_bot import FakeUpdates, generate_csv, make_stub_request
+from sweeper import InactivitySweeper
+
+DAY = 86400
+INACTIVE_AFTER = 180 * DAY
+GRACE = 14 * DAY
+
+def make_markers(count):
+    rnd = random.Random(count)
+    start = 1700000000
+    return [
+        {'ID': str(100000 + rnd.randrange(max(1, count // 3))), 'name': f"Nodo{i}",
+         'timestamp': str(start + rnd.randrange(730 * DAY))}
+        for i in range(count)
+    ]
+
+def scaling(sizes, due):
+    print(f"{'marker':>10}{'caricamento':>14}{'controllo (heap)':>18}{'scansione':>12}{'scaduti':>9}")
+    for size in sizes:
+        markers = make_markers(size)
+        directory = tempfile.mkdtemp(prefix='sweeper-')
+        try:
+            sweeper = InactivitySweeper(os.path.join(directory, 'sweeper.db'), INACTIVE_AFTER, GRACE)
+            start = time.perf_counter()
+            sweeper.load(markers, now=1)
+            load_ms = (time.perf_counter() - start) * 1000
+
+            # Istante in cui esattamente `due` marker sono scaduti
+            now = sorted(float(m['timestamp']) for m in markers)[due - 1] + INACTIVE_AFTER
+
+            start = time.perf_counter()
+            notify, remove = sweeper.pop_due(now)
+            sweeper.mark_notified(notify, now)
+            tick_ms = (time.perf_counter() - start) * 1000
+
+            # Senza indice: ogni controllo scorre tutti i marker
+            start = time.perf_counter()
+            overdue = [m for m in markers if float(m['timestamp']) + INACTIVE_AFTER <= now]
+            scan_ms = (time.perf_counter() - start) * 1000
+
+            assert len(notify) == len(overdue) == due and not remove
+            # Prima della fine del periodo di grazia nessuno dei notificati viene rimosso
+            assert sweeper.pop_due(now + GRACE - 1)[1] == []
+            print(f"{size:>10}{load_ms:>12.0f}ms{tick_ms:>16.2f}ms{scan_ms:>10.1f}ms{due:>9}")
+            sweeper.close()
+        finally:
+            shutil.rmtree(directory)
+
+def quota(limit=5):
+    """Il limite sulle richieste di conferma non deve bloccare le rimozioni scadute."""
+    directory = tempfile.mkdtemp(prefix='sweeper-')
+    try:
+        sweeper = InactivitySweeper(os.path.join(directory, 'sweeper.db'), INACTIVE_AFTER, GRACE)
+        markers = make_markers(1000)
+        sweeper.load(markers, now=1)
+        first = sorted(float(m['timestamp']) for m in markers)[99] + INACTIVE_AFTER
+        notify, _ = sweeper.pop_due(first)
+        sweeper.mark_notified(notify, first)
+
+        # A fine grazia sono scaduti i 100 notificati e molti altri ancora da notificare
+        notify, remove = sweeper.pop_due(first + GRACE, limit=limit)
+        assert len(notify) == limit and len(remove) == 100, (len(notify), len(remove))
+        # I marker oltre il limite restano per il controllo successivo
+        again, _ = sweeper.pop_due(first + GRACE, limit=limit)
+        assert len(again) == limit and not {id(m) for m in again} & {id(m) for m in notify}
+        sweeper.close()
+    finally:
+        shutil.rmtree(directory)
+
+async def flow(bot, rows):
+    from telegram.ext import ApplicationBuilder, PicklePersistence, PersistenceInput
+
+    sent = []  # (chat_id, testo, pulsanti)
+
+    class RecordingRequest(make_stub_request()):
+        async def do_request(self, url, method, request_data=None, **timeouts):
+            if url.endswith('/sendMessage'):
+                params = request_data.parameters
+                markup = params.get('reply_markup')
+                markup = json.loads(markup) if isinstance(markup, str) else markup
+                buttons = [b['callback_data'] for row in (markup or {}).get('inline_keyboard', []) for b in row]
+                sent.append((int(params['chat_id']), params['text'], buttons))
+            return await super().do_request(url, method, request_data, **timeouts)
+
+    app = (
+        ApplicationBuilder()
+        .token("123456:SWEEP")
+        .request(RecordingRequest())
+        .updater(None)
+        .persistence(PicklePersistence(
+            bot.CONVERSATIONS_FILE,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False)
+        ))
+        .build()
+    )
+    bot.register_handlers(app)
+    await app.initialize()
+    bot.LOG_ENABLED = False
+    bot.writer.start()
+    bot.dispatcher.start(app.bot)
+    fake = FakeUpdates(app.bot)
+
+    async def drain():
+        while bot.dispatcher.pending():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+
+    # Tutti i marker generati sono più vecchi di INACTIVE_AFTER
+    markers = bot.store.all()
+    bot.sweeper.load(markers)
+    owners = {m['ID'] for m in markers}
+    flushes = []
+    bot.writer.on_flush = lambda seconds, commands: flushes.append(commands)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("errore simulato")
+
+    async def failing(*args, **kwargs):
+        fail()
+
+    # 0. Un errore nelle richieste non deve perdere i marker estratti dall'heap
+    bot.sweeper.mark_notified = fail
+    await bot.sweep_inactive(None)
+    del bot.sweeper.mark_notified
+    assert not sent and bot.sweeper.awaiting() == 0
+
+    # 1. Richieste di conferma: un messaggio per proprietario con tutti i suoi nodi
+    await bot.sweep_inactive(None)
+    await drain()
+    assert len(sent) == len(owners), (len(sent), len(owners))
+    assert sum(len(buttons) for _, _, buttons in sent) == 2 * len(markers) + sum(
+        1 for _, _, buttons in sent if len(buttons) > 2)
+    print(f"Richieste: {len(markers)} nodi di {len(owners)} utenti in {len(sent)} messaggi")
+
+    # 2. Risposte: il primo utente rimuove un nodo, il secondo mantiene tutto, il terzo un nodo
+    (uid1, _, buttons1), (uid2, _, buttons2), (uid3, _, buttons3) = sent[:3]
+    await app.process_update(fake.button(uid1, next(b for b in buttons1 if b.startswith('sweep_remove:'))))
+    await app.process_update(fake.button(uid2, 'sweep_keep_all' if 'sweep_keep_all' in buttons2 else buttons2[0]))
+    await app.process_update(fake.button(uid3, buttons3[0]))
+    # Un utente non può rispondere per i nodi di un altro
+    await app.process_update(fake.button(uid1, buttons2[0]))
+    kept = len(bot.store.by_user(uid2)) + 1
+    assert bot.sweeper.pending(uid2) == []
+    assert len(bot.store.by_user(uid1)) == sum(1 for b in buttons1 if b.startswith('sweep_remove:')) - 1
+
+    # 3. Fine del periodo di grazia: rimozione in blocco di tutti i nodi senza risposta
+    before = len(bot.store.all())
+    expected = sum(len(bot.sweeper.pending(uid)) for uid in owners)
+    flushes.clear()
+    sent.clear()
+    clock = sys.modules['sweeper'].time
+    sys.modules['sweeper'].time = types.SimpleNamespace(time=lambda: clock.time() + GRACE + 1)
+    # Con la scrittura fallita i nodi restano nell'heap e vengono rimossi al controllo successivo
+    delete_many, bot.writer.delete_many = bot.writer.delete_many, failing
+    await bot.sweep_inactive(None)
+    bot.writer.delete_many = delete_many
+    assert len(bot.store.all()) == before and not flushes
+    start = time.perf_counter()
+    await bot.sweep_inactive(None)
+    elapsed = time.perf_counter() - start
+    sys.modules['sweeper'].time = clock
+    await drain()
+    after = len(bot.store.all())
+    print(f"Rimozione: {before - after} nodi in {len(flushes)} scrittura ({elapsed * 1000:.0f} ms), "
+          f"{len(sent)} avvisi, {kept} nodi confermati restano")
+    assert before - after == expected and flushes == [1], (before, after, expected, flushes)
+    assert after == kept
+    assert all(text.startswith(bot.MESSAGES["sweep_removed"]) for _, text, _ in sent)
+
+    await bot.writer.stop()
+    await bot.dispatcher.stop()
+    await app.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--due', type=int, default=100, help="marker scaduti per controllo")
+    parser.add_argument('--rows', type=int, default=300, help="marker nel flusso completo")
+    args = parser.parse_args()
+
+    scaling([int(s) for s in args.sizes.split(',')], args.due)
+    quota()
+
+    directory = tempfile.mkdtemp(prefix='sweeper-flow-')
+    os.makedirs(os.path.join(directory, 'shared'))
+    generate_csv(os.path.join(directory, 'shared', 'dati.csv'), args.rows)
+    os.chdir(directory)
+    try:
+        import bot
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+        asyncio.run(flow(bot, args.rows))
+        print("OK")
+    finally:
+        os.chdir('/')
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
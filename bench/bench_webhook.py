@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Load test del ricevitore webhook con gli handler reali del bot.
+
+Rimanda gli update registrati in bench/fixtures/webhook_updates.json (/start,
+/list, /near con posizione, /help, comando sconosciuto) come farebbe Telegram:
+POST su più connessioni keep-alive con il token segreto, ogni sessione con un
+utente diverso. Le risposte del bot vanno a un Bot fittizio locale, così per ogni
+update si misura sia la conferma HTTP (200) sia la latenza completa fino alla
+risposta all'utente. Controlla anche che token errati e corpi non validi vengano
+rifiutati. Client e server girano nello stesso processo.
+
+Uso: python bench/bench_webhook.py [--updates 20000] [--connections 40] [--latency 0.002]
+"""
+
+import argparse
+import asyncio
+import collections
+import copy
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from bench_bot import generate_csv, make_stub_request
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'webhook_updates.json')
+SECRET = 'bench-webhook-secret'
+PATH = '/webhook'
+
+def sessions(recorded, count):
+    """Copie degli update registrati con utente e update_id diversi per ogni sessione."""
+    update_id = 0
+    for session in range(count):
+        uid = 700000 + session
+        payloads = []
+        for update in recorded:
+            update = copy.deepcopy(update)
+            update_id += 1
+            update['update_id'] = update_id
+            message = update['message']
+            message['from']['id'] = message['chat']['id'] = uid
+            payloads.append(json.dumps(update).encode('utf-8'))
+        yield uid, payloads
+
+async def post(reader, writer, body, secret=SECRET):
+    writer.write(
+        f"POST {PATH} HTTP/1.1\r\nHost: bench\r\nContent-Type: application/json\r\n"
+        f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+    )
+    status_line = await reader.readline()
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+    return int(status_line.split()[1])
+
+async def client(port, queue, sent, acks, statuses):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while not queue.empty():
+            uid, payloads = queue.get_nowait()
+            for k, body in enumerate(payloads):
+                start = time.perf_counter()
+                sent[(uid, k)] = start
+                status = await post(reader, writer, body)
+                acks.append(time.perf_counter() - start)
+                statuses[status] += 1
+    finally:
+        writer.close()
+
+async def run(bot, args):
+    from telegram.ext import ApplicationBuilder, JobQueue, PicklePersistence, PersistenceInput
+    from webhook import WebhookReceiver
+
+    replies = {}                             # (uid, k) -> istante della k-esima risposta all'utente
+    reply_count = collections.Counter()
+
+    class RecordingRequest(make_stub_request()):
+        async def do_request(self, url, method, request_data=None, **timeouts):
+            result = await super().do_request(url, method, request_data, **timeouts)
+            if url.endswith('/sendMessage'):
+                uid = int(request_data.parameters['chat_id'])
+                replies[(uid, reply_count[uid])] = time.perf_counter()
+                reply_count[uid] += 1
+            return result
+
+    app = (
+        ApplicationBuilder()
+        .token("123456:WEBHOOK")
+        .request(RecordingRequest(args.latency))
+        .updater(None)
+        .concurrent_updates(bot.update_processor)
+        .job_queue(JobQueue())
+        .persistence(PicklePersistence(
+            bot.CONVERSATIONS_FILE,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False)
+        ))
+        .build()
+    )
+    bot.register_handlers(app)
+    receiver = WebhookReceiver(
+        app, SECRET, path=PATH, max_backlog=args.max_backlog,
+        backlog=lambda: app.update_queue.qsize() + bot.update_processor.waiting
+    )
+    await app.initialize()
+    await app.start()
+    await receiver.start('127.0.0.1', args.port)
+
+    # Richieste da rifiutare
+    reader, writer = await asyncio.open_connection('127.0.0.1', args.port)
+    assert await post(reader, writer, b'{}', secret='sbagliato') == 403
+    assert await post(reader, writer, b'non json') == 400
+    writer.close()
+
+    recorded = json.load(open(FIXTURE, encoding='utf-8'))
+    queue = asyncio.Queue()
+    for item in sessions(recorded, max(1, args.updates // len(recorded))):
+        queue.put_nowait(item)
+    total = queue.qsize() * len(recorded)
+    sent, acks, statuses = {}, [], collections.Counter()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(args.port, queue, sent, acks, statuses) for _ in range(args.connections)))
+    ack_elapsed = time.perf_counter() - start
+    while len(replies) < total and time.perf_counter() - start < ack_elapsed + 60:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    await receiver.stop()
+    await app.stop()
+    await app.shutdown()
+
+    ack_ms = np.array(acks) * 1000
+    e2e_ms = np.array([replies[key] - sent[key] for key in sent if key in replies]) * 1000
+    print(f"{total} update su {args.connections} connessioni, latenza Bot API {args.latency * 1000:.0f} ms")
+    print(f"Ricezione: {total / ack_elapsed:8.0f} update/s   conferma p50 {np.percentile(ack_ms, 50):6.2f} ms"
+          f"   p99 {np.percentile(ack_ms, 99):6.2f} ms   risposte {dict(statuses)}")
+    print(f"Completi:  {len(e2e_ms) / elapsed:8.0f} update/s   risposta p50 {np.percentile(e2e_ms, 50):6.2f} ms"
+          f"   p99 {np.percentile(e2e_ms, 99):6.2f} ms   picco {bot.update_processor.peak} handler")
+    assert statuses[200] == total, statuses
+    assert len(e2e_ms) == total, f"{total - len(e2e_ms)} update senza risposta"
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=40, help="come max_connections di setWebhook")
+    parser.add_argument('--latency', type=float, default=0.002, help="secondi per ogni chiamata alla Bot API")
+    parser.add_argument('--max-backlog', type=int, default=1024)
+    parser.add_argument('--rows', type=int, default=1000, help="marker già presenti nel CSV")
+    parser.add_argument('--port', type=int, default=8782)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='webhook-')
+    os.makedirs(os.path.join(directory, 'shared'))
+    generate_csv(os.path.join(directory, 'shared', 'dati.csv'), args.rows)
+    os.chdir(directory)
+    try:
+        import bot
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+        asyncio.run(run(bot, args))
+        print("OK")
+    finally:
+        os.chdir('/')
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+// Tempo di decodifica dei formati dei marker in Node, con le stesse funzioni della pagina web:
+// parseCSV (dati.csv), JSON.parse + snapshotToRows (snapshot.json), decodeSnapshot + binaryToRows
+// (snapshot.bin). Usato da bench_snapshot_formats.py, stampa i risultati in JSON.
+//
+// Uso: node bench/decode_formats.js <cartella con dati.csv, snapshot.json, snapshot.bin> [ripetizioni]
+
+const fs = require('fs');
+const path = require('path');
+
+const web = path.join(__dirname, '..', 'web');
+const { decodeSnapshot } = require(path.join(web, 'snapshot-worker.js'));
+const { pageFunctions } = require('./page_functions.js');
+
+const { parseCSV, snapshotToRows, binaryToRows } = pageFunctions(['parseCSV', 'snapshotToRows', 'binaryToRows']);
+
+function measure(fn, repeat, count = result => result.length) {
+  fn(); // riscaldamento del JIT
+  const samples = [];
+  let result;
+  for (let i = 0; i < repeat; i++) {
+    const start = process.hrtime.bigint();
+    result = fn();
+    samples.push(Number(process.hrtime.bigint() - start) / 1e6);
+  }
+  samples.sort((a, b) => a - b);
+  return { ms: samples[Math.floor(samples.length / 2)], rows: count(result) };
+}
+
+const directory = process.argv[2];
+const repeat = parseInt(process.argv[3] || '10', 10);
+const csvText = fs.readFileSync(path.join(directory, 'dati.csv'), 'utf8');
+const jsonText = fs.readFileSync(path.join(directory, 'snapshot.json'), 'utf8');
+const binary = fs.readFileSync(path.join(directory, 'snapshot.bin'));
+
+// Nella pagina il worker riceve un ArrayBuffer da fetch: qui una copia allineata del file
+const buffer = binary.buffer.slice(binary.byteOffset, binary.byteOffset + binary.byteLength);
+
+// Righe del binario diverse da quelle del JSON (coordinate float32 entro 1e-4 gradi)
+function mismatches(binaryRows, jsonRows) {
+  if (binaryRows.length !== jsonRows.length) return Math.abs(binaryRows.length - jsonRows.length);
+  return binaryRows.filter((row, i) => Object.keys(jsonRows[i]).some(field => (
+    field === 'lat' || field === 'lon'
+      ? Math.abs(row[field] - jsonRows[i][field]) > 1e-4
+      : row[field] !== jsonRows[i][field]
+  ))).length;
+}
+
+console.log(JSON.stringify({
+  mismatches: mismatches(binaryToRows(decodeSnapshot(buffer)), snapshotToRows(JSON.parse(jsonText))),
+  csv: measure(() => parseCSV(csvText), repeat),
+  json: measure(() => snapshotToRows(JSON.parse(jsonText)), repeat),
+  binary_worker: measure(() => decodeSnapshot(buffer), repeat, snapshot => snapshot.count),
+  // Le stringhe vengono copiate da postMessage (gli array tipizzati sono trasferiti)
+  binary_copy: (() => {
+    const snapshot = decodeSnapshot(buffer);
+    return measure(() => structuredClone(snapshot.strings), repeat, () => snapshot.count);
+  })(),
+  binary_rows: (() => {
+    const snapshot = decodeSnapshot(buffer);
+    return measure(() => binaryToRows(snapshot), repeat);
+  })(),
+}));
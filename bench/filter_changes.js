@@ -0,0 +1,103 @@
+// Cambi di filtro sulla pagina web con un cluster fittizio che conta i marker aggiunti e rimossi
+// (il lavoro di ricalcolo dei cluster di Leaflet.markercluster; clearLayers azzera soltanto):
+// applyFilters con i gruppi per (frequenza, tipo) contro il vecchio clearLayers + addLayers
+// dei marker filtrati. Usato da bench_filter_buckets.py, stampa i risultati in JSON.
+//
+// Uso: node bench/filter_changes.js <cartella con snapshot.json>
+
+const fs = require('fs');
+const path = require('path');
+const { pageFunctions } = require('./page_functions.js');
+
+const page = pageFunctions(
+  ['snapshotToRows', 'matchesFilters', 'getBucket', 'buildBuckets', 'visibleMarkers', 'visibleCount',
+   'addToBucket', 'removeFromBucket', 'applyFilters'],
+  `
+  const USE_TILES = false;
+  let markerBuckets = new Map();
+  let currentMarkers = [];
+  let activeFilters = { frequency: null, node_type: null };
+  let status = '';
+  function updateStatus(type, text) { status = text; }
+  const markersCluster = {
+    layers: new Set(), touched: 0, clears: 0,
+    addLayer(m) { this.layers.add(m); this.touched++; },
+    removeLayer(m) { this.layers.delete(m); this.touched++; },
+    addLayers(ms) { ms.forEach(m => this.layers.add(m)); this.touched += ms.length; },
+    removeLayers(ms) { ms.forEach(m => this.layers.delete(m)); this.touched += ms.length; },
+    clearLayers() { this.clears++; this.layers.clear(); }
+  };
+  function setState(markers, filters) { currentMarkers = markers; activeFilters = filters; }
+  function getStatus() { return status; }
+  `,
+  ['markersCluster', 'setState', 'getStatus']
+);
+
+// Il vecchio applyFilters: filter su tutti i marker, poi clearLayers + addLayers
+function oldApplyFilters(cluster, markers, filters) {
+  const filtered = markers.filter(m => (
+    (!filters.frequency || m.options.data.frequency === filters.frequency) &&
+    (!filters.node_type || m.options.data.node_type === filters.node_type)
+  ));
+  cluster.clearLayers();
+  cluster.addLayers(filtered);
+  return filtered.length;
+}
+
+const snapshot = JSON.parse(fs.readFileSync(path.join(process.argv[2], 'snapshot.json'), 'utf8'));
+const markers = page.snapshotToRows(snapshot).map(row => ({ options: { data: row } }));
+const frequencies = [...new Set(snapshot.columns.frequency)].sort();
+const types = [...new Set(snapshot.columns.node_type)].sort();
+
+// Sequenza tipica: una frequenza, poi un tipo, si cambia tipo, si toglie la frequenza, reset
+const steps = [
+  { frequency: frequencies[0], node_type: null },
+  { frequency: frequencies[0], node_type: types[0] },
+  { frequency: frequencies[0], node_type: types[1] },
+  { frequency: null, node_type: types[1] },
+  { frequency: null, node_type: null },
+];
+
+const cluster = page.markersCluster;
+let filters = { frequency: null, node_type: null };
+page.setState(markers, filters);
+page.buildBuckets(markers, snapshot.buckets);
+cluster.addLayers(page.visibleMarkers());
+cluster.touched = 0;
+
+const oldCluster = { layers: new Set(markers), touched: 0, clears: 0, addLayers: cluster.addLayers, clearLayers: cluster.clearLayers };
+
+const results = steps.map(step => {
+  filters = { ...step };
+  page.setState(markers, filters);
+  const before = cluster.touched;
+  const clears = cluster.clears;
+  page.applyFilters();
+
+  const oldBefore = oldCluster.touched;
+  const expected = oldApplyFilters(oldCluster, markers, filters);
+
+  const shown = [...cluster.layers];
+  const correct = shown.length === expected && shown.every(m => oldCluster.layers.has(m));
+  return {
+    filters: step, visible: expected, status: page.getStatus(), correct,
+    touched: cluster.touched - before, rebuilt: cluster.clears > clears, old_touched: oldCluster.touched - oldBefore
+  };
+});
+
+// Delta: un marker aggiunto e poi rimosso entra nel cluster solo se il suo gruppo è visibile
+page.setState(markers, { frequency: frequencies[0], node_type: null });
+page.applyFilters();
+const count = page.visibleCount();
+const added = [frequencies[0], frequencies[frequencies.length - 1]].map((frequency, i) => (
+  { options: { data: { ...markers[0].options.data, frequency, name: `Delta ${i}` } } }
+));
+added.forEach(page.addToBucket);
+const deltaOk = cluster.layers.has(added[0]) && (frequencies.length === 1 || !cluster.layers.has(added[1]))
+  && page.visibleCount() === count + (frequencies.length === 1 ? 2 : 1);
+added.forEach(page.removeFromBucket);
+const removedOk = !cluster.layers.has(added[0]) && page.visibleCount() === count;
+
+console.log(JSON.stringify({
+  markers: markers.length, buckets: snapshot.buckets.length, steps: results, delta_ok: deltaOk && removedOk
+}));
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Verifica offline dei poller dei layer esterni contro un server locale con fixture.
+
+Il server serve bench/fixtures/*.json con ETag e Last-Modified e risponde 304
+alle richieste condizionali. Lo script controlla: prima pull completa, pull
+successiva con 304, diff dopo una modifica della fixture (rinomina, rimozione,
+aggiunta) e riavvio senza riscrittura del layer.
+
+Uso: python bench/ingest_offline.py [--serve] [--port 8765]
+  --serve  avvia solo il server stub (per provare il bot con MESHCORE_URL/LORAITALIA_URL)
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from ingest import Ingestor, Source
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FIXTURES = {'/meshcore': 'meshcore_nodes.json', '/loraitalia': 'loraitalia_nodes.geojson'}
+ITALY_BBOX = (35.5, 6.6, 47.1, 18.6)
+
+class StubState:
+    """Contenuti serviti, modificabili durante la verifica."""
+
+    def __init__(self):
+        self.payloads = {}
+        self.requests = []
+        for path, filename in FIXTURES.items():
+            with open(os.path.join(FIXTURES_DIR, filename), encoding='utf-8') as f:
+                self.set(path, json.load(f))
+
+    def set(self, path, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.payloads[path] = (body, '"%s"' % hashlib.sha1(body).hexdigest(), formatdate(usegmt=True))
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in state.payloads:
+                self.send_error(404)
+                return
+            body, etag, modified = state.payloads[self.path]
+            conditional = self.headers.get('If-None-Match') == etag
+            state.requests.append((self.path, 304 if conditional else 200))
+            if conditional:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', modified)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+def start_server(state, port=0):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def make_sources(base_url, directory):
+    return [Source(name, base_url + path, directory, bbox=ITALY_BBOX) for path, name in (('/meshcore', 'meshcore'), ('/loraitalia', 'loraitalia'))]
+
+async def check(state, base_url):
+    directory = tempfile.mkdtemp(prefix='layers-')
+    results = {}
+
+    ingestor = Ingestor(make_sources(base_url, directory))
+    first = await ingestor.poll_all()
+    results['first'] = first
+    assert all(r['status'] == 200 and r['changes'] == r['nodes'] for r in first), first
+    assert first[0]['nodes'] == 40, "i nodi fuori dal riquadro o senza posizione vanno scartati"
+
+    second = await ingestor.poll_all()
+    results['second'] = second
+    assert all(r['status'] == 304 for r in second), second
+
+    # Rinomina un nodo, ne rimuove uno e ne aggiunge uno
+    with open(os.path.join(FIXTURES_DIR, FIXTURES['/meshcore']), encoding='utf-8') as f:
+        nodes = json.load(f)
+    nodes[0]['adv_name'] = 'Rinominato'
+    removed = nodes.pop(1)
+    nodes.append(dict(removed, public_key='ff' * 32, adv_name='Nuovo'))
+    nodes[2]['last_advert'] = '2025-07-01T00:00:00Z'  # solo ultimo contatto: nessuna modifica
+    state.set('/meshcore', nodes)
+    layer = os.path.join(directory, 'loraitalia', 'snapshot.json')
+    mtime = os.stat(layer).st_mtime_ns
+
+    third = await ingestor.poll_all()
+    results['third'] = third
+    assert third[0]['status'] == 200 and third[0]['changes'] == 4, third  # rinomina = rimozione + aggiunta
+    assert third[1]['status'] == 304
+    deltas = os.path.join(directory, 'meshcore', 'deltas')
+    with open(os.path.join(deltas, 'changelog.json'), encoding='utf-8') as f:
+        version = json.load(f)['version']
+    # Catena dei delta dalla versione 1, come la scaricherebbe un client
+    results['delta_ops'] = []
+    for v in range(2, version + 1):
+        with open(os.path.join(deltas, f'v-{v}.json'), encoding='utf-8') as f:
+            results['delta_ops'] += [op['op'] for op in json.load(f)['ops']]
+    await ingestor.close()
+
+    # Riavvio: la prima pull è completa ma il diff con il layer pubblicato è vuoto
+    restarted = Ingestor(make_sources(base_url, directory))
+    fourth = await restarted.poll_all()
+    results['restart'] = fourth
+    assert all(r['status'] == 200 and r['changes'] == 0 for r in fourth), fourth
+    assert os.stat(layer).st_mtime_ns == mtime, "layer riscritto senza modifiche"
+    await restarted.close()
+
+    results['requests'] = len(state.requests)
+    results['directory'] = directory
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--serve', action='store_true')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    state = StubState()
+    if args.serve:
+        server = start_server(state, args.port)
+        print(f"Stub in ascolto su http://127.0.0.1:{args.port} ({', '.join(FIXTURES)})")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    server = start_server(state)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        results = asyncio.run(check(state, base_url))
+    finally:
+        server.shutdown()
+    print(json.dumps(results, indent=2))
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+// Estrae funzioni da web/pagina.js (che dipende da Leaflet e dal DOM) per usarle in Node
+// nei benchmark. Le funzioni estratte condividono lo stesso scope, così possono chiamarsi
+// tra loro; prelude definisce le variabili globali che usano (preludeNames vengono restituite
+// insieme alle funzioni).
+
+const fs = require('fs');
+const path = require('path');
+
+const page = fs.readFileSync(path.join(__dirname, '..', 'web', 'pagina.js'), 'utf8');
+
+function functionSource(name) {
+  const start = page.search(new RegExp(`(async )?function ${name}\\(`));
+  if (start === -1) throw new Error(`Funzione ${name} non trovata`);
+  let depth = 0;
+  for (let i = page.indexOf('{', start); i < page.length; i++) {
+    if (page[i] === '{') depth++;
+    else if (page[i] === '}' && --depth === 0) return page.slice(start, i + 1);
+  }
+  throw new Error(`Funzione ${name} incompleta`);
+}
+
+function pageFunctions(names, prelude = '', preludeNames = []) {
+  const exported = names.concat(preludeNames).join(', ');
+  const body = `${prelude}\n${names.map(functionSource).join('\n')}\nreturn { ${exported} };`;
+  return new Function(body)();
+}
+
+module.exports = { pageFunctions };
@@ -0,0 +1,58 @@
+// Ricerca per nome in Node con le funzioni della pagina web: indice di n-grammi (search.json)
+// contro la scansione lineare dei marker fatta prima a ogni tasto. Usato da bench_search.py,
+// stampa in JSON risultati e tempi per ogni query.
+//
+// Uso: node bench/search_queries.js <cartella con search.json e snapshot.json> <query in JSON> [ripetizioni]
+
+const fs = require('fs');
+const path = require('path');
+const { pageFunctions } = require('./page_functions.js');
+
+const { fold, querySearchIndex, snapshotToRows } = pageFunctions(
+  ['fold', 'compareResults', 'resultKind', 'intersectSorted', 'gramPostings', 'foldedName',
+   'searchCandidates', 'querySearchIndex', 'snapshotToRows'],
+  'const SEARCH_RESULTS = 10;'
+);
+
+function median(fn, repeat) {
+  const samples = [];
+  let result;
+  for (let i = 0; i < repeat; i++) {
+    const start = process.hrtime.bigint();
+    result = fn();
+    samples.push(Number(process.hrtime.bigint() - start) / 1e6);
+  }
+  samples.sort((a, b) => a - b);
+  return { ms: samples[Math.floor(samples.length / 2)], result };
+}
+
+const [directory, queriesJson, repeatArg] = process.argv.slice(2);
+const repeat = parseInt(repeatArg || '20', 10);
+const data = JSON.parse(fs.readFileSync(path.join(directory, 'search.json'), 'utf8'));
+const rows = snapshotToRows(JSON.parse(fs.readFileSync(path.join(directory, 'snapshot.json'), 'utf8')));
+
+// Stessa struttura di loadSearchIndex() in pagina.js
+const loadStart = process.hrtime.bigint();
+const index = {
+  n: data.n, names: data.names, folded: new Array(data.names.length),
+  points: data.points, grams: data.grams, decoded: new Map()
+};
+const loadMs = Number(process.hrtime.bigint() - loadStart) / 1e6;
+
+const queries = JSON.parse(queriesJson).map(term => {
+  const query = fold(term);
+  // Prima ricerca: include la decodifica delle liste degli n-grammi usate
+  const coldStart = process.hrtime.bigint();
+  querySearchIndex(index, query);
+  const coldMs = Number(process.hrtime.bigint() - coldStart) / 1e6;
+  const indexed = median(() => querySearchIndex(index, query), repeat);
+  // Il vecchio handleSearch: filter + toLowerCase + includes su tutti i marker
+  const lower = term.toLowerCase().trim();
+  const scan = median(() => rows.filter(m => m.name && m.name.toLowerCase().includes(lower)).slice(0, 10), repeat);
+  return {
+    term, cold_ms: coldMs, index_ms: indexed.ms, scan_ms: scan.ms,
+    results: indexed.result.map(r => r.name), scan_results: scan.result.length
+  };
+});
+
+console.log(JSON.stringify({ load_ms: loadMs, queries }));
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Stress test dell'esecuzione concorrente degli update.
+
+Ogni utente invia il flusso /add completo seguito da /rename; gli update di tutti
+gli utenti vengono messi in coda insieme, mescolati ma in ordine per utente (come
+messaggi ravvicinati dopo una pausa del polling), e passano per l'Application con
+un Bot fittizio che simula la latenza di rete. Controlla che ogni utente abbia
+esattamente il suo marker con le sue coordinate e il nuovo nome, che nessuna
+sessione resti in user_data e che il limite di handler contemporanei sia rispettato.
+
+Lo stesso carico viene eseguito prima con concurrent_updates(True) di
+python-telegram-bot (esecuzione concorrente senza ordine per utente), solo per
+confronto: lì gli update dello stesso utente si intrecciano.
+
+Uso: python bench/stress_updates.py [--users 500] [--latency 0.002]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from bench_bot import FakeUpdates, generate_csv, make_stub_request
+
+def user_steps(fake, uid, i):
+    """Update di un utente, nell'ordine in cui li invia."""
+    return [
+        lambda: fake.message(uid, '/add'),
+        lambda: fake.message(uid, f"{40 + i * 0.001:.4f}"),
+        lambda: fake.message(uid, f"{10 + i * 0.001:.4f}"),
+        lambda: fake.message(uid, f"S{i}"),
+        lambda: fake.message(uid, 'MeshCore'),
+        lambda: fake.message(uid, '868 MHz'),
+        lambda: fake.message(uid, f"Stress {i}"),
+        lambda: fake.message(uid, 'No'),
+        lambda: fake.message(uid, '/rename'),
+        lambda: fake.message(uid, '1'),
+        lambda: fake.message(uid, f"R{i}"),
+    ]
+
+def interleave(sequences, rnd):
+    """Mescola le sequenze mantenendo l'ordine all'interno di ciascuna."""
+    pending = [list(reversed(seq)) for seq in sequences]
+    merged = []
+    while pending:
+        k = rnd.randrange(len(pending))
+        merged.append(pending[k].pop())
+        if not pending[k]:
+            pending[k] = pending[-1]
+            pending.pop()
+    return merged
+
+def check(bot, uids):
+    """Utenti con marker mancanti, duplicati o con i dati di un altro update, e sessioni rimaste."""
+    wrong = 0
+    for i, uid in enumerate(uids):
+        markers = bot.store.by_user(str(uid))
+        ok = (
+            len(markers) == 1
+            and markers[0]['name'] == f"R{i}"
+            and abs(float(markers[0]['lat']) - (40 + i * 0.001)) < 1e-6
+            and abs(float(markers[0]['lon']) - (10 + i * 0.001)) < 1e-6
+            and markers[0]['desc'] == f"Stress {i}"
+        )
+        wrong += not ok
+    sessions = sum(1 for uid in uids if str(uid) in bot.user_data)
+    return wrong, sessions
+
+async def run(bot, processor, uids, latency, seed):
+    from telegram.ext import ApplicationBuilder, JobQueue, PicklePersistence, PersistenceInput
+
+    StubRequest = make_stub_request()
+    app = (
+        ApplicationBuilder()
+        .token("123456:STRESS")
+        .request(StubRequest(latency))
+        .get_updates_request(StubRequest())
+        .concurrent_updates(processor)
+        .job_queue(JobQueue())
+        .persistence(PicklePersistence(
+            f"stress-{seed}.pickle",
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False)
+        ))
+        .build()
+    )
+    bot.register_handlers(app)
+    fake = FakeUpdates(app.bot)
+    await app.initialize()
+    await app.start()
+
+    steps = interleave([user_steps(fake, uid, i) for i, uid in enumerate(uids)], random.Random(seed))
+    errors = sum(count for count in bot.handler_errors.values().values())
+    start = time.perf_counter()
+    for step in steps:
+        app.update_queue.put_nowait(step())
+    while processor.processed < len(steps):
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    await app.stop()
+    await app.shutdown()
+    errors = sum(count for count in bot.handler_errors.values().values()) - errors
+    return len(steps), elapsed, errors
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.002, help="secondi per ogni chiamata alla Bot API")
+    parser.add_argument('--rows', type=int, default=1000, help="marker già presenti nel CSV")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='stress-')
+    os.makedirs(os.path.join(directory, 'shared'))
+    generate_csv(os.path.join(directory, 'shared', 'dati.csv'), args.rows)
+    os.chdir(directory)
+    try:
+        import bot
+        import logging
+        from telegram.ext import SimpleUpdateProcessor
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+        class CountingProcessor(SimpleUpdateProcessor):
+            """Esecuzione concorrente di python-telegram-bot, con il conteggio degli update gestiti."""
+            processed = 0
+
+            async def do_process_update(self, update, coroutine):
+                try:
+                    await super().do_process_update(update, coroutine)
+                finally:
+                    self.processed += 1
+
+        async def scenarios():
+            bot.LOG_ENABLED = False  # nessun log agli admin durante il test
+            bot.writer.start()
+            print(f"{args.users} utenti, {args.users * 11} update, latenza Bot API {args.latency * 1000:.0f} ms")
+
+            before = [800000 + i for i in range(args.users)]
+            count, elapsed, errors = await run(bot, CountingProcessor(256), before, args.latency, 1)
+            wrong, sessions = check(bot, before)
+            print(f"concurrent_updates(True): {count / elapsed:7.0f} update/s, {wrong} utenti con marker errati, "
+                  f"{sessions} sessioni rimaste, {errors} eccezioni negli handler")
+
+            after = [900000 + i for i in range(args.users)]
+            processor = bot.update_processor
+            count, elapsed, errors = await run(bot, processor, after, args.latency, 2)
+            wrong, sessions = check(bot, after)
+            print(f"UserUpdateProcessor:      {count / elapsed:7.0f} update/s, {wrong} utenti con marker errati, "
+                  f"{sessions} sessioni rimaste, {errors} eccezioni negli handler, "
+                  f"picco {processor.peak}/{processor.max_in_flight} handler")
+            assert wrong == 0, f"{wrong} utenti con marker mancanti o corrotti"
+            assert sessions == 0, f"{sessions} sessioni non chiuse"
+            assert errors == 0, f"{errors} eccezioni negli handler"
+            assert processor.peak <= processor.max_in_flight
+            assert processor.waiting == 0 and processor.in_flight == 0
+
+            await bot.writer.stop()
+
+        asyncio.run(scenarios())
+        print("OK")
+    finally:
+        os.chdir('/')
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
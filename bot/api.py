@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import gzip
+import hashlib
+import json
+import logging
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from changelog import delta_row, marker_key
+from export import filter_markers, parse_date
+
+MAX_HEADERS = 100
+MAX_LINE = 8192
+GZIP_MIN_SIZE = 1024  # byte, sotto questa soglia la risposta non viene compressa
+
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+class _Response:
+    """Risposta serializzata una sola volta, con ETag e variante gzip precalcolati."""
+
+    __slots__ = ('status', 'body', 'gzip', 'etag')
+
+    def __init__(self, payload, status=200):
+        self.status = status
+        self.body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.gzip = gzip.compress(self.body, compresslevel=6, mtime=0) if len(self.body) >= GZIP_MIN_SIZE else None
+        self.etag = '"%s"' % hashlib.sha1(self.body).hexdigest()[:20]
+
+def parse_query(query):
+    """Filtri di /api/markers: bbox=lat1,lon1,lat2,lon2, type, freq, since (timestamp o AAAA-MM-GG).
+
+    Restituisce un dizionario ordinabile per la chiave della cache; solleva
+    ValueError con un messaggio leggibile.
+    """
+    filters = {}
+    for key, values in parse_qs(query, keep_blank_values=False).items():
+        value = values[-1]
+        if key in ('type', 'node_type'):
+            filters['node_type'] = value
+        elif key in ('freq', 'frequency'):
+            filters['frequency'] = value
+        elif key == 'bbox':
+            try:
+                lat1, lon1, lat2, lon2 = (float(v) for v in value.split(','))
+            except ValueError:
+                raise ValueError("bbox deve essere lat1,lon1,lat2,lon2")
+            filters['bbox'] = (min(lat1, lat2), min(lon1, lon2), max(lat1, lat2), max(lon1, lon2))
+        elif key == 'since':
+            try:
+                filters['since'] = int(value) if value.isdigit() else parse_date(value)
+            except ValueError:
+                raise ValueError("since deve essere un timestamp o una data AAAA-MM-GG")
+        else:
+            raise ValueError(f"Parametro non riconosciuto: {key}")
+    return filters
+
+def _accepts_gzip(value):
+    for part in value.split(','):
+        name, _, params = part.partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+class MarkerAPI:
+    """API HTTP in sola lettura sui marker, nello stesso processo del bot.
+
+    Endpoint: /api/markers (filtri bbox, type, freq, since), /api/markers/<chiave>
+    con la chiave ID|timestamp|nome dei delta, e /api/stats. Le risposte vengono
+    serializzate una volta in un thread, tenute in una cache LRU e invalidate a
+    ogni scrittura dei marker; richieste concorrenti per la stessa risposta
+    attendono la stessa serializzazione. Supporta ETag (304), gzip e keep-alive.
+    """
+
+    def __init__(self, store, stats=None, cache_size=256, keepalive_timeout=15):
+        self.store = store
+        self.stats = stats
+        self.cache_size = cache_size
+        self.keepalive_timeout = keepalive_timeout
+        self.version = 0
+        self._cache = collections.OrderedDict()  # chiave richiesta -> _Response
+        self._pending = {}                       # chiave richiesta -> future della serializzazione
+        self._by_key = None                      # chiave marker -> marker, ricostruito dopo ogni modifica
+        self._server = None
+        self._connections = set()
+        self.requests = 0
+
+    def invalidate(self):
+        """Scarta le risposte in cache dopo una modifica dei marker."""
+        self.version += 1
+        self._cache.clear()
+        self._pending.clear()
+        self._by_key = None
+
+    # -------------- RISPOSTE --------------
+
+    def _markers(self, filters):
+        bbox = filters.get('bbox')
+        markers = self.store.in_bbox(*bbox) if bbox else self.store.all()
+        rows = []
+        for marker in filter_markers(markers, **{k: v for k, v in filters.items() if k != 'bbox'}):
+            try:
+                rows.append(delta_row(marker))
+            except (KeyError, ValueError):
+                continue
+        return _Response({'count': len(rows), 'markers': rows})
+
+    def _marker(self, key):
+        by_key, version = self._by_key, self.version
+        if by_key is None:
+            by_key = {marker_key(m): m for m in self.store.all()}
+            if version == self.version:
+                self._by_key = by_key
+        marker = by_key.get(key)
+        if marker is None:
+            return _Response({'error': "Marker non trovato"}, status=404)
+        return _Response(delta_row(marker))
+
+    def _stats(self):
+        if self.stats is None:
+            return _Response({'error': "Statistiche non disponibili"}, status=404)
+        return _Response(self.stats.summary())
+
+    async def _build(self, cache_key, build, *args):
+        version = self.version
+        response = await asyncio.to_thread(build, *args)
+        # Una risposta calcolata prima di un'invalidazione non entra in cache
+        if version == self.version:
+            self._cache[cache_key] = response
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return response
+
+    async def _cached(self, cache_key, build, *args):
+        response = self._cache.get(cache_key)
+        if response is not None:
+            self._cache.move_to_end(cache_key)
+            return response
+        future = self._pending.get(cache_key)
+        if future is None:
+            future = asyncio.ensure_future(self._build(cache_key, build, *args))
+            self._pending[cache_key] = future
+            future.add_done_callback(lambda f: self._pending.pop(cache_key, None) if self._pending.get(cache_key) is f else None)
+        return await asyncio.shield(future)
+
+    async def resolve(self, method, target):
+        """Risposta (_Response) per una richiesta, senza I/O di rete."""
+        if method not in ('GET', 'HEAD'):
+            return _Response({'error': "Metodo non consentito"}, status=405)
+        url = urlsplit(target)
+        path = url.path.rstrip('/')
+        if path == '/api/markers':
+            try:
+                filters = parse_query(url.query)
+            except ValueError as e:
+                return _Response({'error': str(e)}, status=400)
+            return await self._cached(('markers', tuple(sorted(filters.items()))), self._markers, filters)
+        if path.startswith('/api/markers/'):
+            key = unquote(path[len('/api/markers/'):])
+            return await self._cached(('marker', key), self._marker, key)
+        if path == '/api/stats':
+            return await self._cached(('stats',), self._stats)
+        return _Response({'error': "Endpoint non trovato"}, status=404)
+
+    # -------------- HTTP --------------
+
+    def _head(self, status, headers):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _respond(self, method, target, request_headers):
+        response = await self.resolve(method, target)
+        headers = {
+            'Content-Type': 'application/json; charset=utf-8',
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*',
+            'Vary': 'Accept-Encoding',
+            'ETag': response.etag,
+        }
+        if response.status == 200:
+            candidates = [tag.strip().removeprefix('W/') for tag in request_headers.get('if-none-match', '').split(',')]
+            if response.etag in candidates or '*' in candidates:
+                headers['Content-Length'] = '0'
+                return self._head(304, headers)
+        body = response.body
+        if response.gzip is not None and _accepts_gzip(request_headers.get('accept-encoding', '')):
+            body = response.gzip
+            headers['Content-Encoding'] = 'gzip'
+        headers['Content-Length'] = str(len(body))
+        return self._head(response.status, headers) + (b'' if method == 'HEAD' else body)
+
+    async def _handle(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.keepalive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    writer.write(self._head(400, {'Content-Length': '0', 'Connection': 'close'}))
+                    break
+                headers = {}
+                for _ in range(MAX_HEADERS):
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                self.requests += 1
+                writer.write(await self._respond(method, target, headers))
+                await writer.drain()
+                # Le richieste con corpo non sono supportate: la connessione viene chiusa
+                keep_alive = (
+                    version == 'HTTP/1.1'
+                    and headers.get('connection', '').lower() != 'close'
+                    and 'content-length' not in headers
+                    and 'transfer-encoding' not in headers
+                )
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except Exception as e:
+            logging.error(f"Errore API: {e}")
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_LINE)
+        logging.info(f"API marker in ascolto su {host}:{port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # Chiude anche le connessioni keep-alive inattive
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
@@ -1,17 +1,41 @@
 # -*- coding: utf-8 -*-
 
-import csv
 import re
 import os
-import tempfile
-import shutil
+import asyncio
 import logging
+import io
 import json
+import secrets
+import signal
 import time
 import traceback
+from urllib.parse import urlsplit
 from telegram.constants import ParseMode
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove, Update, ReplyKeyboardMarkup
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters, ConversationHandler, JobQueue
+from telegram.ext import PicklePersistence, PersistenceInput
+
+from storage import open_store
+from writer import MarkerWriter
+from snapshot import SnapshotPublisher
+from changelog import ChangeLog
+from tiles import TileBuilder
+from coverage import CoverageBuilder
+from api import MarkerAPI
+from metrics import Metrics, instrument_handlers, instrument_methods
+from spatial import MarkerSpatialIndex
+from search import MarkerSearchIndex, SearchIndexPublisher
+from dispatcher import MessageDispatcher
+from scheduler import UserUpdateProcessor
+from webhook import WebhookReceiver
+from subscriptions import SubscriptionStore
+from sweeper import InactivitySweeper
+from sessions import SessionStore
+from stats import MarkerStats
+from export import export_markers, parse_export_args
+from importer import load_document, validate as validate_import, report_csv
+from ingest import Ingestor, Source
 
 ############################################
 #                                          #
@@ -23,6 +47,70 @@ from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandle
 FILE = "shared/dati.csv"
 ENCODING = "utf-8"
 LOG_STATE_FILE = "log_state.json"
+SESSIONS_FILE = "sessions.pickle"  # dati delle conversazioni in corso, ripristinati al riavvio
+CONVERSATIONS_FILE = "conversations.pickle"  # stato dei ConversationHandler
+
+# Backend dei marker: "csv" (solo dati.csv) oppure "sqlite" (database con indici,
+# dati.csv viene rigenerato per il frontend web)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "csv")
+DB_FILE = "markers.db"
+SUBSCRIPTIONS_DB_FILE = "subscriptions.db"  # iscrizioni alle notifiche dei nuovi nodi in una zona
+SWEEPER_DB_FILE = "sweeper.db"  # conferme dei nodi e richieste inviate ai proprietari
+
+# Snapshot colonnare dei marker letto dalla pagina web (shared/snapshot.json e snapshot.bin)
+# e feed incrementale delle modifiche (shared/deltas/v-<versione>.json)
+SNAPSHOT_DIR = "shared"
+DELTA_MAX_CHAIN = 50  # versioni coperte dai delta, oltre si ricarica lo snapshot
+TILE_DETAIL_ZOOM = 10  # tile z/x/y (shared/tiles): cluster sotto questo zoom, marker singoli da qui in su
+STATS_FILE = "shared/stats.json"  # statistiche aggregate per la pagina web (nodi aggiunti oggi)
+COVERAGE_ZOOMS = range(6, 11)  # livelli delle tile PNG di copertura stimata (shared/coverage)
+COVERAGE_ANTENNA_HEIGHT = 10  # metri, altezza dell'antenna usata per la stima
+
+# Layer delle reti esterne (shared/layers/<sorgente>), stesso formato dello snapshot dei marker.
+# Una sorgente è attiva solo se il suo URL è impostato.
+LAYERS_DIR = "shared/layers"
+LAYER_SOURCES = {
+    "loraitalia": os.getenv("LORAITALIA_URL", ""),
+    "meshcore": os.getenv("MESHCORE_URL", ""),
+}
+# API HTTP in sola lettura sui marker (/api/markers, /api/stats), disattivata se API_PORT è vuoto
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT") or 0)
+
+# Metriche in formato Prometheus su http://METRICS_HOST:METRICS_PORT/metrics (solo in locale
+# di default), anche nel menu admin. METRICS_PORT vuoto disattiva l'endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108") or 0)
+
+# Modalità webhook: con WEBHOOK_URL impostato (URL pubblico https, inoltrato a
+# WEBHOOK_HOST:WEBHOOK_PORT) gli update arrivano al ricevitore locale invece del long polling.
+# Senza WEBHOOK_SECRET il token segreto viene generato a ogni avvio (setWebhook viene ripetuto)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT") or 8443)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_MAX_CONNECTIONS = 40  # connessioni parallele di Telegram verso il webhook
+
+INGEST_INTERVAL = 600  # secondi tra due aggiornamenti dei layer
+INGEST_BBOX = (35.5, 6.6, 47.1, 18.6)  # lat/lon min e max: solo i nodi in Italia
+
+# Scrittura marker: le aggiunte vengono accodate al CSV, rinomine ed eliminazioni
+# vanno nel journal e vengono compattate periodicamente in un nuovo snapshot
+# (con il backend sqlite la compattazione riesporta dati.csv)
+APPEND_ONLY = True
+COMPACTION_INTERVAL = 30  # secondi, come l'aggiornamento automatico della mappa
+WRITE_FLUSH_WINDOW = 0.05  # secondi in cui le modifiche concorrenti vengono raggruppate
+
+# Nodi inattivi: senza conferme per INACTIVE_AFTER il proprietario riceve una richiesta
+# con i pulsanti mantieni/rimuovi; senza risposta entro SWEEP_GRACE il nodo viene rimosso
+INACTIVE_AFTER = 180 * 24 * 3600  # secondi dall'ultima conferma (o dalla creazione)
+SWEEP_GRACE = 14 * 24 * 3600  # secondi per rispondere alla richiesta
+SWEEP_INTERVAL = 3600  # secondi tra due controlli
+SWEEP_MAX_NOTIFICATIONS = 500  # marker notificati per controllo, i restanti al successivo
+
+# Esecuzione degli update: in ordine per ogni utente, utenti diversi in parallelo
+MAX_CONCURRENT_HANDLERS = 32  # handler in esecuzione contemporaneamente
+MAX_PENDING_UPDATES = 1024  # update accettati in attesa del proprio turno
 
 # Limiti di input
 MAX_NAME_LENGTH = 14
@@ -30,6 +118,17 @@ MAX_DESC_LENGTH = 50
 MAX_LINK_LENGTH = 40
 MAX_MARKERS_PER_USER = 3
 MAX_MARKERS_FOR_SPECIAL_USERS = 6
+NEAR_RESULTS = 5  # nodi restituiti da /near
+FIND_RESULTS = 10  # nodi restituiti da /find
+MAX_SUBSCRIPTIONS_PER_USER = 3
+MAX_IMPORT_FILE_SIZE = 5 * 1024 * 1024  # byte, per /import
+IMPORT_REPORT_PREVIEW = 10  # errori mostrati nel messaggio, il report completo è allegato
+MAX_SUBSCRIPTION_RADIUS_KM = 200
+
+# Invio messaggi in uscita (limiti Telegram: ~30 messaggi/s globali, 1/s per chat)
+OUTBOUND_GLOBAL_RATE = 25
+OUTBOUND_PER_CHAT_RATE = 1
+LOG_DIGEST_WINDOW = 3  # secondi in cui i log agli admin vengono raggruppati in un solo messaggio
 
 # Timeout conversazioni
 TIMEOUT_SECONDS = 300  # 5 minuti
@@ -49,7 +148,11 @@ MESSAGES = {
              "➕ Aggiungi marker (massimo 3) - /add\n"
              "✏️ Rinomina marker - /rename\n"
              "🗑️ Elimina marker - /delete\n"
-             "📍 Lista marker - /list",
+             "📍 Lista marker - /list\n"
+             "📡 Nodi vicini a te - /near\n"
+             "🔎 Cerca un nodo per nome - /find nome\n"
+             "🔔 Avvisi nuovi nodi in una zona - /subscribe\n"
+             "🔕 Disattiva avvisi - /unsubscribe",
     "unknown_command": "Comando non riconosciuto. Usa /help per la lista dei comandi",
     "operation_in_progress": "Hai già un'operazione in corso. Completa prima quella",
     "max_markers_reached": f"Hai già {MAX_MARKERS_PER_USER} marker. Elimina uno per aggiungerne un altro",
@@ -86,15 +189,45 @@ MESSAGES = {
     "error_value": "❌ Valore non valido",
     "error_select": "❌ Errore nella selezione",
     "timed_out": "⏳ Sessione scaduta per inattività. Usa /start per ricominciare.",
-    "cancelled": "❌ Operazione annullata"
+    "cancelled": "❌ Operazione annullata",
+    "near_location": "📍 Invia la tua posizione oppure scrivi le coordinate (lat, lon):",
+    "near_results": "📡 Nodi più vicini:\n\n",
+    "no_nodes_near": "Nessun nodo presente sulla mappa",
+    "find_usage": "🔎 Scrivi il nome da cercare dopo il comando, es. /find Monte Cimone",
+    "find_results": "🔎 Nodi trovati:\n\n",
+    "find_no_results": "Nessun nodo trovato con questo nome",
+    "subscribe_area": "📍 Invia il centro della zona (posizione oppure lat, lon) "
+                      "o scrivi un riquadro come lat1, lon1, lat2, lon2:",
+    "subscribe_radius": f"📏 Inserisci il raggio in km (max {MAX_SUBSCRIPTION_RADIUS_KM}):",
+    "subscribed": "🔔 Iscrizione salvata! Riceverai un messaggio quando verrà aggiunto un nodo nella zona",
+    "max_subscriptions_reached": f"Hai già {MAX_SUBSCRIPTIONS_PER_USER} zone. Usa /unsubscribe per eliminarne una",
+    "no_subscriptions": "Non hai zone attive",
+    "unsubscribe_select": "Quale zona vuoi eliminare?\n\n",
+    "unsubscribed": "🔕 Iscrizione eliminata",
+    "new_node_nearby": "🔔 Nuovo nodo nella tua zona!\n\n",
+    "sweep_confirm": f"⏳ Questi nodi non sono stati confermati negli ultimi {INACTIVE_AFTER // 86400} giorni. "
+                     "Sono ancora attivi?\n\n",
+    "sweep_confirm_footer": f"\nSenza risposta entro {SWEEP_GRACE // 86400} giorni verranno rimossi dalla mappa",
+    "sweep_removed": "🗑️ Questi nodi sono stati rimossi dalla mappa perché non confermati:\n\n",
+    "sweep_kept": "✅ Nodo confermato",
+    "sweep_deleted": "🗑️ Nodo eliminato",
+    "sweep_done": "✅ Grazie! Tutte le richieste di conferma hanno una risposta",
+    "sweep_expired": "Richiesta non più valida",
+    "import_file": "📥 Invia il file CSV o GeoJSON con i nodi da importare.\n\n"
+                   "Colonne: lat, lon, name, desc, node_type, frequency, link, ID, user "
+                   "(senza ID i nodi vengono assegnati a te)",
+    "import_invalid_file": "❌ File non leggibile. Invia un CSV o un GeoJSON valido",
+    "import_too_large": f"❌ File troppo grande. Massimo {MAX_IMPORT_FILE_SIZE // (1024 * 1024)} MB"
 }
 
 # Stati del ConversationHandler
 (
     ADD_LAT, ADD_LON, ADD_NAME, ADD_DESC, ADD_LINK_ASK, 
     ADD_LINK, RENAME_SELECT, RENAME_NEW_NAME, DELETE_SELECT, 
-    SELECT_NODE_TYPE, SELECT_FREQUENCY, ENTER_DESCRIPTION
-) = range(12)
+    SELECT_NODE_TYPE, SELECT_FREQUENCY, ENTER_DESCRIPTION,
+    NEAR_LOCATION, SUBSCRIBE_AREA, SUBSCRIBE_RADIUS,
+    UNSUBSCRIBE_SELECT, IMPORT_FILE
+) = range(17)
 
 def load_log_state():
     try:
@@ -115,6 +248,33 @@ LOG_ENABLED = load_log_state()
 #                                              #
 ################################################
 
+# Metriche dei percorsi critici del bot
+metrics = Metrics()
+handler_seconds = metrics.histogram('handler_seconds', "Durata degli handler Telegram", labels=('handler',))
+handler_errors = metrics.counter('handler_errors_total', "Eccezioni negli handler Telegram", labels=('handler',))
+marker_read_seconds = metrics.histogram('marker_read_seconds', "Durata delle letture dallo store dei marker", labels=('method',))
+marker_write_seconds = metrics.histogram('marker_write_seconds', "Durata delle scritture dei marker (un batch del writer)")
+marker_write_commands = metrics.counter('marker_write_commands_total', "Modifiche ai marker scritte")
+telegram_send_seconds = metrics.histogram('telegram_send_seconds', "Durata delle chiamate sendMessage per log e annunci", labels=('outcome',))
+telegram_send_failures = metrics.counter('telegram_send_failures_total', "Chiamate sendMessage non riuscite", labels=('reason',))
+job_lag_seconds = metrics.histogram('job_lag_seconds', "Ritardo dei job periodici rispetto all'orario previsto", labels=('job',))
+
+def observe_write(seconds, commands):
+    marker_write_seconds.observe(seconds)
+    marker_write_commands.inc(commands)
+
+def observe_send(seconds, outcome):
+    telegram_send_seconds.observe(seconds, outcome)
+    if outcome != 'ok':
+        telegram_send_failures.inc(1, outcome)
+
+# Update dello stesso utente uno alla volta (niente intrecci su user_data[uid]),
+# con un limite globale sugli handler in esecuzione
+update_processor = UserUpdateProcessor(MAX_CONCURRENT_HANDLERS, MAX_PENDING_UPDATES)
+
+# Sessioni delle conversazioni in corso (uid -> dati), con scadenza dopo TIMEOUT_SECONDS
+user_data = SessionStore(TIMEOUT_SECONDS, path=SESSIONS_FILE)
+
 # Handler per timeout della chat
 def check_timeout(user_id):
     """Verifica se è scaduto il timeout per un'operazione."""
@@ -137,14 +297,32 @@ async def timeout_checker(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
     return None
 
+last_cleanup = None  # orario (monotonic) dell'ultima esecuzione di cleanup_timeout
+
 async def cleanup_timeout(context: ContextTypes.DEFAULT_TYPE):
-    """Pulizia periodica delle sessioni scadute."""
-    now = time.time()
-    expired = [uid for uid, data in user_data.items() 
-               if now - data.get('timestamp', 0) > TIMEOUT_SECONDS]
-    
-    for uid in expired:
-        user_data.pop(uid, None)
+    """Pulizia periodica delle sessioni scadute e salvataggio di quelle in corso."""
+    global last_cleanup
+    now = time.monotonic()
+    if last_cleanup is not None:
+        job_lag_seconds.observe(max(now - last_cleanup - TIMEOUT_CHECK_INTERVAL, 0), 'cleanup_timeout')
+    last_cleanup = now
+
+    expired = user_data.expire()
+    if expired:
+        logging.info(f"Sessioni scadute: {len(expired)}")
+
+    try:
+        user_data.save()
+    except Exception as e:
+        logging.error(f"Errore salvataggio sessioni: {e}")
+
+async def compact_markers(context: ContextTypes.DEFAULT_TYPE):
+    """Compattazione periodica del journal dei marker nel CSV."""
+    try:
+        if await writer.compact():
+            logging.info("Journal marker compattato nel CSV")
+    except Exception as e:
+        logging.error(f"Errore compattazione marker: {e}")
 
 # Configurazione logging
 logging.basicConfig(
@@ -162,61 +340,326 @@ def is_valid_url(url):
     """Verifica se una stringa è un URL valido."""
     return re.match(r'^https?://[^\s]+$', url)
 
+# Store condiviso dei marker: CSV in memoria oppure SQLite, in base a STORAGE_BACKEND
+store = open_store(STORAGE_BACKEND, FILE, db_path=DB_FILE, append_only=APPEND_ONLY)
+
+instrument_methods(store, ('all', 'by_user', 'count_user', 'by_name', 'has_name', 'in_bbox'), marker_read_seconds)
+
+# Unico scrittore del CSV: gli handler accodano le modifiche e attendono la scrittura
+writer = MarkerWriter(store, flush_window=WRITE_FLUSH_WINDOW, on_flush=observe_write)
+
+# Snapshot e delta per il frontend, rigenerati dopo ogni scrittura
+snapshot_publisher = SnapshotPublisher(SNAPSHOT_DIR, binary=True)
+search_publisher = SearchIndexPublisher(SNAPSHOT_DIR)
+changelog = ChangeLog(SNAPSHOT_DIR, max_chain=DELTA_MAX_CHAIN)
+tile_builder = TileBuilder(SNAPSHOT_DIR, detail_zoom=TILE_DETAIL_ZOOM)
+marker_stats = MarkerStats(STATS_FILE)
+
+async def publish_snapshot(changes=None, markers=None):
+    """Pubblica delta, snapshot, indice di ricerca, tile e statistiche dei marker per la pagina web.
+
+    markers sono i marker subito dopo changes: snapshot e delta della stessa versione
+    devono descrivere lo stesso stato. Senza modifiche (avvio del bot) la catena dei
+    delta viene azzerata e le tile ricostruite (come le statistiche), perché il CSV
+    potrebbe essere cambiato mentre il bot era spento.
+    """
+    def publish():
+        nonlocal markers
+        if markers is None:
+            markers = store.all()
+        if changes:
+            version = changelog.record(changes)
+            tile_builder.update(changes)
+            marker_stats.apply(changes)
+        else:
+            version = changelog.reset()
+            tile_builder.rebuild(markers)
+            marker_stats.rebuild(markers)
+        snapshot_publisher.publish(markers, version)
+        search_publisher.publish(markers, version)
+        marker_stats.publish()
+    await asyncio.to_thread(publish)
+    # /api/stats legge le statistiche appena pubblicate
+    api.invalidate()
+
+# Pubblicazione in un task separato: una pubblicazione lenta non blocca le scritture
+# successive, e le scritture arrivate nel frattempo vengono pubblicate insieme
+publish_queue = asyncio.Queue()
+
+async def queue_publish(changes):
+    # Copia dei marker presa qui, prima della scrittura successiva (il writer attende
+    # i listener): lo snapshot contiene esattamente le modifiche della sua versione
+    markers = await asyncio.to_thread(store.all)
+    publish_queue.put_nowait((changes, markers))
+
+async def publish_worker():
+    """Pubblica le modifiche in coda, raccolte in un'unica versione con i marker dell'ultima."""
+    while True:
+        batch = [await publish_queue.get()]
+        while not publish_queue.empty():
+            batch.append(publish_queue.get_nowait())
+        try:
+            await publish_snapshot([c for changes, _ in batch for c in changes], batch[-1][1])
+        except Exception as e:
+            logging.error(f"Errore pubblicazione snapshot: {e}")
+        finally:
+            for _ in batch:
+                publish_queue.task_done()
+
+# Indice per nome di /find e dei controlli sui duplicati, aggiornato con le modifiche.
+# Prima degli altri listener: i futures delle scritture sono già risolti e gli handler
+# non devono vedere l'indice precedente
+search_index = MarkerSearchIndex(store)
+
+async def update_search_index(changes):
+    search_index.apply(changes)
+
+writer.add_listener(update_search_index)
+writer.add_listener(queue_publish)
+
+# Overlay di copertura stimata: ricalcolato in un task separato per non rallentare le scritture
+coverage_builder = CoverageBuilder(SNAPSHOT_DIR, zooms=COVERAGE_ZOOMS, antenna_height=COVERAGE_ANTENNA_HEIGHT)
+coverage_queue = asyncio.Queue()
+
+async def queue_coverage(changes):
+    coverage_queue.put_nowait(changes)
+
+async def coverage_worker():
+    """Applica le modifiche in coda all'overlay; None in coda indica una ricostruzione completa."""
+    while True:
+        batch = [await coverage_queue.get()]
+        while not coverage_queue.empty():
+            batch.append(coverage_queue.get_nowait())
+        try:
+            if None in batch:
+                await asyncio.to_thread(lambda: coverage_builder.rebuild(store.all()))
+            else:
+                await asyncio.to_thread(coverage_builder.update, [c for changes in batch for c in changes])
+        except Exception as e:
+            logging.error(f"Errore aggiornamento copertura: {e}")
+
+writer.add_listener(queue_coverage)
+
+# API di lettura: condivide lo store, le risposte in cache vengono scartate a ogni scrittura
+# e di nuovo dopo la pubblicazione, così /api/stats vede le statistiche aggiornate
+api = MarkerAPI(store, marker_stats)
+
+async def invalidate_api(changes):
+    api.invalidate()
+
+writer.add_listener(invalidate_api)
+
+# Indice spaziale per le ricerche di prossimità, ricostruito in un thread dopo le scritture
+# (quelle arrivate durante una ricostruzione vengono raccolte nella successiva)
+spatial_index = MarkerSpatialIndex(store)
+spatial_queue = asyncio.Queue()
+
+async def queue_spatial_index(changes):
+    spatial_queue.put_nowait(changes)
+
+async def spatial_worker():
+    while True:
+        await spatial_queue.get()
+        while not spatial_queue.empty():
+            spatial_queue.get_nowait()
+        try:
+            await asyncio.to_thread(spatial_index.rebuild)
+        except Exception as e:
+            logging.error(f"Errore aggiornamento indice spaziale: {e}")
+
+writer.add_listener(queue_spatial_index)
+
+# Messaggi in uscita (log, annunci) inviati in background con limiti di frequenza
+dispatcher = MessageDispatcher(
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    per_chat_rate=OUTBOUND_PER_CHAT_RATE,
+    digest_window=LOG_DIGEST_WINDOW,
+    on_send=observe_send
+)
+
+# Valori letti al momento dell'esportazione
+metrics.counter('marker_bytes_written_total', "Byte scritti su CSV e journal dei marker", func=lambda: store.bytes_written)
+metrics.gauge('sessions_active', "Conversazioni in corso in user_data", func=lambda: len(user_data))
+metrics.counter('sessions_total', "Sessioni create, scadute e concluse", labels=('event',), func=lambda: {
+    (event,): value for event, value in user_data.stats().items() if event != 'active'
+})
+metrics.gauge('updates_in_flight', "Handler in esecuzione", func=lambda: update_processor.in_flight)
+metrics.gauge('updates_waiting', "Update in attesa del turno dell'utente o di un posto libero", func=lambda: update_processor.waiting)
+metrics.gauge('outbound_pending', "Messaggi in coda nel dispatcher", func=lambda: dispatcher.pending())
+metrics.gauge('markers_awaiting_confirmation', "Nodi inattivi in attesa di conferma dal proprietario", func=lambda: sweeper.awaiting())
+metrics.counter('api_requests_total', "Richieste all'API dei marker", func=lambda: api.requests)
+
+# Poller delle reti esterne, con un client HTTP condiviso e richieste condizionali
+ingestor = Ingestor([
+    Source(name, url, LAYERS_DIR, bbox=INGEST_BBOX)
+    for name, url in LAYER_SOURCES.items() if url
+])
+
+async def poll_layers(context: ContextTypes.DEFAULT_TYPE):
+    """Aggiornamento periodico dei layer LoRa Italia e MeshCore."""
+    try:
+        await ingestor.poll_all()
+    except Exception as e:
+        logging.error(f"Errore aggiornamento layer: {e}")
+
+# Iscrizioni alle zone, con indice spaziale sulle aree (persistenti tra i riavvii)
+subscriptions = SubscriptionStore(SUBSCRIPTIONS_DB_FILE)
+
+# Scadenze di conferma dei nodi inattivi (min-heap in memoria, conferme su SQLite)
+sweeper = InactivitySweeper(SWEEPER_DB_FILE, inactive_after=INACTIVE_AFTER, grace=SWEEP_GRACE)
+
+async def update_sweeper(changes):
+    sweeper.apply(changes)
+
+writer.add_listener(update_sweeper)
+
+def group_by_owner(items, marker=lambda item: item):
+    """Raggruppa per proprietario (ID del marker), per un solo messaggio a utente."""
+    groups = {}
+    for item in items:
+        groups.setdefault(marker(item)['ID'], []).append(item)
+    return groups
+
+def confirmation_keyboard(pending):
+    """Pulsanti mantieni/rimuovi per ogni marker in attesa, più 'mantieni tutti'."""
+    rows = [
+        [InlineKeyboardButton(f"✅ {m['name']}", callback_data=f"sweep_keep:{cid}"),
+         InlineKeyboardButton(f"🗑️ {m['name']}", callback_data=f"sweep_remove:{cid}")]
+        for cid, m in pending
+    ]
+    if len(pending) > 1:
+        rows.append([InlineKeyboardButton("✅ Mantieni tutti", callback_data="sweep_keep_all")])
+    return InlineKeyboardMarkup(rows)
+
+async def sweep_inactive(context: ContextTypes.DEFAULT_TYPE):
+    """Job: richieste di conferma per i nodi scaduti e rimozione in blocco di quelli senza risposta.
+
+    Estrae dall'heap solo i marker scaduti; una richiesta per utente con tutti i suoi nodi.
+    Richieste e rimozioni sono gestite separatamente: se una delle due fallisce i suoi
+    marker tornano nell'heap per il controllo successivo, senza toccare l'altra.
+    """
+    try:
+        notify, remove = sweeper.pop_due(limit=SWEEP_MAX_NOTIFICATIONS)
+    except Exception as e:
+        logging.error(f"Errore controllo nodi inattivi: {e}")
+        return
+
+    if notify:
+        try:
+            pending = sweeper.mark_notified(notify)
+        except Exception as e:
+            sweeper.requeue(notify)
+            logging.error(f"Errore registrazione richieste di conferma: {e}")
+        else:
+            for uid, items in group_by_owner(pending, marker=lambda item: item[1]).items():
+                text = (MESSAGES["sweep_confirm"] + ''.join(f"• {m['name']}\n" for _, m in items) +
+                        MESSAGES["sweep_confirm_footer"])
+                dispatcher.send(int(uid), text, reply_markup=confirmation_keyboard(items))
+            logging.info(f"Richieste di conferma inviate: {len(pending)} nodi")
+
+    if remove:
+        try:
+            removed = await writer.delete_many(remove)
+        except Exception as e:
+            sweeper.requeue(remove)
+            logging.error(f"Errore rimozione nodi inattivi: {e}")
+            return
+        try:
+            sweeper.forget(remove)
+            for uid, markers in group_by_owner(removed).items():
+                dispatcher.send(int(uid), MESSAGES["sweep_removed"] + ''.join(f"• {m['name']}\n" for m in markers))
+            logging.info(f"Nodi inattivi rimossi: {len(removed)}")
+            if LOG_ENABLED and removed:
+                await send_log_to_admins(context, f"🧹 Nodi inattivi rimossi: {len(removed)}\n" +
+                                         ''.join(f"• {m['name']} (ID: {m['ID']})\n" for m in removed))
+        except Exception as e:
+            logging.error(f"Errore controllo nodi inattivi: {e}")
+
+async def sweep_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Risposta del proprietario a una richiesta di conferma (pulsanti inline)."""
+    query = update.callback_query
+    uid = str(query.from_user.id)
+    action, _, confirmation_id = query.data.partition(':')
+
+    try:
+        if action == 'sweep_keep_all':
+            for cid, _ in sweeper.pending(uid):
+                sweeper.confirm(cid, uid)
+            await query.answer(MESSAGES["sweep_kept"])
+        elif action == 'sweep_keep':
+            marker = sweeper.confirm(int(confirmation_id), uid)
+            await query.answer(MESSAGES["sweep_kept"] if marker else MESSAGES["sweep_expired"])
+        else:
+            marker = sweeper.lookup(int(confirmation_id), uid)
+            removed = await writer.delete_many([marker]) if marker else []
+            sweeper.forget(removed)  # subito, senza attendere i listener della scrittura
+            await query.answer(MESSAGES["sweep_deleted"] if removed else MESSAGES["sweep_expired"])
+            if removed and LOG_ENABLED:
+                await send_log_to_admins(
+                    context,
+                    f"🗑️ Marker eliminato dopo la richiesta di conferma\n"
+                    f"👤 Utente: {query.from_user.username or 'anonimo'} (ID: {uid})\n"
+                    f"📛 Nome: {removed[0]['name']}\n"
+                )
+
+        # Restano solo i pulsanti dei nodi ancora senza risposta
+        pending = sweeper.pending(uid)
+        if pending:
+            await query.edit_message_reply_markup(reply_markup=confirmation_keyboard(pending))
+        else:
+            await query.edit_message_text(MESSAGES["sweep_done"])
+
+    except Exception as e:
+        logging.error(f"Errore in sweep_button per {uid}: {str(e)}", exc_info=True)
+
+async def notify_subscribers(context: ContextTypes.DEFAULT_TYPE):
+    """Job: avvisa gli iscritti la cui zona contiene il marker appena aggiunto."""
+    marker = context.job.data
+    try:
+        lat, lon = float(marker['lat']), float(marker['lon'])
+        matches = await asyncio.to_thread(subscriptions.match, lat, lon, exclude=marker['ID'])
+        if not matches:
+            return
+
+        text = (
+            MESSAGES["new_node_nearby"] +
+            f"📍 Nome: {marker['name']}\n"
+            f"📡 Tipo: {marker['node_type']}\n"
+            f"📶 Frequenza: {marker['frequency']}\n"
+            f"🌍 Posizione: {lat:.5f}, {lon:.5f}"
+        )
+        dispatcher.broadcast([int(sub['ID']) for sub in matches], text)
+        logging.info(f"Nuovo marker {marker['name']}: {len(matches)} iscritti avvisati")
+    except Exception as e:
+        logging.error(f"Errore notifica iscritti: {e}")
+
+def describe_subscription(sub):
+    """Descrizione breve di una zona per le liste."""
+    if sub['kind'] == 'radius':
+        return f"{sub['radius_km']:g} km da {sub['lat']:.4f}, {sub['lon']:.4f}"
+    return f"riquadro {sub['min_lat']:.4f}, {sub['min_lon']:.4f} - {sub['max_lat']:.4f}, {sub['max_lon']:.4f}"
+
 def read_markers():
-    """Legge tutti i marker dal file CSV."""
-    if not os.path.exists(FILE):
-        return []
-    
-    with open(FILE, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        if reader.fieldnames and reader.fieldnames[0].startswith('\ufeff'):
-            reader.fieldnames[0] = reader.fieldnames[0].replace('\ufeff', '')
-        
-        fieldnames = ['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link', 'ID', 'user', 'timestamp']
-        markers = []
-        
-        for row in reader:
-            if not row.get('lat') or not row.get('lon') or not row.get('ID'):
-                continue
-            
-            marker = {field: row.get(field, '') for field in fieldnames}
-            if not marker['user']:
-                marker['user'] = 'anonimo'
-                
-            markers.append(marker)
-        
-        return markers
+    """Legge tutti i marker (dalla cache in memoria, il file viene riletto solo se cambia)."""
+    return store.all()
 
 def safe_write_markers(markers):
     """Scrive i marker su file in modo sicuro con file temporaneo."""
-    fieldnames = ['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link', 'ID', 'user', 'timestamp']
-    
-    temp_file = tempfile.NamedTemporaryFile('w', newline='', delete=False, encoding='utf-8-sig')
-    with temp_file as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for marker in markers:
-            clean_marker = {field: marker.get(field, '') for field in fieldnames}
-            writer.writerow(clean_marker)
-    
-    shutil.move(temp_file.name, FILE)
+    store.replace_all(markers)
 
 # -------------- MENU ADMIN --------------
 
 async def send_log_to_admins(context: ContextTypes.DEFAULT_TYPE, message: str):
-    """Invia un messaggio di log a tutti gli admin se i log sono abilitati"""
+    """Accoda un messaggio di log per tutti gli admin se i log sono abilitati.
+
+    L'invio avviene in background: i log ravvicinati arrivano in un unico messaggio.
+    """
     global LOG_ENABLED
     if not LOG_ENABLED:
         return
         
     for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(
-                chat_id=admin_id,
-                text=f"📢 LOG:\n{message}"
-            )
-        except Exception as e:
-            logging.error(f"Errore invio log all'admin {admin_id}: {e}")
+        dispatcher.digest(admin_id, message, header="📢 LOG:")
 
 async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Menu di gestione per admin"""
@@ -228,7 +671,8 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("🔈 Abilita Log", callback_data="log_on")],
         [InlineKeyboardButton("🔇 Disabilita Log", callback_data="log_off")],
         [InlineKeyboardButton("📊 Statistiche", callback_data="stats")],
-        [InlineKeyboardButton("📤 Esporta dati", callback_data="export")]
+        [InlineKeyboardButton("📤 Esporta dati", callback_data="export")],
+        [InlineKeyboardButton("📈 Metriche", callback_data="metrics")]
     ]
     
     await update.message.reply_text(
@@ -276,8 +720,11 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     elif query.data == "stats":
         await admin_stats(update, context)
         
-    elif query.data == "export":
+    elif query.data.startswith("export"):
         await admin_export(update, context)
+
+    elif query.data == "metrics":
+        await admin_metrics(update, context)
         
     elif query.data == "back_to_menu":
         # Ricrea il menu principale
@@ -285,7 +732,8 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             [InlineKeyboardButton("🔈 Abilita Log" if not LOG_ENABLED else "🔇 Disabilita Log", 
              callback_data="log_off" if LOG_ENABLED else "log_on")],
             [InlineKeyboardButton("📊 Statistiche", callback_data="stats")],
-            [InlineKeyboardButton("📤 Esporta dati", callback_data="export")]
+            [InlineKeyboardButton("📤 Esporta dati", callback_data="export")],
+            [InlineKeyboardButton("📈 Metriche", callback_data="metrics")]
         ]
         await query.edit_message_text(
             "🛠️ *Menu Admin* - Stato log: " + ("✅ ON" if LOG_ENABLED else "❌ OFF"),
@@ -293,6 +741,49 @@ async def admin_button_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
 
+def format_latency(histogram, *labels):
+    p50, p95 = histogram.quantile(0.5, *labels), histogram.quantile(0.95, *labels)
+    if p50 is None:
+        return "n/d"
+    return f"p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms"
+
+async def admin_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Riepilogo delle metriche per gli admin (l'elenco completo è su /metrics)."""
+    query = update.callback_query
+    if query.from_user.id not in ADMIN_IDS:
+        await query.edit_message_text(MESSAGES["not_authorized"])
+        return
+
+    handlers = sorted(handler_seconds.series().items(), key=lambda item: -item[1][2])
+    errors = handler_errors.values()
+    lines = ["📈 <b>Metriche</b>\n", "⏱️ <b>Handler</b> (chiamate, latenza):"]
+    for (name,), (_, _, count) in handlers[:12]:
+        failed = errors.get((name,), 0)
+        lines.append(f"• {name}: {count}, {format_latency(handler_seconds, name)}" + (f", ❗ {failed} errori" if failed else ""))
+    if not handlers:
+        lines.append("• nessuna chiamata")
+
+    reads = marker_read_seconds.series()
+    read_count = sum(count for _, _, count in reads.values())
+    lines += [
+        "",
+        f"📖 <b>Letture marker:</b> {read_count}, all() {format_latency(marker_read_seconds, 'all')}",
+        f"💾 <b>Scritture marker:</b> {marker_write_commands.values().get((), 0)} modifiche, {format_latency(marker_write_seconds)}",
+        f"📦 <b>Byte scritti:</b> {store.bytes_written / 1024:.1f} KiB",
+        f"📨 <b>Telegram sendMessage:</b> {format_latency(telegram_send_seconds, 'ok')}, "
+        f"errori {sum(telegram_send_failures.values().values())}, in coda {dispatcher.pending()}",
+        f"👥 <b>Sessioni attive:</b> {len(user_data)}",
+        f"⏰ <b>Ritardo cleanup_timeout:</b> {format_latency(job_lag_seconds, 'cleanup_timeout')}",
+    ]
+    await query.edit_message_text(
+        "\n".join(lines),
+        parse_mode=ParseMode.HTML,
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔄 Aggiorna", callback_data="metrics")],
+            [InlineKeyboardButton("🔙 Torna al menu", callback_data="back_to_menu")]
+        ])
+    )
+
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mostra le statistiche agli admin."""
     query = update.callback_query
@@ -302,35 +793,33 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(MESSAGES["not_authorized"])
         return
 
-    markers = read_markers()
-    total_markers = len(markers)
-    
-    # Statistiche utenti
-    users = {}
-    for marker in markers:
-        user_id = marker['ID']
-        users[user_id] = users.get(user_id, 0) + 1
-    
-    top_users = sorted(users.items(), key=lambda x: x[1], reverse=True)[:5]
-    markers_with_links = sum(1 for m in markers if m['link'])
+    # Statistiche aggiornate a ogni scrittura: nessuna lettura dei marker qui
+    summary = marker_stats.summary()
+    total_markers = summary['total']
+    markers_with_links = summary['with_link']
+    link_ratio = markers_with_links / total_markers if total_markers else 0
     
     # Costruisci il messaggio
     stats_message = (
         "📊 <b>Statistiche Admin</b>\n\n"
         f"📍 <b>Marker totali:</b> {total_markers}\n"
-        f"👥 <b>Utenti unici:</b> {len(users)}\n"
-        f"🔗 <b>Marker con link:</b> {markers_with_links} ({markers_with_links/total_markers:.1%})\n\n"
+        f"👥 <b>Utenti unici:</b> {summary['users']}\n"
+        f"🔗 <b>Marker con link:</b> {markers_with_links} ({link_ratio:.1%})\n"
+        f"🆕 <b>Aggiunti oggi:</b> {marker_stats.added_on()}\n\n"
+        "📡 <b>Tipi di nodo:</b> " + ", ".join(f"{k}: {v}" for k, v in sorted(summary['node_types'].items())) + "\n"
+        "📶 <b>Frequenze:</b> " + ", ".join(f"{k}: {v}" for k, v in sorted(summary['frequencies'].items())) + "\n\n"
         "🏆 <b>Top contributor:</b>\n"
     )
     
-    for i, (user_id, count) in enumerate(top_users, 1):
-        user_info = next((m for m in markers if m['ID'] == user_id), None)
-        username = f"@{user_info['user']}" if user_info and user_info.get('user') else f"Utente #{user_id}"
+    for i, (user_id, count) in enumerate(marker_stats.top_users(5), 1):
+        user_name = marker_stats.usernames.get(user_id)
+        username = f"@{user_name}" if user_name else f"Utente #{user_id}"
         stats_message += f"{i}. {username}: {count} marker\n"
     
     stats_message += (
-        f"\n⭐ <b>Utenti speciali:</b> {sum(1 for uid in users if int(uid) in SPECIAL_USERS)}\n"
-        f"🔢 <b>Max marker per utente:</b> {MAX_MARKERS_PER_USER} (normali), {MAX_MARKERS_FOR_SPECIAL_USERS} (speciali)"
+        f"\n⭐ <b>Utenti speciali:</b> {sum(1 for uid in SPECIAL_USERS if str(uid) in marker_stats.user_counts)}\n"
+        f"🔢 <b>Max marker per utente:</b> {MAX_MARKERS_PER_USER} (normali), {MAX_MARKERS_FOR_SPECIAL_USERS} (speciali)\n"
+        f"💬 <b>Sessioni attive:</b> {len(user_data)} (scadute: {user_data.expired})"
     )
     
     await query.edit_message_text(
@@ -341,23 +830,51 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ])
     )
 
+async def send_export(bot, chat_id, fmt='csv', compress=False, filters=None):
+    """Genera l'esportazione in un thread (senza bloccare gli altri utenti) e la invia come documento."""
+    path, filename, count = await asyncio.to_thread(
+        export_markers, store.iter_all(), fmt, compress, **(filters or {})
+    )
+    try:
+        with open(path, 'rb') as f:
+            await bot.send_document(
+                chat_id=chat_id,
+                document=f,
+                filename=filename,
+                caption=f'📤 Esportazione marker: {count} marker'
+            )
+    finally:
+        os.remove(path)
+
 async def admin_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Esporta tutti i marker in un file CSV."""
+    """Esporta i marker nel formato scelto dal menu admin."""
     query = update.callback_query
     await query.answer()  # Chiude l'indicatore di caricamento
     
     if query.from_user.id not in ADMIN_IDS:
         await query.edit_message_text(MESSAGES["not_authorized"])
         return
+
+    # Scelta del formato (i filtri sono disponibili con il comando /export)
+    if query.data == "export":
+        await query.edit_message_text(
+            "📤 Scegli il formato di esportazione:\n\n"
+            "Per filtrare usa /export, es.\n"
+            "/export geojson gz type=MeshCore freq=868 bbox=45,9.5,46,10.8 from=2025-01-01 to=2025-01-31",
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("CSV", callback_data="export_csv"),
+                 InlineKeyboardButton("CSV (gzip)", callback_data="export_csv_gz")],
+                [InlineKeyboardButton("GeoJSON", callback_data="export_geojson"),
+                 InlineKeyboardButton("GeoJSON (gzip)", callback_data="export_geojson_gz")],
+                [InlineKeyboardButton("NDJSON (gzip)", callback_data="export_ndjson_gz")],
+                [InlineKeyboardButton("🔙 Torna al menu", callback_data="back_to_menu")]
+            ])
+        )
+        return
     
     try:
-        with open(FILE, 'rb') as f:
-            await context.bot.send_document(
-                chat_id=query.from_user.id,
-                document=f,
-                filename='markers_export.csv',
-                caption='📤 Esportazione completa dei marker'
-            )
+        _, fmt, *options = query.data.split('_')
+        await send_export(context.bot, query.from_user.id, fmt, compress='gz' in options)
         await query.edit_message_text(
             "✅ File esportato con successo!",
             reply_markup=InlineKeyboardMarkup([
@@ -368,6 +885,117 @@ async def admin_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logging.error(f"Errore esportazione: {str(e)}")
         await query.edit_message_text(MESSAGES["error_generic"])
 
+async def admin_export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /export [csv|geojson|ndjson] [gz] [type=..] [freq=..] [bbox=..] [from=..] [to=..]"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text(MESSAGES["not_authorized"])
+        return
+
+    try:
+        fmt, compress, filters = parse_export_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+
+    try:
+        await send_export(context.bot, update.effective_chat.id, fmt, compress, filters)
+    except Exception as e:
+        logging.error(f"Errore esportazione: {str(e)}")
+        await update.message.reply_text(MESSAGES["error_generic"])
+
+
+async def admin_import(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Avvia l'importazione in blocco dei marker da file (solo admin)."""
+    uid = str(update.effective_user.id)
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text(MESSAGES["not_authorized"])
+        return ConversationHandler.END
+
+    # Controllo se un'altra operazione è in corso
+    if uid in user_data and 'state' in user_data[uid]:
+        await update.message.reply_text(MESSAGES["operation_in_progress"])
+        return ConversationHandler.END
+
+    user_data[uid] = {'state': 'importing', 'timestamp': time.time()}
+    await update.message.reply_text(MESSAGES["import_file"])
+    return IMPORT_FILE
+
+def import_limit(uid):
+    """Limite di marker per l'importazione: nessun limite per gli admin."""
+    if int(uid) in ADMIN_IDS:
+        return None
+    return MAX_MARKERS_FOR_SPECIAL_USERS if int(uid) in SPECIAL_USERS else MAX_MARKERS_PER_USER
+
+async def import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Valida il file ricevuto e aggiunge i marker validi con un'unica scrittura."""
+    uid = str(update.effective_user.id)
+    document = update.message.document
+
+    if document.file_size and document.file_size > MAX_IMPORT_FILE_SIZE:
+        await update.message.reply_text(MESSAGES["import_too_large"])
+        return IMPORT_FILE
+
+    try:
+        data = bytes(await (await document.get_file()).download_as_bytearray())
+        filename = document.file_name or 'import.csv'
+
+        def check():
+            df = load_document(data, filename)
+            return validate_import(
+                df, store.all(),
+                clean=clean_text,
+                node_types=NODE_TYPES,
+                frequencies=FREQUENCIES,
+                max_name=MAX_NAME_LENGTH,
+                max_desc=MAX_DESC_LENGTH,
+                max_link=MAX_LINK_LENGTH,
+                limit_for=import_limit,
+                default_id=uid,
+                default_user=update.effective_user.username or "anonimo"
+            )
+
+        try:
+            markers, report = await asyncio.to_thread(check)
+        except (ValueError, UnicodeDecodeError) as e:
+            logging.error(f"File di importazione non valido da {uid}: {e}")
+            await update.message.reply_text(MESSAGES["import_invalid_file"])
+            return IMPORT_FILE
+
+        # Tutti i marker validi in un'unica scrittura atomica
+        if markers:
+            await writer.add_many(markers)
+
+        msg = f"📥 Importazione completata\n\n✅ Marker aggiunti: {len(markers)}\n❌ Righe scartate: {len(report)}\n"
+        if len(report):
+            msg += "\n" + "\n".join(
+                f"Riga {row.row} ({row.name}): {row.errors}" for row in report.head(IMPORT_REPORT_PREVIEW).itertuples()
+            )
+            if len(report) > IMPORT_REPORT_PREVIEW:
+                msg += f"\n… e altre {len(report) - IMPORT_REPORT_PREVIEW} righe, vedi il report allegato"
+        await update.message.reply_text(msg)
+
+        if len(report):
+            await update.message.reply_document(
+                document=io.BytesIO(report_csv(report)),
+                filename='import_errori.csv',
+                caption='Report delle righe scartate'
+            )
+
+        if LOG_ENABLED and markers:
+            await send_log_to_admins(
+                context,
+                f"📥 Importazione marker\n"
+                f"👤 Admin: {update.effective_user.username or 'anonimo'} (ID: {uid})\n"
+                f"✅ Aggiunti: {len(markers)}\n"
+                f"❌ Scartati: {len(report)}\n"
+            )
+
+    except Exception as e:
+        logging.error(f"Errore in import_file per {uid}: {str(e)}", exc_info=True)
+        await update.message.reply_text(MESSAGES["error_generic"])
+
+    user_data.pop(uid, None)
+    return ConversationHandler.END
 
 #########################################
 #                                       #
@@ -430,11 +1058,9 @@ async def add(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(MESSAGES["operation_in_progress"])
         return ConversationHandler.END
     
-    markers = read_markers()
-    user_markers = [m for m in markers if m['ID'] == uid]
     max_markers = MAX_MARKERS_FOR_SPECIAL_USERS if int(uid) in SPECIAL_USERS else MAX_MARKERS_PER_USER
 
-    if len(user_markers) >= max_markers:
+    if store.count_user(uid) >= max_markers:
         await update.message.reply_text(MESSAGES["max_markers_reached"])
         return ConversationHandler.END
     
@@ -523,11 +1149,8 @@ async def add_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text(MESSAGES["name_too_long"])
             return ADD_NAME
 
-        # Controllo duplicati
-        existing_markers = read_markers()
-        user_markers = [m for m in existing_markers if str(m['ID']) == uid]  # Confronta come stringa
-        
-        if any(m['name'].lower() == name.lower() for m in user_markers):
+        # Controllo duplicati (senza distinzione di maiuscole e accenti)
+        if search_index.has_name(uid, name):
             await update.message.reply_text(MESSAGES["duplicate_name"])
             user_data.pop(uid, None)
             return ConversationHandler.END
@@ -715,9 +1338,10 @@ async def finish_add(update: Update, context: ContextTypes.DEFAULT_TYPE):
         })
 
         # Salvataggio
-        markers = read_markers()
-        markers.append(marker)
-        safe_write_markers(markers)
+        await writer.add(marker)
+
+        # Notifiche agli iscritti della zona, in background
+        context.job_queue.run_once(notify_subscribers, 0, data=dict(marker))
 
         if LOG_ENABLED:  # Solo se i log sono abilitati
             log_message = (
@@ -763,7 +1387,7 @@ async def rename(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(MESSAGES["operation_in_progress"])
         return ConversationHandler.END
         
-    markers = [m for m in read_markers() if m['ID'] == uid]
+    markers = store.by_user(uid)
     if not markers:
         await update.message.reply_text(MESSAGES["no_markers_to_rename"])
         return ConversationHandler.END
@@ -799,23 +1423,12 @@ async def rename_new_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(MESSAGES["name_too_long"])
         return RENAME_NEW_NAME
 
-    if any(m['name'] == new_name for m in read_markers() if m['ID'] == uid):
+    if search_index.has_name(uid, new_name):
         await update.message.reply_text(MESSAGES["duplicate_name"])
         user_data.pop(uid, None)
         return ConversationHandler.END
 
-    markers = read_markers()
-    count = -1
-    old_name = None
-    for m in markers:
-        if m['ID'] == uid:
-            count += 1
-            if count == idx:
-                old_name = m['name']  # Memorizza il vecchio nome prima di aggiornare
-                m['name'] = new_name
-                break
-
-    safe_write_markers(markers)
+    old_name = await writer.rename(uid, idx, new_name)  # Restituisce il vecchio nome prima dell'aggiornamento
 
     # Invia log agli admin
     if LOG_ENABLED:
@@ -844,7 +1457,7 @@ async def delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(MESSAGES["operation_in_progress"])
         return ConversationHandler.END
         
-    markers = [m for m in read_markers() if m['ID'] == uid]
+    markers = store.by_user(uid)
     if not markers:
         await update.message.reply_text(MESSAGES["no_markers_to_delete"])
         return ConversationHandler.END
@@ -857,21 +1470,9 @@ async def delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def delete_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = str(update.effective_user.id)
     idx = int(update.message.text.strip()) - 1
-    all_markers = read_markers()
-    count = -1
-    to_delete = None
-    deleted_marker = None
-
-    for i, m in enumerate(all_markers):
-        if m['ID'] == uid:
-            count += 1
-            if count == idx:
-                to_delete = i
-                deleted_marker = m
-                break
-    if to_delete is not None:
-        del all_markers[to_delete]
-        safe_write_markers(all_markers)
+    deleted_marker = await writer.delete(uid, idx)
+
+    if deleted_marker is not None:
 
         if LOG_ENABLED:
             log_message = f"🗑️ Marker eliminato\n"
@@ -883,7 +1484,7 @@ async def delete_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         await update.message.reply_text(MESSAGES["marker_deleted"])
         
-        updated = [m for m in read_markers() if m['ID'] == uid]
+        updated = store.by_user(uid)
         if updated:
             msg = MESSAGES["your_markers"]
             for m in updated:
@@ -906,7 +1507,7 @@ async def list_markers(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(MESSAGES["operation_in_progress"])
         return ConversationHandler.END
         
-    markers = [m for m in read_markers() if m['ID'] == uid]
+    markers = store.by_user(uid)
     if not markers:
         await update.message.reply_text(MESSAGES["no_markers"])
     else:
@@ -918,32 +1519,287 @@ async def list_markers(update: Update, context: ContextTypes.DEFAULT_TYPE):
             msg += "\n"
         await update.message.reply_text(msg)
 
+# NEAR
+async def near(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Avvia la ricerca dei nodi più vicini a una posizione."""
+    uid = str(update.effective_user.id)
+
+    # Controllo timeout
+    timeout_resp = await timeout_checker(update, context)
+    if timeout_resp == ConversationHandler.END:
+        return ConversationHandler.END
+
+    # Controllo se un'altra operazione è in corso
+    if uid in user_data and 'state' in user_data[uid]:
+        await update.message.reply_text(MESSAGES["operation_in_progress"])
+        return ConversationHandler.END
+
+    user_data[uid] = {'state': 'near', 'timestamp': time.time()}
+    await update.message.reply_text(MESSAGES["near_location"])
+    return NEAR_LOCATION
+
+async def near_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Risponde con i nodi più vicini alla posizione inviata."""
+    uid = str(update.effective_user.id)
+
+    try:
+        # Posizione condivisa oppure coordinate scritte a mano
+        if update.message.location:
+            lat = update.message.location.latitude
+            lon = update.message.location.longitude
+        else:
+            try:
+                lat, lon = (float(v) for v in update.message.text.replace(',', ' ').split())
+            except ValueError:
+                await update.message.reply_text(MESSAGES["error_position"])
+                return NEAR_LOCATION
+
+        results = spatial_index.nearest(lat, lon, NEAR_RESULTS)
+        if not results:
+            await update.message.reply_text(MESSAGES["no_nodes_near"])
+        else:
+            msg = MESSAGES["near_results"]
+            for i, (m, distance) in enumerate(results, 1):
+                msg += f"{i}. {m['name']} ({m['node_type']}, {m['frequency']}) - {distance:.1f} km\n"
+            await update.message.reply_text(msg)
+
+    except Exception as e:
+        logging.error(f"Errore in near_location per {uid}: {str(e)}", exc_info=True)
+        await update.message.reply_text(MESSAGES["error_generic"])
+
+    user_data.pop(uid, None)
+    return ConversationHandler.END
+
+# FIND
+async def find(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cerca i nodi per nome (anche parziale, senza distinzione di maiuscole e accenti)."""
+    uid = str(update.effective_user.id)
+    query = ' '.join(context.args or [])
+    if not query.strip():
+        await update.message.reply_text(MESSAGES["find_usage"])
+        return
+
+    try:
+        results = await asyncio.to_thread(search_index.search, query, FIND_RESULTS)
+        if not results:
+            await update.message.reply_text(MESSAGES["find_no_results"])
+            return
+
+        # Una riga per marker: nomi uguali di utenti diversi sono voci separate
+        lines = []
+        for _, markers in results:
+            for m in markers:
+                lines.append(f"{len(lines) + 1}. {m['name']} ({m['node_type']}, {m['frequency']}) - {m['lat']}, {m['lon']}")
+        await update.message.reply_text(MESSAGES["find_results"] + '\n'.join(lines[:FIND_RESULTS]))
+
+    except Exception as e:
+        logging.error(f"Errore in find per {uid}: {str(e)}", exc_info=True)
+        await update.message.reply_text(MESSAGES["error_generic"])
+
+# SUBSCRIBE
+async def subscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Avvia l'iscrizione alle notifiche dei nuovi nodi in una zona."""
+    uid = str(update.effective_user.id)
+
+    # Controllo timeout
+    timeout_resp = await timeout_checker(update, context)
+    if timeout_resp == ConversationHandler.END:
+        return ConversationHandler.END
+
+    # Controllo se un'altra operazione è in corso
+    if uid in user_data and 'state' in user_data[uid]:
+        await update.message.reply_text(MESSAGES["operation_in_progress"])
+        return ConversationHandler.END
+
+    if subscriptions.count_user(uid) >= MAX_SUBSCRIPTIONS_PER_USER:
+        await update.message.reply_text(MESSAGES["max_subscriptions_reached"])
+        return ConversationHandler.END
+
+    user_data[uid] = {'state': 'subscribing', 'timestamp': time.time()}
+    await update.message.reply_text(MESSAGES["subscribe_area"])
+    return SUBSCRIBE_AREA
+
+async def subscribe_area(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Riceve il centro della zona (poi si chiede il raggio) oppure un riquadro completo."""
+    uid = str(update.effective_user.id)
+
+    try:
+        if update.message.location:
+            values = [update.message.location.latitude, update.message.location.longitude]
+        else:
+            try:
+                values = [float(v) for v in update.message.text.replace(',', ' ').split()]
+            except ValueError:
+                values = []
+
+        lats, lons = values[0::2], values[1::2]
+        if len(values) not in (2, 4) or any(abs(v) > 90 for v in lats) or any(abs(v) > 180 for v in lons):
+            await update.message.reply_text(MESSAGES["error_position"])
+            return SUBSCRIBE_AREA
+
+        if len(values) == 2:
+            user_data[uid].update({'lat': values[0], 'lon': values[1]})
+            await update.message.reply_text(MESSAGES["subscribe_radius"])
+            return SUBSCRIBE_RADIUS
+
+        await asyncio.to_thread(
+            subscriptions.subscribe_bbox, uid, min(lats), min(lons), max(lats), max(lons)
+        )
+        await update.message.reply_text(MESSAGES["subscribed"])
+
+    except Exception as e:
+        logging.error(f"Errore in subscribe_area per {uid}: {str(e)}", exc_info=True)
+        await update.message.reply_text(MESSAGES["error_generic"])
+
+    user_data.pop(uid, None)
+    return ConversationHandler.END
+
+async def subscribe_radius(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Completa l'iscrizione a una zona circolare."""
+    uid = str(update.effective_user.id)
+
+    try:
+        radius = float(update.message.text.replace(',', '.').lower().replace('km', '').strip())
+        if not 0 < radius <= MAX_SUBSCRIPTION_RADIUS_KM:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(MESSAGES["error_value"])
+        return SUBSCRIBE_RADIUS
+
+    try:
+        data = user_data[uid]
+        await asyncio.to_thread(subscriptions.subscribe_radius, uid, data['lat'], data['lon'], radius)
+        await update.message.reply_text(MESSAGES["subscribed"])
+    except Exception as e:
+        logging.error(f"Errore in subscribe_radius per {uid}: {str(e)}", exc_info=True)
+        await update.message.reply_text(MESSAGES["error_generic"])
+
+    user_data.pop(uid, None)
+    return ConversationHandler.END
+
+# UNSUBSCRIBE
+async def unsubscribe(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = str(update.effective_user.id)
+
+    # Controllo timeout
+    timeout_resp = await timeout_checker(update, context)
+    if timeout_resp == ConversationHandler.END:
+        return ConversationHandler.END
+
+    # Controllo se un'altra operazione è in corso
+    if uid in user_data and 'state' in user_data[uid]:
+        await update.message.reply_text(MESSAGES["operation_in_progress"])
+        return ConversationHandler.END
+
+    subs = subscriptions.by_user(uid)
+    if not subs:
+        await update.message.reply_text(MESSAGES["no_subscriptions"])
+        return ConversationHandler.END
+
+    msg = MESSAGES["unsubscribe_select"] + "\n".join(f"{i+1}. {describe_subscription(s)}" for i, s in enumerate(subs))
+    await update.message.reply_text(msg)
+    user_data[uid] = {'state': 'unsubscribing', 'timestamp': time.time()}
+    return UNSUBSCRIBE_SELECT
+
+async def unsubscribe_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = str(update.effective_user.id)
+    try:
+        idx = int(update.message.text.strip()) - 1
+    except ValueError:
+        await update.message.reply_text(MESSAGES["invalid_selection"])
+        return UNSUBSCRIBE_SELECT
+
+    if subscriptions.remove(uid, idx) is None:
+        await update.message.reply_text(MESSAGES["invalid_selection"])
+        return UNSUBSCRIBE_SELECT
+
+    await update.message.reply_text(MESSAGES["unsubscribed"])
+    user_data.pop(uid, None)
+    return ConversationHandler.END
+
 ############################################
 #                                          #
 #                   MAIN                   #
 #                                          #
 ############################################
 
-if __name__ == '__main__':
-    # Inizializza i dati utente
-    user_data = {}
-
-    # Crea l'applicazione
-    token = os.getenv("BOT_TOKEN")
-    # app = ApplicationBuilder().token(token).build()
-    app = (
-        ApplicationBuilder()
-        .token(token)
-        .read_timeout(30)
-        .write_timeout(30)
-        .concurrent_updates(True)
-        .job_queue(JobQueue())  # <-- Aggiungi questa linea
-        .build()
+async def post_init(app):
+    """Avvia i task di scrittura dei marker, di invio messaggi e della copertura, l'API,
+    pubblica lo snapshot iniziale e carica indici di ricerca e spaziale e scadenze dei nodi inattivi."""
+    writer.start()
+    dispatcher.start(app.bot)
+    await publish_snapshot()
+    app.bot_data['publish_task'] = asyncio.create_task(publish_worker())
+    await asyncio.to_thread(search_index.rebuild)
+    await asyncio.to_thread(spatial_index.rebuild)
+    app.bot_data['spatial_task'] = asyncio.create_task(spatial_worker())
+    await asyncio.to_thread(lambda: sweeper.load(store.all()))
+    coverage_queue.put_nowait(None)
+    app.bot_data['coverage_task'] = asyncio.create_task(coverage_worker())
+    if API_PORT:
+        await api.start(API_HOST, API_PORT)
+    if METRICS_PORT:
+        app.bot_data['metrics_server'] = await metrics.serve(METRICS_HOST, METRICS_PORT)
+
+async def post_shutdown(app):
+    """Scrive le modifiche, invia i messaggi ancora in coda e salva le sessioni prima di uscire."""
+    await writer.stop()
+    if 'publish_task' in app.bot_data:
+        await publish_queue.join()
+        app.bot_data['publish_task'].cancel()
+    await dispatcher.stop()
+    await ingestor.close()
+    await api.stop()
+    if 'metrics_server' in app.bot_data:
+        app.bot_data['metrics_server'].close()
+    if 'coverage_task' in app.bot_data:
+        app.bot_data['coverage_task'].cancel()
+    if 'spatial_task' in app.bot_data:
+        app.bot_data['spatial_task'].cancel()
+    user_data.save()
+
+async def run_webhook(app):
+    """Avvia il bot in modalità webhook con il ricevitore locale, al posto di run_polling."""
+    receiver = WebhookReceiver(
+        app, WEBHOOK_SECRET, path=urlsplit(WEBHOOK_URL).path,
+        # Oltre questa soglia il ricevitore rallenta le risposte a Telegram
+        max_backlog=MAX_PENDING_UPDATES,
+        backlog=lambda: app.update_queue.qsize() + update_processor.waiting
     )
+    metrics.counter('webhook_requests_total', "Richieste al webhook per codice di risposta", labels=('status',),
+                    func=lambda: {(status,): count for status, count in receiver.responses.items()})
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    await post_init(app)
+    await app.start()
+    await receiver.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    try:
+        await app.bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS
+        )
+        logging.info(f"Webhook impostato su {WEBHOOK_URL}")
+        await stop.wait()
+    finally:
+        await receiver.stop()
+        await app.stop()
+        await post_shutdown(app)
+        await app.shutdown()
 
+def register_handlers(app):
+    """Registra comandi, conversazioni e pulsanti (anche per il benchmark, con un Bot fittizio)."""
     # Configura i ConversationHandler
     add_conv = ConversationHandler(
         entry_points=[CommandHandler("add", add)],
+        name="add",
+        persistent=True,
         states={
             ADD_LAT: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, add_lat),
@@ -964,6 +1820,8 @@ if __name__ == '__main__':
 
     rename_conv = ConversationHandler(
         entry_points=[CommandHandler("rename", rename)],
+        name="rename",
+        persistent=True,
         states={
             RENAME_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, rename_select)],
             RENAME_NEW_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, rename_new_name)],
@@ -975,6 +1833,8 @@ if __name__ == '__main__':
 
     delete_conv = ConversationHandler(
         entry_points=[CommandHandler("delete", delete)],
+        name="delete",
+        persistent=True,
         states={
             DELETE_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, delete_select)],
         },
@@ -983,29 +1843,141 @@ if __name__ == '__main__':
         per_user=True
     )
 
+    near_conv = ConversationHandler(
+        entry_points=[CommandHandler("near", near)],
+        name="near",
+        persistent=True,
+        states={
+            NEAR_LOCATION: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, near_location),
+                MessageHandler(filters.LOCATION, near_location),
+            ],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=TIMEOUT_SECONDS,
+        per_user=True
+    )
+
+    subscribe_conv = ConversationHandler(
+        entry_points=[CommandHandler("subscribe", subscribe)],
+        name="subscribe",
+        persistent=True,
+        states={
+            SUBSCRIBE_AREA: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, subscribe_area),
+                MessageHandler(filters.LOCATION, subscribe_area),
+            ],
+            SUBSCRIBE_RADIUS: [MessageHandler(filters.TEXT & ~filters.COMMAND, subscribe_radius)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=TIMEOUT_SECONDS,
+        per_user=True
+    )
+
+    unsubscribe_conv = ConversationHandler(
+        entry_points=[CommandHandler("unsubscribe", unsubscribe)],
+        name="unsubscribe",
+        persistent=True,
+        states={
+            UNSUBSCRIBE_SELECT: [MessageHandler(filters.TEXT & ~filters.COMMAND, unsubscribe_select)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=TIMEOUT_SECONDS,
+        per_user=True
+    )
+
+    import_conv = ConversationHandler(
+        entry_points=[CommandHandler("import", admin_import)],
+        name="import",
+        persistent=True,
+        states={
+            IMPORT_FILE: [MessageHandler(filters.Document.ALL, import_file)],
+        },
+        fallbacks=[CommandHandler("cancel", cancel)],
+        conversation_timeout=TIMEOUT_SECONDS,
+        per_user=True
+    )
+
     # Registra gli handler
     app.add_handler(CallbackQueryHandler(
         admin_button_handler, 
-        pattern="^(log_on|log_off|stats|export|back_to_menu)$"
+        pattern="^(log_on|log_off|stats|export(_\\w+)?|metrics|back_to_menu)$"
     ))
+    app.add_handler(CallbackQueryHandler(sweep_button, pattern="^sweep_(keep|remove):\\d+$|^sweep_keep_all$"))
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help))
     app.add_handler(CommandHandler("list", list_markers))
+    app.add_handler(CommandHandler("find", find))
     app.add_handler(CommandHandler("stats", admin_stats))
     app.add_handler(CommandHandler("admin", admin_menu))
-    app.add_handler(CommandHandler("export", admin_export))
+    app.add_handler(CommandHandler("export", admin_export_command))
     app.add_handler(add_conv)
     app.add_handler(rename_conv)
     app.add_handler(delete_conv)
+    app.add_handler(near_conv)
+    app.add_handler(subscribe_conv)
+    app.add_handler(unsubscribe_conv)
+    app.add_handler(import_conv)
     app.add_handler(MessageHandler(filters.COMMAND, unknown))
     app.add_error_handler(error_handler)
 
+    # Durata di ogni handler (anche negli stati delle conversazioni)
+    instrument_handlers([h for group in app.handlers.values() for h in group], handler_seconds, handler_errors)
+
+if __name__ == '__main__':
+    # Crea l'applicazione
+    token = os.getenv("BOT_TOKEN")
+    # app = ApplicationBuilder().token(token).build()
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        .read_timeout(30)
+        .write_timeout(30)
+        .concurrent_updates(update_processor)
+        .job_queue(JobQueue())  # <-- Aggiungi questa linea
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .persistence(PicklePersistence(
+            CONVERSATIONS_FILE,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False)
+        ))
+        .build()
+    )
+
+    register_handlers(app)
+
     # Controllo periodico timeout
     app.job_queue.run_repeating(
         cleanup_timeout,
         interval=TIMEOUT_CHECK_INTERVAL,
         first=10
     )
+
+    # Compattazione periodica del journal (rinomine/eliminazioni) o esportazione del CSV
+    if APPEND_ONLY or STORAGE_BACKEND == "sqlite":
+        app.job_queue.run_repeating(
+            compact_markers,
+            interval=COMPACTION_INTERVAL,
+            first=COMPACTION_INTERVAL
+        )
+
+    # Richieste di conferma e rimozione dei nodi inattivi
+    app.job_queue.run_repeating(
+        sweep_inactive,
+        interval=SWEEP_INTERVAL,
+        first=60
+    )
+
+    # Layer delle reti esterne
+    if ingestor.sources:
+        app.job_queue.run_repeating(
+            poll_layers,
+            interval=INGEST_INTERVAL,
+            first=5
+        )
     
     # Avvia il bot
-    app.run_polling()
\ No newline at end of file
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
\ No newline at end of file
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import json
+import logging
+import os
+
+from snapshot import atomic_write
+
+def marker_key(marker):
+    """Chiave stabile di un marker, la stessa calcolata dalla pagina web."""
+    return f"{marker['ID']}|{marker['timestamp']}|{marker['name']}"
+
+def delta_row(marker):
+    """Riga di un marker nel formato dello snapshot (lat/lon numerici)."""
+    row = dict(marker)
+    row['lat'], row['lon'] = float(marker['lat']), float(marker['lon'])
+    return row
+
+def changes_to_ops(changes):
+    """Converte le modifiche del writer in operazioni del feed incrementale."""
+    ops = []
+    for name, args, result in changes:
+        if name == 'add':
+            ops.append({'op': 'add', 'marker': delta_row(result)})
+        elif name == 'rename':
+            ops.append({'op': 'rename', 'key': marker_key(result), 'name': args[2]})
+        elif name == 'delete':
+            ops.append({'op': 'remove', 'key': marker_key(result)})
+    return ops
+
+class ChangeLog:
+    """Registro versionato delle modifiche ai marker.
+
+    Ogni scrittura incrementa la versione e pubblica deltas/v-<versione>.json con le
+    sole operazioni di quella versione, scritto una volta sola. deltas/changelog.json
+    contiene la versione corrente e la base, la versione più vecchia da cui la catena
+    è completa: il client scarica i delta delle versioni che gli mancano e li applica
+    in ordine; se è più indietro della base ricarica lo snapshot completo. Restano
+    gli ultimi max_chain delta.
+    """
+
+    def __init__(self, directory, max_chain=50):
+        self.deltas_dir = os.path.join(directory, 'deltas')
+        self.path = os.path.join(self.deltas_dir, 'changelog.json')
+        self.max_chain = max_chain
+        self.version = 0
+        self.base = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+            self.version = int(state['version'])
+            # Formato precedente (catena nel file di stato): si riparte senza delta
+            self.base = int(state.get('base', self.version))
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.error(f"Changelog non valido, verrà azzerato: {e}")
+
+    def _save(self):
+        state = {'version': self.version, 'base': self.base}
+        atomic_write(self.path, json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+    def _delta_path(self, version):
+        return os.path.join(self.deltas_dir, f'v-{version}.json')
+
+    def reset(self):
+        """Nuova versione senza catena di delta (es. all'avvio, se il CSV è cambiato fuori dal bot)."""
+        self.version += 1
+        self.base = self.version
+        self._publish()
+        return self.version
+
+    def record(self, changes):
+        """Registra le modifiche di una scrittura e pubblica il delta. Restituisce la nuova versione."""
+        self.version += 1
+        os.makedirs(self.deltas_dir, exist_ok=True)
+        delta = {'from': self.version - 1, 'to': self.version, 'ops': changes_to_ops(changes)}
+        atomic_write(self._delta_path(self.version), json.dumps(delta, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        self.base = max(self.base, self.version - self.max_chain)
+        self._publish()
+        return self.version
+
+    def _publish(self):
+        os.makedirs(self.deltas_dir, exist_ok=True)
+        # Prima lo stato, poi la rimozione dei delta usciti dalla catena: un client
+        # non viene mai indirizzato verso un file già eliminato
+        self._save()
+        valid = {self._delta_path(v) for v in range(self.base + 1, self.version + 1)}
+        for path in glob.glob(os.path.join(self.deltas_dir, '*.json')):
+            if path != self.path and path not in valid:
+                os.remove(path)
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import json
+import logging
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from changelog import marker_key
+from snapshot import atomic_write
+from tiles import tile_coords
+
+KM_PER_DEG_LAT = 111.32
+
+# -------------- MODELLO DI PROPAGAZIONE --------------
+
+class PathLossModel:
+    """Modello log-distanza per LoRa, senza orografia.
+
+    Perdita a distanza d (km): FSPL a 1 km + 10·n·log10(d) + perdita fissa per
+    ostacoli, meno un guadagno per l'altezza dell'antenna rispetto a quella di
+    riferimento. Il margine è la potenza ricevuta meno la sensibilità del ricevitore.
+    """
+
+    # EIRP in dBm per banda (limiti ETSI tipici con antenna da 2 dBi)
+    BANDS = {'433 MHz': (433.0, 12.0), '868 MHz': (868.0, 16.0)}
+    DEFAULT_BAND = '868 MHz'
+
+    def __init__(self, exponent=3.5, clutter_db=20.0, sensitivity_dbm=-130.0,
+                 reference_height=10.0, max_radius_km=50.0):
+        self.exponent = exponent
+        self.clutter_db = clutter_db
+        self.sensitivity_dbm = sensitivity_dbm
+        self.reference_height = reference_height
+        self.max_radius_km = max_radius_km
+
+    @property
+    def signature(self):
+        """Parametri del modello: cambiano l'hash dei footprint se il modello cambia."""
+        return f"{self.exponent}|{self.clutter_db}|{self.sensitivity_dbm}|{self.reference_height}|{self.BANDS}"
+
+    def band(self, frequency):
+        return self.BANDS.get(frequency, self.BANDS[self.DEFAULT_BAND])
+
+    def _budget(self, frequency, height):
+        """Margine a 1 km in dB."""
+        mhz, eirp = self.band(frequency)
+        height_gain = 20 * math.log10(max(height, 1.0) / self.reference_height)
+        fspl_1km = 20 * math.log10(mhz) + 32.44
+        return eirp + height_gain - fspl_1km - self.clutter_db - self.sensitivity_dbm
+
+    def radius_km(self, frequency, height):
+        """Distanza oltre la quale il margine è negativo (al massimo max_radius_km)."""
+        return min(10 ** (self._budget(frequency, height) / (10 * self.exponent)), self.max_radius_km)
+
+    def margin(self, distance_km, frequency, height):
+        """Margine in dB per un array di distanze."""
+        return self._budget(frequency, height) - 10 * self.exponent * np.log10(np.maximum(distance_km, 0.05))
+
+# -------------- PNG --------------
+
+# Colori per margine in dB (soglia minima, RGBA): da segnale debole a forte
+LEGEND = [(0, (229, 57, 53, 110)), (5, (251, 140, 0, 120)), (15, (253, 216, 53, 130)), (30, (67, 160, 71, 140))]
+
+def _palette():
+    """Tabella valore -> RGBA; il valore 0 è "nessuna copertura", v > 0 è un margine di v - 1 dB."""
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    for threshold, color in LEGEND:
+        lut[threshold + 1:] = color
+    return lut
+
+PALETTE = _palette()
+
+def encode_png(rgba):
+    """Codifica un array RGBA (altezza x larghezza x 4) in PNG senza dipendenze esterne."""
+    height, width, _ = rgba.shape
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)  # byte di filtro 0 per ogni riga
+    raw[:, 1:] = rgba.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+        + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6))
+        + chunk(b'IEND', b'')
+    )
+
+# -------------- TILE DI COPERTURA --------------
+
+class CoverageBuilder:
+    """Overlay della copertura stimata in tile PNG z/x/y (shared/coverage).
+
+    Ogni marker ha un footprint calcolato dal modello di propagazione in base a
+    frequenza e altezza dell'antenna; le tile contengono, pixel per pixel, il
+    margine migliore tra i footprint che le toccano. Dopo una modifica vengono
+    ricalcolate solo le tile nel raggio dei marker toccati. Una tile è
+    identificata dall'hash dei contenuti dei suoi marker: se non cambia (rinomina,
+    riavvio del bot) la tile pubblicata viene riusata, e i raster dei singoli
+    footprint restano in una cache LRU (limitata in byte) per ricomporre le tile senza ricalcolarli.
+    """
+
+    def __init__(self, directory, zooms=range(6, 11), antenna_height=10.0, model=None,
+                 tile_size=256, cache_bytes=48 * 1024 * 1024, canvas_cache=256):
+        self.root = os.path.join(directory, 'coverage')
+        self.zooms = list(zooms)
+        self.antenna_height = antenna_height
+        self.model = model or PathLossModel()
+        self.tile_size = tile_size
+        self.cache_bytes = cache_bytes
+        self.canvas_cache = canvas_cache
+        # Cache LRU limitata in byte delle finestre dei footprint ((hash, tile) -> (r0, c0, valori))
+        self._cache = collections.OrderedDict()
+        self._cache_size = 0
+        # Ultime tile composte (tile -> (hash presenti, valori)), per sovrapporre solo i marker aggiunti
+        self._canvases = collections.OrderedDict()
+        # Per livello: tile pubblicate e tile calcolate senza copertura ("x/y" -> hash)
+        self._hashes, self._empty = {}, {}
+        for z in self.zooms:
+            self._hashes[z], self._empty[z] = self._load_index(z)
+        self._reset()
+
+    def _reset(self):
+        self._markers = {}     # chiave marker -> hash footprint
+        self._footprints = {}  # hash footprint -> [lat, lon, frequenza, tile toccate, marker]
+        self._members = {}     # tile -> Counter degli hash footprint
+
+    def _load_index(self, z):
+        try:
+            with open(os.path.join(self.root, str(z), 'index.json'), encoding='utf-8') as f:
+                index = json.load(f)
+            return index['tiles'], index.get('empty', {})
+        except (OSError, ValueError, KeyError):
+            return {}, {}
+
+    def footprint_hash(self, marker):
+        """Hash del contenuto che determina la copertura: posizione, frequenza, altezza e modello."""
+        lat, lon = float(marker['lat']), float(marker['lon'])
+        text = f"{lat:.6f}|{lon:.6f}|{marker.get('frequency', '')}|{self.antenna_height}|{self.model.signature}"
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+    def _footprint_tiles(self, lat, lon, frequency):
+        radius = self.model.radius_km(frequency, self.antenna_height)
+        dlat = radius / KM_PER_DEG_LAT
+        dlon = radius / (KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+        tiles = []
+        for z in self.zooms:
+            x0, y0 = tile_coords(lat + dlat, lon - dlon, z)
+            x1, y1 = tile_coords(lat - dlat, lon + dlon, z)
+            tiles.extend((z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+        return tiles
+
+    def _insert(self, marker):
+        digest = self.footprint_hash(marker)
+        key = marker_key(marker)
+        touched = self._remove(key)  # una modifica già vista (es. durante la ricostruzione) non viene contata due volte
+        self._markers[key] = digest
+        if digest not in self._footprints:
+            lat, lon, frequency = float(marker['lat']), float(marker['lon']), marker.get('frequency', '')
+            self._footprints[digest] = [lat, lon, frequency, self._footprint_tiles(lat, lon, frequency), 0]
+        footprint = self._footprints[digest]
+        footprint[4] += 1
+        for tile in footprint[3]:
+            self._members.setdefault(tile, collections.Counter())[digest] += 1
+        return touched | set(footprint[3])
+
+    def _remove(self, key):
+        digest = self._markers.pop(key, None)
+        if digest is None:
+            return set()
+        footprint = self._footprints[digest]
+        footprint[4] -= 1
+        for tile in footprint[3]:
+            members = self._members[tile]
+            members[digest] -= 1
+            if members[digest] <= 0:
+                del members[digest]
+            if not members:
+                del self._members[tile]
+        if footprint[4] <= 0:
+            del self._footprints[digest]
+        return set(footprint[3])
+
+    # -------------- RENDERING --------------
+
+    def _pixel_centres(self, tile):
+        """Latitudini delle righe e longitudini delle colonne dei pixel della tile."""
+        z, x, y = tile
+        n = float(1 << z)
+        steps = (np.arange(self.tile_size) + 0.5) / self.tile_size
+        lons = (x + steps) / n * 360.0 - 180.0
+        lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y + steps) / n))))
+        return lats, lons
+
+    def _cache_get(self, key):
+        entry = self._cache.get(key)
+        if entry is not None:
+            self._cache.move_to_end(key)
+            return entry[0]
+        return None
+
+    def _cache_put(self, key, value, nbytes):
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cache_size -= old[1]
+        self._cache[key] = (value, nbytes)
+        self._cache_size += nbytes
+        while self._cache_size > self.cache_bytes:
+            _, (_, size) = self._cache.popitem(last=False)
+            self._cache_size -= size
+
+    def _raster(self, digest, tile, lats, lons):
+        """Finestra (r0, c0, valori) del footprint nella tile, () se non la copre."""
+        window = self._cache_get((digest, tile))
+        if window is not None:
+            return window
+
+        lat, lon, frequency = self._footprints[digest][:3]
+        radius = self.model.radius_km(frequency, self.antenna_height)
+        km_per_deg_lon = KM_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01)
+        dlat, dlon = radius / KM_PER_DEG_LAT, radius / km_per_deg_lon
+        # Solo i pixel nel riquadro del raggio (le latitudini delle righe sono decrescenti)
+        r0 = int(np.searchsorted(-lats, -(lat + dlat)))
+        r1 = int(np.searchsorted(-lats, -(lat - dlat), side='right'))
+        c0 = int(np.searchsorted(lons, lon - dlon))
+        c1 = int(np.searchsorted(lons, lon + dlon, side='right'))
+        window = ()
+        if r1 > r0 and c1 > c0:
+            dy = (lats[r0:r1, None] - lat) * KM_PER_DEG_LAT
+            dx = (lons[None, c0:c1] - lon) * km_per_deg_lon
+            margin = self.model.margin(np.hypot(dx, dy), frequency, self.antenna_height)
+            # Margine negativo -> 0 (nessuna copertura), altrimenti margine + 1
+            window = (r0, c0, np.clip(margin + 1, 0, 255).astype(np.uint8))
+        self._cache_put((digest, tile), window, window[2].nbytes if window else 0)
+        return window
+
+    def _render(self, tile, members):
+        # Se la tile composta è in cache e sono stati solo aggiunti marker basta
+        # sovrapporre i nuovi footprint; altrimenti si ricompone da zero
+        cached = self._canvases.pop(tile, None)
+        if cached is not None and cached[0] <= members.keys():
+            canvas, todo = cached[1].copy(), members.keys() - cached[0]
+        else:
+            canvas, todo = np.zeros((self.tile_size, self.tile_size), dtype=np.uint8), members.keys()
+        if todo:
+            lats, lons = self._pixel_centres(tile)
+        for digest in todo:
+            window = self._raster(digest, tile, lats, lons)
+            if not window:
+                continue
+            r0, c0, values = window
+            target = canvas[r0:r0 + values.shape[0], c0:c0 + values.shape[1]]
+            np.maximum(target, values, out=target)
+        self._canvases[tile] = (frozenset(members), canvas)
+        if len(self._canvases) > self.canvas_cache:
+            self._canvases.popitem(last=False)
+        if not canvas.any():
+            return None
+        return encode_png(PALETTE[canvas])
+
+    def _tile_hash(self, tile, members):
+        text = '/'.join(map(str, tile)) + '|' + ','.join(sorted(members))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+    def _write_tiles(self, tiles):
+        """Ricalcola le tile indicate se il loro hash è cambiato. Restituisce (calcolate, riusate)."""
+        rendered = reused = 0
+        zooms = set()
+        for tile in tiles:
+            z, x, y = tile
+            name = f'{x}/{y}'
+            path = os.path.join(self.root, str(z), str(x), f'{y}.png')
+            members = self._members.get(tile)
+            if not members:
+                if self._empty[z].pop(name, None) is not None:
+                    zooms.add(z)
+                if self._hashes[z].pop(name, None) is not None:
+                    zooms.add(z)
+                    if os.path.exists(path):
+                        os.remove(path)
+                continue
+
+            digest = self._tile_hash(tile, members)
+            if self._empty[z].get(name) == digest or (self._hashes[z].get(name) == digest and os.path.exists(path)):
+                reused += 1
+                continue
+
+            data = self._render(tile, members)
+            rendered += 1
+            zooms.add(z)
+            if data is None:
+                self._empty[z][name] = digest
+                self._hashes[z].pop(name, None)
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            self._empty[z].pop(name, None)
+            self._hashes[z][name] = digest
+            atomic_write(path, data)
+
+        # Indice per livello: tile con copertura e hash del contenuto
+        for z in zooms:
+            index = {'z': z, 'tile_size': self.tile_size, 'legend': LEGEND, 'tiles': self._hashes[z], 'empty': self._empty[z]}
+            atomic_write(
+                os.path.join(self.root, str(z), 'index.json'),
+                json.dumps(index, separators=(',', ':')).encode('utf-8')
+            )
+        return rendered, reused
+
+    def rebuild(self, markers):
+        """Ricalcola l'overlay per tutti i marker, riusando le tile pubblicate ancora valide."""
+        self._reset()
+        for marker in markers:
+            try:
+                self._insert(marker)
+            except (KeyError, ValueError):
+                continue
+        # Le tile pubblicate che non contengono più marker vengono rimosse
+        stale = {(z, *map(int, name.split('/'))) for z in self.zooms for name in {**self._hashes[z], **self._empty[z]}}
+        rendered, reused = self._write_tiles(set(self._members) | stale)
+        logging.info(f"Copertura ricostruita: {rendered} tile calcolate, {reused} riusate per {len(self._markers)} marker")
+        return rendered, reused
+
+    def update(self, changes):
+        """Ricalcola solo le tile nel raggio dei marker aggiunti o eliminati."""
+        touched = set()
+        for name, args, result in changes:
+            try:
+                if name == 'add':
+                    touched |= self._insert(result)
+                elif name == 'delete':
+                    touched |= self._remove(marker_key(result))
+                elif name == 'rename':
+                    # Stessa posizione: cambia solo la chiave del marker
+                    digest = self._markers.pop(marker_key(result), None)
+                    if digest is not None:
+                        self._markers[marker_key(dict(result, name=args[2]))] = digest
+            except (KeyError, ValueError):
+                continue
+        return self._write_tiles(touched)
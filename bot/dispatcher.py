@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+MAX_MESSAGE_LENGTH = 4096
+PRUNE_MIN_BUCKETS = 1024
+
+class TokenBucket:
+    """Limitatore a gettoni: rate gettoni al secondo, fino a capacity accumulati."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Secondi da attendere prima che ci sia un gettone disponibile."""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class _Outgoing:
+    __slots__ = ('text', 'kwargs', 'attempts', 'not_before')
+
+    def __init__(self, text, kwargs):
+        self.text = text
+        self.kwargs = kwargs
+        self.attempts = 0
+        self.not_before = 0
+
+class MessageDispatcher:
+    """Invio dei messaggi in uscita in background, fuori dal percorso degli handler.
+
+    I messaggi vengono accodati per chat e inviati rispettando un limite globale
+    e uno per chat (token bucket). In caso di RetryAfter l'invio viene sospeso per
+    il tempo indicato da Telegram, sugli errori di rete si riprova con backoff
+    esponenziale. digest() raggruppa i messaggi che arrivano a raffica verso la
+    stessa chat in un unico messaggio.
+    Le chat con messaggi in coda sono in un min-heap ordinato per istante in cui
+    possono inviare, così la scelta della prossima chat costa O(log n) anche con
+    migliaia di chat in coda (annunci a tutti gli utenti).
+    on_send(secondi, esito), se indicata, viene chiamata dopo ogni chiamata a
+    Telegram con esito 'ok', 'retry_after', 'bad_request', 'network' o 'error'.
+    """
+
+    def __init__(self, global_rate=25, per_chat_rate=1, per_chat_burst=3,
+                 digest_window=3.0, max_retries=5, backoff=1.0, max_concurrency=8, on_send=None):
+        self.on_send = on_send
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.digest_window = digest_window
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._bot = None
+        self._pending = {}  # chat_id -> deque di _Outgoing
+        self._ready = []  # heap di (pronta dal, seq, chat_id), una voce per chat in coda e non in invio
+        self._scheduled = set()
+        self._seq = itertools.count()
+        self._buckets = {}
+        self._prune_at = PRUNE_MIN_BUCKETS
+        self._inflight = set()
+        self._delivery_tasks = set()
+        self._digests = {}  # (chat_id, header) -> lista di testi
+        self._digest_tasks = set()
+        self._paused_until = 0
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.sent = 0
+        self.failed = 0
+
+    def start(self, bot):
+        self._bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=10):
+        """Invia i digest in sospeso e attende lo svuotamento della coda (al massimo timeout secondi)."""
+        for task in list(self._digest_tasks):
+            task.cancel()
+        for key in list(self._digests):
+            self._flush_digest(key)
+
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def pending(self):
+        return sum(len(queue) for queue in self._pending.values())
+
+    # -------------- ACCODAMENTO --------------
+
+    def send(self, chat_id, text, **kwargs):
+        """Accoda un messaggio e ritorna subito."""
+        self._pending.setdefault(chat_id, collections.deque()).append(_Outgoing(text, kwargs))
+        self._schedule(chat_id, time.monotonic())
+        self._wakeup.set()
+
+    def broadcast(self, chat_ids, text, **kwargs):
+        """Accoda lo stesso messaggio per più chat (es. annunci a tutti gli utenti)."""
+        for chat_id in chat_ids:
+            self.send(chat_id, text, **kwargs)
+
+    def digest(self, chat_id, text, header=''):
+        """Accoda un testo da raggruppare con gli altri arrivati entro digest_window."""
+        key = (chat_id, header)
+        if key not in self._digests:
+            self._digests[key] = []
+            task = asyncio.create_task(self._digest_later(key))
+            self._digest_tasks.add(task)
+            task.add_done_callback(self._digest_tasks.discard)
+        self._digests[key].append(text)
+
+    async def _digest_later(self, key):
+        await asyncio.sleep(self.digest_window)
+        self._flush_digest(key)
+
+    def _flush_digest(self, key):
+        texts = self._digests.pop(key, None)
+        if not texts:
+            return
+        chat_id, header = key
+        if len(texts) > 1:
+            header = f"{header} ({len(texts)} eventi)" if header else f"({len(texts)} eventi)"
+
+        # Divide il digest in più messaggi se supera il limite di Telegram
+        chunk = header
+        for text in texts:
+            candidate = f"{chunk}\n\n{text}" if chunk else text
+            if len(candidate) > MAX_MESSAGE_LENGTH and chunk:
+                self.send(chat_id, chunk)
+                candidate = text
+            chunk = candidate[:MAX_MESSAGE_LENGTH]
+        if chunk:
+            self.send(chat_id, chunk)
+
+    # -------------- INVIO --------------
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self._prune_at:
+                self._prune_buckets()
+            bucket = self._buckets[chat_id] = TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        return bucket
+
+    def _prune_buckets(self):
+        """Elimina i bucket pieni delle chat senza messaggi: sono uguali a un bucket nuovo."""
+        now = time.monotonic()
+        self._buckets = {
+            chat_id: bucket for chat_id, bucket in self._buckets.items()
+            if chat_id in self._pending or chat_id in self._inflight or not bucket.is_full(now)
+        }
+        # Soglia doppia: il costo della pulizia resta costante per chat servita
+        self._prune_at = max(PRUNE_MIN_BUCKETS, 2 * len(self._buckets))
+
+    def _schedule(self, chat_id, now):
+        """Mette la chat nell'heap con l'istante in cui potrà inviare il prossimo messaggio."""
+        if chat_id in self._scheduled or chat_id in self._inflight or chat_id not in self._pending:
+            return
+        wait = max(self._chat_bucket(chat_id).wait_time(now), self._pending[chat_id][0].not_before - now)
+        heapq.heappush(self._ready, (now + wait, next(self._seq), chat_id))
+        self._scheduled.add(chat_id)
+
+    def _next_ready(self, now):
+        """La chat che può inviare prima. Restituisce (chat_id, attesa in secondi)."""
+        if not self._ready:
+            return None, None
+        ready, _, chat_id = self._ready[0]
+        return chat_id, max(ready - now, self.global_bucket.wait_time(now), self._paused_until - now)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            chat_id, wait = self._next_ready(time.monotonic())
+            if chat_id is None:
+                await self._wakeup.wait()
+                continue
+            if wait > 0:
+                # Un nuovo messaggio può cambiare la chat da servire per prima
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._semaphore.acquire()
+            # Durante l'attesa del semaforo la chat in cima può essere cambiata
+            now = time.monotonic()
+            chat_id, wait = self._next_ready(now)
+            if chat_id is None or wait > 0:
+                self._semaphore.release()
+                continue
+            heapq.heappop(self._ready)
+            self._scheduled.discard(chat_id)
+            self.global_bucket.consume(now)
+            self._chat_bucket(chat_id).consume(now)
+            item = self._pending[chat_id].popleft()
+            if not self._pending[chat_id]:
+                del self._pending[chat_id]
+            self._inflight.add(chat_id)
+            task = asyncio.create_task(self._deliver(chat_id, item))
+            self._delivery_tasks.add(task)
+            task.add_done_callback(self._delivery_tasks.discard)
+
+    def _requeue(self, chat_id, item):
+        self._pending.setdefault(chat_id, collections.deque()).appendleft(item)
+
+    async def _deliver(self, chat_id, item):
+        started, outcome = time.perf_counter(), 'error'
+        try:
+            await self._bot.send_message(chat_id=chat_id, text=item.text, **item.kwargs)
+            self.sent += 1
+            outcome = 'ok'
+        except RetryAfter as e:
+            outcome = 'retry_after'
+            # Limite di Telegram: sospende tutti gli invii per il tempo richiesto
+            retry_after = e.retry_after
+            if hasattr(retry_after, 'total_seconds'):
+                retry_after = retry_after.total_seconds()
+            logging.warning(f"RetryAfter da Telegram, invii sospesi per {retry_after}s")
+            self._paused_until = time.monotonic() + retry_after
+            self._requeue(chat_id, item)
+        except BadRequest as e:
+            outcome = 'bad_request'
+            self.failed += 1
+            logging.error(f"Messaggio a {chat_id} rifiutato: {e}")
+        except NetworkError as e:
+            outcome = 'network'
+            item.attempts += 1
+            if item.attempts > self.max_retries:
+                self.failed += 1
+                logging.error(f"Invio a {chat_id} fallito dopo {self.max_retries} tentativi: {e}")
+            else:
+                item.not_before = time.monotonic() + self.backoff * 2 ** (item.attempts - 1)
+                self._requeue(chat_id, item)
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Errore invio messaggio a {chat_id}: {e}")
+        finally:
+            if self.on_send is not None:
+                self.on_send(time.perf_counter() - started, outcome)
+            self._inflight.discard(chat_id)
+            self._schedule(chat_id, time.monotonic())
+            self._semaphore.release()
+            self._wakeup.set()
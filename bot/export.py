@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+
+from marker_store import FIELDNAMES
+
+FORMATS = {'csv': 'csv', 'geojson': 'geojson', 'ndjson': 'ndjson'}
+CHUNK_ROWS = 500  # righe codificate insieme prima di scriverle sul file
+
+def parse_date(value, end=False):
+    """Converte AAAA-MM-GG in timestamp (inizio del giorno, o fine se end)."""
+    start = time.mktime(time.strptime(value, '%Y-%m-%d'))
+    return int(start) + (86400 if end else 0)
+
+def parse_export_args(args):
+    """Interpreta gli argomenti di /export.
+
+    Esempio: /export geojson gz type=MeshCore freq=868 bbox=45,9.5,46,10.8 from=2025-01-01 to=2025-01-31
+    Restituisce (formato, gzip, filtri); solleva ValueError con un messaggio leggibile.
+    """
+    fmt, compress, filters = 'csv', False, {}
+    for arg in args:
+        key, _, value = arg.partition('=')
+        key = key.lower()
+        if not value and key in FORMATS:
+            fmt = key
+        elif not value and key in ('gz', 'gzip'):
+            compress = True
+        elif key in ('type', 'node_type'):
+            filters['node_type'] = value
+        elif key in ('freq', 'frequency'):
+            filters['frequency'] = value
+        elif key == 'bbox':
+            try:
+                lat1, lon1, lat2, lon2 = (float(v) for v in value.split(','))
+            except ValueError:
+                raise ValueError("bbox deve essere lat1,lon1,lat2,lon2")
+            filters['bbox'] = (min(lat1, lat2), min(lon1, lon2), max(lat1, lat2), max(lon1, lon2))
+        elif key in ('from', 'to'):
+            try:
+                filters['since' if key == 'from' else 'until'] = parse_date(value, end=key == 'to')
+            except ValueError:
+                raise ValueError(f"Data non valida per {key}: usa AAAA-MM-GG")
+        else:
+            raise ValueError(f"Argomento non riconosciuto: {arg}")
+    return fmt, compress, filters
+
+def filter_markers(markers, node_type=None, frequency=None, bbox=None, since=None, until=None):
+    """Generatore dei marker che rispettano i filtri (confronti case-insensitive per tipo e frequenza)."""
+    node_type = node_type.lower() if node_type else None
+    frequency = frequency.lower() if frequency else None
+    for marker in markers:
+        if node_type and marker.get('node_type', '').lower() != node_type:
+            continue
+        # "868" trova anche "868 MHz"
+        if frequency and not marker.get('frequency', '').lower().startswith(frequency):
+            continue
+        if bbox:
+            try:
+                lat, lon = float(marker['lat']), float(marker['lon'])
+            except ValueError:
+                continue
+            if not (bbox[0] <= lat <= bbox[2] and bbox[1] <= lon <= bbox[3]):
+                continue
+        if since is not None or until is not None:
+            try:
+                timestamp = int(float(marker.get('timestamp', '')))
+            except ValueError:
+                continue
+            if (since is not None and timestamp < since) or (until is not None and timestamp >= until):
+                continue
+        yield marker
+
+# -------------- CODIFICA --------------
+
+def _numeric(marker):
+    row = {field: marker.get(field, '') for field in FIELDNAMES}
+    row['lat'], row['lon'] = float(marker['lat']), float(marker['lon'])
+    return row
+
+def _with_coordinates(markers):
+    """Solo i marker con coordinate numeriche (GeoJSON e NDJSON le scrivono come numeri)."""
+    for marker in markers:
+        try:
+            float(marker['lat']), float(marker['lon'])
+        except (KeyError, ValueError):
+            continue
+        yield marker
+
+def _csv_chunks(markers):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FIELDNAMES, extrasaction='ignore')
+    writer.writeheader()
+    for i, marker in enumerate(markers, 1):
+        writer.writerow(marker)
+        if i % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _ndjson_chunks(markers):
+    lines = []
+    for marker in markers:
+        lines.append(json.dumps(_numeric(marker), ensure_ascii=False))
+        if len(lines) == CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def _geojson_chunks(markers):
+    yield '{"type":"FeatureCollection","features":['
+    separator = ''
+    features = []
+    for marker in markers:
+        row = _numeric(marker)
+        lat, lon = row.pop('lat'), row.pop('lon')
+        features.append(json.dumps({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': row,
+        }, ensure_ascii=False, separators=(',', ':')))
+        if len(features) == CHUNK_ROWS:
+            yield separator + ','.join(features)
+            separator, features = ',', []
+    if features:
+        yield separator + ','.join(features)
+    yield ']}'
+
+ENCODERS = {'csv': _csv_chunks, 'geojson': _geojson_chunks, 'ndjson': _ndjson_chunks}
+
+class _Counter:
+    """Conta i marker che attraversano il generatore (dopo tutti i filtri, quindi quelli esportati)."""
+
+    def __init__(self, markers):
+        self.markers = markers
+        self.count = 0
+
+    def __iter__(self):
+        for marker in self.markers:
+            self.count += 1
+            yield marker
+
+def export_markers(markers, fmt='csv', compress=False, directory=None, **filters):
+    """Scrive l'esportazione in un file temporaneo, un blocco alla volta.
+
+    markers è un iterabile (es. store.iter_all()); il risultato non viene mai
+    tenuto tutto in memoria. Restituisce (percorso, nome file, marker esportati);
+    il file va eliminato dal chiamante.
+    """
+    if fmt not in ENCODERS:
+        raise ValueError(f"Formato sconosciuto: {fmt}")
+    filename = f"markers_export.{FORMATS[fmt]}" + ('.gz' if compress else '')
+    fd, path = tempfile.mkstemp(suffix='-' + filename, dir=directory)
+    selected = filter_markers(markers, **filters)
+    if fmt != 'csv':
+        selected = _with_coordinates(selected)
+    counter = _Counter(selected)
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            stream = gzip.GzipFile(filename=filename[:-3], mode='wb', fileobj=raw) if compress else raw
+            # Il CSV mantiene il BOM come dati.csv, per l'apertura corretta in Excel
+            encoding = 'utf-8-sig' if fmt == 'csv' else 'utf-8'
+            with io.TextIOWrapper(stream, encoding=encoding, newline='') as out:
+                for chunk in ENCODERS[fmt](counter):
+                    out.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, filename, counter.count
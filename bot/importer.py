@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import io
+import json
+import math
+import time
+
+import pandas as pd
+
+from marker_store import FIELDNAMES
+from search import fold
+
+URL_PATTERN = r'^https?://[^\s]+$'
+
+def load_document(data, filename):
+    """Legge un CSV o un GeoJSON (FeatureCollection di punti) in un DataFrame di stringhe.
+
+    La colonna 'row' contiene il numero di riga del CSV (o della feature) per il report.
+    """
+    if filename.lower().endswith(('.geojson', '.json')):
+        collection = json.loads(data.decode('utf-8-sig'))
+        rows = []
+        for feature in collection.get('features', []):
+            row = dict(feature.get('properties') or {})
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') == 'Point' and len(geometry.get('coordinates', [])) >= 2:
+                row['lon'], row['lat'] = geometry['coordinates'][:2]
+            rows.append(row)
+        df = pd.DataFrame(rows, dtype=object).fillna('').astype(str)
+        df['row'] = range(1, len(df) + 1)
+    else:
+        df = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False, encoding='utf-8-sig')
+        df['row'] = range(2, len(df) + 2)  # la riga 1 è l'intestazione
+
+    # Nomi delle colonne senza distinzione tra maiuscole e minuscole
+    columns = {field.lower(): field for field in FIELDNAMES}
+    df = df.rename(columns=lambda c: columns.get(str(c).strip().lower(), c))
+    for field in FIELDNAMES:
+        if field not in df:
+            df[field] = ''
+    return df
+
+def _choices(values):
+    """Mappa i valori ammessi in minuscolo (anche senza " MHz") sul valore canonico."""
+    lookup = {}
+    for value in values:
+        lookup[value.lower()] = value
+        lookup[value.lower().replace(' mhz', '')] = value
+    return lookup
+
+def validate(df, existing, *, clean, node_types, frequencies, max_name, max_desc, max_link,
+             limit_for, default_id, default_user, now=None):
+    """Valida tutte le righe con operazioni vettoriali sulle colonne.
+
+    existing sono i marker già presenti (per duplicati e limiti per utente);
+    limit_for(uid) restituisce il numero massimo di marker dell'utente, None
+    se senza limite. Restituisce (marker validi, report degli errori) dove il
+    report è un DataFrame con colonne row, name, errors.
+    """
+    now = int(now or time.time())
+    checks = []
+
+    lat = pd.to_numeric(df['lat'].str.strip(), errors='coerce')
+    lon = pd.to_numeric(df['lon'].str.strip(), errors='coerce')
+    checks.append((~lat.between(-90, 90), "latitudine non valida"))
+    checks.append((~lon.between(-180, 180), "longitudine non valida"))
+
+    name = df['name'].map(clean)
+    desc = df['desc'].map(clean)
+    checks.append((name == '', "nome mancante"))
+    checks.append((name.str.len() > max_name, f"nome oltre {max_name} caratteri"))
+    checks.append((desc.str.len() > max_desc, f"descrizione oltre {max_desc} caratteri"))
+
+    node_type = df['node_type'].str.strip().str.lower().map(_choices(node_types))
+    frequency = df['frequency'].str.strip().str.lower().map(_choices(frequencies))
+    checks.append((node_type.isna(), "tipo di nodo non valido"))
+    checks.append((frequency.isna(), "frequenza non valida"))
+
+    link = df['link'].str.strip()
+    checks.append(((link != '') & ~link.str.match(URL_PATTERN), "link non valido"))
+    checks.append((link.str.len() > max_link, f"link oltre {max_link} caratteri"))
+
+    # Senza ID il marker viene assegnato all'admin che importa
+    uid = df['ID'].str.strip().replace('', str(default_id))
+    user = df['user'].str.strip()
+    user = user.mask(user == '', uid.eq(str(default_id)).map({True: default_user, False: 'anonimo'}))
+    checks.append((~uid.str.isdigit(), "ID utente non valido"))
+
+    timestamp = pd.to_numeric(df['timestamp'].str.strip(), errors='coerce').fillna(now).astype('int64')
+
+    # Duplicati rispetto ai marker esistenti e all'interno del file, con lo stesso
+    # confronto dei nomi di /add (fold: senza maiuscole né accenti)
+    key = pd.MultiIndex.from_arrays([uid, name.map(fold)])
+    position = lat.round(5).astype(str) + ',' + lon.round(5).astype(str)
+    existing_keys = {(m['ID'], fold(m['name'])) for m in existing}
+    existing_positions = set()
+    for m in existing:
+        try:
+            existing_positions.add(f"{round(float(m['lat']), 5)},{round(float(m['lon']), 5)}")
+        except ValueError:
+            continue
+    checks.append((pd.Series(key.isin(existing_keys), index=df.index), "l'utente ha già un marker con questo nome"))
+    checks.append((pd.Series(key.duplicated(), index=df.index), "nome duplicato nel file per lo stesso utente"))
+    checks.append((position.isin(existing_positions), "esiste già un marker in questa posizione"))
+    checks.append((position.duplicated() & lat.notna() & lon.notna(), "posizione duplicata nel file"))
+
+    # Limite per utente: conta solo le righe altrimenti valide, in ordine di file
+    valid = ~pd.concat([mask.fillna(True) for mask, _ in checks], axis=1).any(axis=1)
+    existing_counts = pd.Series([m['ID'] for m in existing], dtype=object).value_counts()
+    limits = uid.map({u: math.inf if limit_for(u) is None else limit_for(u) for u in uid.unique()})
+    taken = uid.map(existing_counts).fillna(0) + valid.groupby(uid).cumsum()
+    checks.append((valid & (taken > limits), "limite di marker per l'utente superato"))
+
+    masks = pd.concat([mask.fillna(True).rename(message) for mask, message in checks], axis=1)
+    invalid = masks.any(axis=1)
+
+    accepted = pd.DataFrame({
+        'lat': lat.astype(str), 'lon': lon.astype(str), 'name': name, 'desc': desc,
+        'node_type': node_type, 'frequency': frequency, 'link': link,
+        'ID': uid, 'user': user, 'timestamp': timestamp.astype(str),
+    })[~invalid]
+    markers = accepted[FIELDNAMES].to_dict('records')
+
+    failed = masks[invalid]
+    report = pd.DataFrame({
+        'row': df['row'][invalid],
+        'name': df['name'][invalid],
+        'errors': failed.apply(lambda r: '; '.join(failed.columns[r.to_numpy()]), axis=1) if len(failed) else pd.Series(dtype=str),
+    })
+    return markers, report
+
+def report_csv(report):
+    """Report degli errori come CSV (riga, nome, errori)."""
+    return report.rename(columns={'row': 'riga', 'name': 'nome', 'errors': 'errori'}).to_csv(index=False).encode('utf-8-sig')
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+import httpx
+
+from changelog import ChangeLog
+from snapshot import SNAPSHOT_FIELDS, SnapshotPublisher
+
+USER_AGENT = "LoRaBS-map/2.0 (+https://github.com/BadCactus634/LoRaBS-map)"
+
+# -------------- NORMALIZZAZIONE --------------
+
+def _frequency(value):
+    """Banda in MHz nel formato dei marker ("868 MHz", "433 MHz")."""
+    if value in (None, ''):
+        return ''
+    text = str(value).upper()
+    if '868' in text or '869' in text or 'EU_868' in text:
+        return '868 MHz'
+    if '433' in text or 'EU_433' in text:
+        return '433 MHz'
+    try:
+        mhz = float(value)
+    except ValueError:
+        return str(value)
+    if 863 <= mhz <= 870:
+        return '868 MHz'
+    if 433 <= mhz <= 435:
+        return '433 MHz'
+    return f"{mhz:g} MHz"
+
+def _timestamp(value):
+    """Timestamp in secondi da epoch, da numero (anche in ms) o data ISO."""
+    if value in (None, ''):
+        return ''
+    try:
+        number = float(value)
+        return str(int(number / 1000 if number > 1e11 else number))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return str(int(datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()))
+    except ValueError:
+        return ''
+
+def _first(item, *keys, default=None):
+    for key in keys:
+        if item.get(key) not in (None, ''):
+            return item[key]
+    return default
+
+MESHCORE_TYPES = {1: 'Companion', 2: 'Repeater', 3: 'Room server', 4: 'Sensore'}
+
+def normalize_meshcore(node):
+    """Nodo della mappa MeshCore (campi adv_*) nel formato dei marker."""
+    key = _first(node, 'public_key', 'id')
+    lat, lon = _first(node, 'adv_lat', 'lat', 'latitude'), _first(node, 'adv_lon', 'lon', 'longitude')
+    if key is None or lat is None or lon is None:
+        return None
+    params = node.get('params') or {}
+    return {
+        'lat': float(lat),
+        'lon': float(lon),
+        'name': str(_first(node, 'adv_name', 'name', default='')),
+        'desc': MESHCORE_TYPES.get(node.get('type'), str(node.get('type', ''))),
+        'node_type': 'MeshCore',
+        'frequency': _frequency(_first(params, 'freq', default=node.get('freq'))),
+        'link': '',
+        'ID': f"meshcore:{str(key)[:16]}",
+        'user': 'meshcore',
+        'timestamp': _timestamp(_first(node, 'last_advert', 'updated_at', 'inserted_at')),
+    }
+
+def normalize_loraitalia(node):
+    """Nodo Meshtastic della mappa LoRa Italia nel formato dei marker.
+
+    Accetta coordinate in gradi (latitude/longitude) o intere (latitude_i * 1e-7).
+    """
+    key = _first(node, 'node_id', 'id', 'num')
+    lat = _first(node, 'latitude', 'lat')
+    lon = _first(node, 'longitude', 'lon')
+    if lat is None and node.get('latitude_i') is not None:
+        lat, lon = node['latitude_i'] / 1e7, node.get('longitude_i', 0) / 1e7
+    if key is None or lat is None or lon is None:
+        return None
+    return {
+        'lat': float(lat),
+        'lon': float(lon),
+        'name': str(_first(node, 'long_name', 'longName', 'name', 'short_name', default='')),
+        'desc': str(_first(node, 'hw_model', 'hwModel', 'role', default='')),
+        'node_type': 'Mehstastic',
+        'frequency': _frequency(_first(node, 'region', 'frequency')),
+        'link': '',
+        'ID': f"loraitalia:{key}",
+        'user': 'loraitalia',
+        'timestamp': _timestamp(_first(node, 'last_heard', 'updated_at', 'lastHeard')),
+    }
+
+def extract_items(payload):
+    """Elenco dei nodi da una risposta JSON: lista, {"nodes": [...]}, {"data": [...]} o GeoJSON."""
+    if isinstance(payload, dict):
+        if payload.get('type') == 'FeatureCollection':
+            items = []
+            for feature in payload.get('features', []):
+                item = dict(feature.get('properties') or {})
+                coordinates = (feature.get('geometry') or {}).get('coordinates') or []
+                if len(coordinates) >= 2:
+                    item.setdefault('lon', coordinates[0])
+                    item.setdefault('lat', coordinates[1])
+                items.append(item)
+            return items
+        payload = _first(payload, 'nodes', 'data', 'results', default=[])
+    return payload if isinstance(payload, list) else []
+
+NORMALIZERS = {'meshcore': normalize_meshcore, 'loraitalia': normalize_loraitalia}
+
+# -------------- DIFF --------------
+
+def diff_nodes(previous, current):
+    """Confronta due pull (ID -> riga) e restituisce le modifiche nel formato del writer.
+
+    Un nodo è cambiato se differisce in un campo diverso dal timestamp: in quel
+    caso viene rimosso e aggiunto di nuovo. Ai nodi invariati resta il timestamp
+    della pull precedente, così un semplice "ultimo contatto" non genera scritture.
+    """
+    changes = []
+    for key, row in current.items():
+        old = previous.get(key)
+        if old is None:
+            changes.append(('add', (row,), row))
+        elif any(old.get(f) != row.get(f) for f in SNAPSHOT_FIELDS if f != 'timestamp'):
+            changes.append(('delete', (), old))
+            changes.append(('add', (row,), row))
+        else:
+            current[key] = old
+    for key, old in previous.items():
+        if key not in current:
+            changes.append(('delete', (), old))
+    return changes
+
+# -------------- SORGENTI --------------
+
+class Source:
+    """Una rete esterna: URL, normalizzazione e file del layer pubblicato.
+
+    Il layer usa lo stesso formato dei marker del bot: <directory>/<nome>/snapshot.json
+    (con .gz/.br) e i delta in <directory>/<nome>/deltas/.
+    """
+
+    def __init__(self, name, url, directory, normalize=None, bbox=None):
+        self.name = name
+        self.url = url
+        self.normalize = normalize or NORMALIZERS[name]
+        self.bbox = bbox
+        layer_dir = os.path.join(directory, name)
+        self.publisher = SnapshotPublisher(layer_dir)
+        self.changelog = ChangeLog(layer_dir)
+        self.etag = None
+        self.last_modified = None
+        self.nodes = self._load_previous()
+
+    def _load_previous(self):
+        """Ricostruisce l'ultima pull dal layer già pubblicato (base per il diff dopo un riavvio)."""
+        try:
+            with open(self.publisher.path, encoding='utf-8') as f:
+                columns = json.load(f)['columns']
+        except (OSError, ValueError, KeyError):
+            return {}
+        rows = [dict(zip(SNAPSHOT_FIELDS, values)) for values in zip(*(columns[f] for f in SNAPSHOT_FIELDS))]
+        return {row['ID']: row for row in rows}
+
+    def parse(self, payload):
+        nodes = {}
+        for item in extract_items(payload):
+            try:
+                row = self.normalize(item)
+            except (TypeError, ValueError, AttributeError):
+                row = None
+            if row is None:
+                continue
+            if self.bbox and not (self.bbox[0] <= row['lat'] <= self.bbox[2] and self.bbox[1] <= row['lon'] <= self.bbox[3]):
+                continue
+            nodes[row['ID']] = row
+        return nodes
+
+    def publish(self, changes):
+        version = self.changelog.record(changes)
+        self.publisher.publish(sorted(self.nodes.values(), key=lambda row: row['ID']), version)
+
+class Ingestor:
+    """Poller delle reti esterne con un client HTTP condiviso (connessioni riutilizzate).
+
+    Ogni richiesta è condizionale (If-None-Match / If-Modified-Since): con 304 non
+    si scarica né si analizza nulla. Il layer di una sorgente viene riscritto solo
+    se il diff con la pull precedente contiene modifiche.
+    """
+
+    def __init__(self, sources, timeout=20, max_connections=10):
+        self.sources = sources
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                headers={'User-Agent': USER_AGENT, 'Accept': 'application/json'},
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def poll(self, source):
+        """Scarica e aggiorna una sorgente. Restituisce un riepilogo per i log."""
+        headers = {}
+        if source.etag:
+            headers['If-None-Match'] = source.etag
+        if source.last_modified:
+            headers['If-Modified-Since'] = source.last_modified
+
+        started = time.monotonic()
+        response = await self._get_client().get(source.url, headers=headers)
+        if response.status_code == 304:
+            return {'source': source.name, 'status': 304, 'changes': 0}
+        response.raise_for_status()
+
+        def process():
+            nodes = source.parse(response.json())
+            changes = diff_nodes(source.nodes, nodes)
+            source.nodes = nodes
+            if changes or not os.path.exists(source.publisher.path):
+                source.publish(changes)
+            return changes
+
+        changes = await asyncio.to_thread(process)
+        # I validatori vengono salvati solo dopo un'elaborazione riuscita
+        source.etag = response.headers.get('ETag')
+        source.last_modified = response.headers.get('Last-Modified')
+        return {
+            'source': source.name,
+            'status': response.status_code,
+            'nodes': len(source.nodes),
+            'changes': len(changes),
+            'seconds': round(time.monotonic() - started, 2),
+        }
+
+    async def poll_all(self):
+        """Aggiorna tutte le sorgenti in parallelo; l'errore di una non blocca le altre."""
+        results = await asyncio.gather(*(self.poll(source) for source in self.sources), return_exceptions=True)
+        for source, result in zip(self.sources, results):
+            if isinstance(result, Exception):
+                logging.error(f"Errore aggiornamento layer {source.name}: {result}")
+            elif result['changes']:
+                logging.info(f"Layer {source.name}: {result['changes']} modifiche ({result['nodes']} nodi)")
+        return results
@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+
+import csv
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+
+FIELDNAMES = ['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link', 'ID', 'user', 'timestamp']
+
+def read_csv(path):
+    """Legge e valida tutti i marker dal file CSV (parsing completo)."""
+    if not os.path.exists(path):
+        return []
+
+    # utf-8-sig rimuove il BOM scritto da write_csv
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+
+        markers = []
+        for row in reader:
+            if not row.get('lat') or not row.get('lon') or not row.get('ID'):
+                continue
+
+            marker = {field: row.get(field) or '' for field in FIELDNAMES}
+            if not marker['user']:
+                marker['user'] = 'anonimo'
+
+            markers.append(marker)
+
+        return markers
+
+def write_csv(path, markers):
+    """Scrive i marker su file in modo atomico tramite file temporaneo. Restituisce i byte scritti."""
+    directory = os.path.dirname(os.path.abspath(path))
+    temp_file = tempfile.NamedTemporaryFile('w', newline='', delete=False, encoding='utf-8-sig', dir=directory)
+    with temp_file as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for marker in markers:
+            writer.writerow({field: marker.get(field, '') for field in FIELDNAMES})
+        written = f.tell()
+
+    os.replace(temp_file.name, path)
+    return written
+
+def append_csv(path, markers):
+    """Accoda le righe al CSV e le rende persistenti con un solo fsync. Restituisce i byte scritti."""
+    with open(path, 'a', newline='', encoding='utf-8') as f:
+        start = f.tell()
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        for marker in markers:
+            writer.writerow({field: marker.get(field, '') for field in FIELDNAMES})
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell() - start
+
+def _last_row_start(f):
+    """Posizione in cui inizia l'ultima riga: dopo l'ultimo ritorno a capo fuori dalle virgolette.
+
+    Un campo tra virgolette (es. una descrizione) può contenere ritorni a capo,
+    quindi il file viene letto dall'inizio tenendo conto delle virgolette aperte.
+    """
+    f.seek(0)
+    start = offset = 0
+    quoted = False
+    while True:
+        chunk = f.read(1 << 20)
+        if not chunk:
+            return start
+        if not quoted and b'"' not in chunk:
+            nl = chunk.rfind(b'\n')
+            if nl != -1:
+                start = offset + nl + 1
+        else:
+            for match in re.finditer(rb'["\n]', chunk):
+                if match.group() == b'"':
+                    quoted = not quoted  # "" dentro un campo si annulla
+                elif not quoted:
+                    start = offset + match.end()
+        offset += len(chunk)
+
+def repair_tail(path):
+    """Sistema la coda del file dopo una scrittura interrotta.
+
+    Ogni riga scritta termina con un ritorno a capo: un'ultima riga senza è una
+    scrittura non completata e viene troncata (anche se i campi sembrano validi,
+    potrebbero essere tagliati). Solo l'intestazione viene completata.
+    Restituisce True se ha modificato il file.
+    """
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        if end == 0:
+            return False
+        f.seek(end - 1)
+        if f.read(1) == b'\n':
+            return False
+
+        start = _last_row_start(f)
+        if start == 0:
+            f.seek(end)
+            f.write(b'\r\n')
+        else:
+            f.truncate(start)
+            logging.warning(f"Riga incompleta rimossa in fondo a {path}")
+        f.flush()
+        os.fsync(f.fileno())
+        return True
+
+class MarkerStore:
+    """Cache in memoria dei marker con indici per utente e per nome.
+
+    Il CSV viene letto una sola volta e riletto solo quando cambiano
+    mtime o dimensione del file (es. modifica manuale sul volume condiviso).
+
+    In modalità append_only le aggiunte sono righe accodate al CSV con fsync,
+    mentre rinomine ed eliminazioni finiscono in un journal a lato
+    (<file>.journal) che compact() incorpora periodicamente in un nuovo snapshot.
+    """
+
+    def __init__(self, path, append_only=False):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.append_only = append_only
+        self._lock = threading.RLock()
+        self._signature = None
+        self._markers = []
+        self._by_user = {}
+        self._by_name = {}
+        self._pending_rows = []
+        self._pending_ops = []
+        self._pending_rewrite = False
+        self.bytes_written = 0  # byte scritti su CSV e journal, per le metriche
+
+    def _file_signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _rebuild_indexes(self):
+        self._by_user = {}
+        self._by_name = {}
+        for marker in self._markers:
+            self._index(marker)
+
+    def _index(self, marker):
+        self._by_user.setdefault(marker['ID'], []).append(marker)
+        self._by_name.setdefault(marker['name'].lower(), []).append(marker)
+
+    def _unindex(self, marker):
+        self._remove_from(self._by_user, marker['ID'], marker)
+        self._remove_from(self._by_name, marker['name'].lower(), marker)
+
+    @staticmethod
+    def _remove_from(index, key, marker):
+        bucket = [m for m in index.get(key, []) if m is not marker]
+        if bucket:
+            index[key] = bucket
+        else:
+            index.pop(key, None)
+
+    def refresh(self):
+        """Ricarica il file solo se è cambiato dall'ultima lettura."""
+        with self._lock:
+            signature = self._file_signature()
+            if signature == self._signature:
+                return
+            if signature is not None and repair_tail(self.path):
+                signature = self._file_signature()
+            self._markers = read_csv(self.path)
+            self._rebuild_indexes()
+            self._replay_journal()
+            self._signature = signature
+
+    def _save(self):
+        self.bytes_written += write_csv(self.path, self._markers)
+        self._signature = self._file_signature()
+        self._clear_journal()
+
+    # -------------- JOURNAL --------------
+
+    def _find(self, op):
+        """Trova il marker indicato da un'operazione (ID, timestamp e nome)."""
+        for marker in self._by_user.get(op['ID'], []):
+            if marker['timestamp'] == op['timestamp'] and marker['name'] == op['name']:
+                return marker
+        return None
+
+    def _apply(self, op):
+        """Applica in memoria un'operazione del journal. È idempotente."""
+        marker = self._find(op)
+        if marker is None:
+            return None
+        if op['op'] == 'rename':
+            self._remove_from(self._by_name, marker['name'].lower(), marker)
+            marker['name'] = op['new_name']
+            self._by_name.setdefault(marker['name'].lower(), []).append(marker)
+        elif op['op'] == 'delete':
+            self._unindex(marker)
+            self._markers = [m for m in self._markers if m is not marker]
+        return marker
+
+    def _replay_journal(self):
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                # Ultima riga troncata da un crash: l'operazione non era stata confermata.
+                # Va rimossa, altrimenti la prossima operazione verrebbe accodata sulla stessa riga
+                logging.warning(f"Riga incompleta rimossa in fondo a {self.journal_path}")
+                f.truncate(end)
+        for line in data[:end].decode('utf-8').splitlines():
+            try:
+                op = json.loads(line)
+            except ValueError:
+                logging.warning(f"Riga non valida ignorata in {self.journal_path}")
+                continue
+            self._apply(op)
+
+    def _journal(self, ops):
+        data = ''.join(json.dumps(op, ensure_ascii=False) + '\n' for op in ops)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.bytes_written += len(data.encode('utf-8'))
+
+    def _clear_journal(self):
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+    def compact(self):
+        """Incorpora il journal in un nuovo snapshot del CSV. Restituisce True se ha scritto."""
+        with self._lock:
+            if not os.path.exists(self.journal_path):
+                return False
+            self.refresh()
+            self._save()
+            return True
+
+    # -------------- LETTURA --------------
+
+    def all(self):
+        """Restituisce una copia di tutti i marker."""
+        with self._lock:
+            self.refresh()
+            return [dict(m) for m in self._markers]
+
+    def iter_all(self, batch_size=1000):
+        """Generatore dei marker: copia solo i riferimenti e restituisce i marker uno alla volta."""
+        with self._lock:
+            self.refresh()
+            markers = list(self._markers)
+        for start in range(0, len(markers), batch_size):
+            with self._lock:
+                batch = [dict(m) for m in markers[start:start + batch_size]]
+            yield from batch
+
+    def by_user(self, uid):
+        """Marker di un utente, nell'ordine del file."""
+        with self._lock:
+            self.refresh()
+            return [dict(m) for m in self._by_user.get(str(uid), [])]
+
+    def count_user(self, uid):
+        with self._lock:
+            self.refresh()
+            return len(self._by_user.get(str(uid), []))
+
+    def by_name(self, name):
+        """Marker di tutti gli utenti con questo nome (case-insensitive)."""
+        with self._lock:
+            self.refresh()
+            return [dict(m) for m in self._by_name.get(name.lower(), [])]
+
+    def has_name(self, uid, name):
+        """Verifica se l'utente ha già un marker con questo nome (case-insensitive)."""
+        uid = str(uid)
+        return any(m['ID'] == uid for m in self.by_name(name))
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Marker all'interno di un riquadro (scansione lineare)."""
+        with self._lock:
+            self.refresh()
+            result = []
+            for m in self._markers:
+                try:
+                    lat, lon = float(m['lat']), float(m['lon'])
+                except ValueError:
+                    continue
+                if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon:
+                    result.append(dict(m))
+            return result
+
+    # -------------- SCRITTURA --------------
+
+    def replace_all(self, markers):
+        """Sostituisce tutti i marker e riscrive il file."""
+        with self._lock:
+            self._markers = [{field: m.get(field, '') for field in FIELDNAMES} for m in markers]
+            self._rebuild_indexes()
+            self._save()
+
+    def apply(self, commands):
+        """Applica più modifiche in memoria e le rende persistenti con una sola scrittura.
+
+        commands è una lista di tuple (operazione, argomenti) con operazione tra
+        'add', 'add_many', 'rename', 'delete' e 'delete_many'. Restituisce i risultati nello
+        stesso ordine: il marker aggiunto, oppure il marker com'era prima di rinomina/eliminazione
+        (None se la selezione non è valida), per 'delete_many' la lista dei marker eliminati.
+        """
+        with self._lock:
+            self.refresh()
+            try:
+                results = [getattr(self, '_' + name)(*args) for name, args in commands]
+                self._persist()
+            except Exception:
+                # Stato in memoria non più allineato al disco: forza la rilettura
+                self._pending_rows, self._pending_ops = [], []
+                self._pending_rewrite = False
+                self._signature = None
+                raise
+            return results
+
+    def _persist(self):
+        rows, ops, rewrite = self._pending_rows, self._pending_ops, self._pending_rewrite
+        self._pending_rows, self._pending_ops, self._pending_rewrite = [], [], False
+        if not rows and not ops:
+            return
+        if self.append_only and not rewrite and self._signature and self._signature[1] > 0:
+            if rows:
+                self.bytes_written += append_csv(self.path, rows)
+                self._signature = self._file_signature()
+            if ops:
+                self._journal(ops)
+        else:
+            self._save()
+
+    def _add(self, marker):
+        marker = {field: str(marker.get(field, '')) for field in FIELDNAMES}
+        self._markers.append(marker)
+        self._index(marker)
+        self._pending_rows.append(marker)
+        return dict(marker)
+
+    def _add_many(self, markers):
+        """Aggiunta in blocco: il file viene riscritto con un'unica sostituzione atomica,
+        così un'interruzione non lascia un'importazione a metà."""
+        results = [self._add(marker) for marker in markers]
+        self._pending_rewrite = True
+        return results
+
+    def _mutate(self, uid, idx, op, **extra):
+        user_markers = self._by_user.get(str(uid), [])
+        if idx < 0 or idx >= len(user_markers):
+            return None
+        marker = user_markers[idx]
+        op = {'op': op, 'ID': marker['ID'], 'timestamp': marker['timestamp'], 'name': marker['name'], **extra}
+        before = dict(marker)
+        self._apply(op)
+        self._pending_ops.append(op)
+        return before
+
+    def _rename(self, uid, idx, new_name):
+        return self._mutate(uid, idx, 'rename', new_name=new_name)
+
+    def _delete(self, uid, idx):
+        return self._mutate(uid, idx, 'delete')
+
+    def _delete_many(self, markers):
+        """Eliminazione in blocco per chiave (ID, timestamp e nome), con una sola passata
+        sulla lista dei marker. I marker non più presenti vengono ignorati."""
+        removed, deleted = [], set()
+        for marker in markers:
+            op = {'op': 'delete', 'ID': marker['ID'], 'timestamp': marker['timestamp'], 'name': marker['name']}
+            found = self._find(op)
+            if found is None:
+                continue
+            self._unindex(found)
+            deleted.add(id(found))
+            self._pending_ops.append(op)
+            removed.append(dict(found))
+        if deleted:
+            self._markers = [m for m in self._markers if id(m) not in deleted]
+        return removed
+
+    def add(self, marker):
+        return self.apply([('add', (marker,))])[0]
+
+    def rename(self, uid, idx, new_name):
+        """Rinomina l'idx-esimo marker dell'utente. Restituisce il vecchio nome o None."""
+        before = self.apply([('rename', (uid, idx, new_name))])[0]
+        return before['name'] if before else None
+
+    def delete(self, uid, idx):
+        """Elimina l'idx-esimo marker dell'utente. Restituisce il marker eliminato o None."""
+        return self.apply([('delete', (uid, idx))])[0]
+
+    def delete_many(self, markers):
+        """Elimina più marker (per ID, timestamp e nome). Restituisce i marker eliminati."""
+        return self.apply([('delete_many', (markers,))])[0]
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+
+from telegram.ext import ConversationHandler
+
+# Limiti dei bucket in secondi, dai millisecondi degli handler ai secondi delle scritture
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{str(v)}"' for n, v in zip(names, values)) + '}'
+
+class Histogram:
+    """Istogramma cumulativo per combinazione di etichette, come quelli di Prometheus."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # etichette -> [conteggi per bucket (+Inf), somma, conteggio]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def series(self):
+        with self._lock:
+            return {labels: ([*counts], total, count) for labels, (counts, total, count) in self._series.items()}
+
+    def quantile(self, q, *labels):
+        """Stima del quantile q per interpolazione lineare nel bucket (come histogram_quantile)."""
+        series = self.series().get(labels)
+        if not series or not series[2]:
+            return None
+        counts, _, count = series
+        rank = q * count
+        cumulative = 0
+        for i, n in enumerate(counts):
+            if cumulative + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+    def render(self):
+        lines = []
+        for labels, (counts, total, count) in sorted(self.series().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts):
+                cumulative += n
+                le = _labels(self.labels + ('le',), labels + (bound,))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {count}")
+        return lines
+
+class Counter:
+    """Contatore monotono, incrementato direttamente o letto da una funzione (func)."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=(), func=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.func = func
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        if self.func is not None:
+            value = self.func()
+            return value if isinstance(value, dict) else {(): value}
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        return [f"{self.name}{_labels(self.labels, labels)} {value}" for labels, value in sorted(self.values().items())]
+
+class Gauge(Counter):
+    """Valore istantaneo, di solito letto da una funzione al momento dell'esportazione."""
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+class Metrics:
+    """Registro delle metriche del bot, esportate nel formato testo di Prometheus."""
+
+    def __init__(self, prefix='lorabs_'):
+        self.prefix = prefix
+        self._metrics = {}
+
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self.prefix + name, help, labels, buckets))
+
+    def counter(self, name, help, labels=(), func=None):
+        return self._register(Counter(self.prefix + name, help, labels, func))
+
+    def gauge(self, name, help, labels=(), func=None):
+        return self._register(Gauge(self.prefix + name, help, labels, func))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                body = metric.render()
+            except Exception as e:
+                logging.error(f"Errore lettura metrica {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(body)
+        return '\n'.join(lines) + '\n'
+
+    # -------------- ENDPOINT HTTP --------------
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render().encode('utf-8')
+            else:
+                status, body = '404 Not Found', b'Not found\n'
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host, port):
+        """Espone GET /metrics; di default solo in locale (host 127.0.0.1)."""
+        server = await asyncio.start_server(self._handle, host, port)
+        logging.info(f"Metriche su http://{host}:{port}/metrics")
+        return server
+
+# -------------- HANDLER --------------
+
+def instrument_handlers(handlers, histogram, errors):
+    """Avvolge le callback degli handler (anche dentro i ConversationHandler)
+    per misurarne la durata, con il nome della funzione come etichetta."""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            instrument_handlers(nested, histogram, errors)
+            continue
+        callback = handler.callback
+        if getattr(callback, '_instrumented', False):
+            continue
+        handler.callback = _timed(callback, histogram, errors)
+
+def _timed(callback, histogram, errors):
+    name = getattr(callback, '__name__', 'handler')
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            errors.inc(1, name)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start, name)
+
+    wrapper._instrumented = True
+    return wrapper
+
+def instrument_methods(obj, names, histogram):
+    """Sostituisce i metodi indicati dell'oggetto con versioni che ne misurano la durata."""
+    for name in names:
+        method = getattr(obj, name)
+
+        @functools.wraps(method)
+        def wrapper(*args, _method=method, _name=name, **kwargs):
+            start = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, _name)
+
+        setattr(obj, name, wrapper)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import contextlib
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class UserUpdateProcessor(BaseUpdateProcessor):
+    """Esecuzione concorrente degli update con ordine garantito per utente.
+
+    Gli update dello stesso utente vengono gestiti uno alla volta, nell'ordine di
+    arrivo (lock FIFO per utente), così due messaggi ravvicinati non possono
+    intrecciarsi su user_data[uid] né sullo stato delle conversazioni; utenti
+    diversi procedono in parallelo. Al massimo max_in_flight handler sono in
+    esecuzione contemporaneamente (protegge il writer e il thread pool), mentre
+    max_pending limita gli update accettati in attesa del proprio turno.
+
+    Il limite globale viene preso dopo il lock dell'utente: chi invia molti
+    messaggi di fila occupa un solo posto e non blocca gli altri utenti.
+    """
+
+    def __init__(self, max_in_flight=32, max_pending=1024):
+        super().__init__(max_pending)
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.BoundedSemaphore(max_in_flight)
+        self._locks = {}   # uid -> [lock, update in attesa o in esecuzione]
+        self.waiting = 0   # update accettati in attesa del proprio turno
+        self.in_flight = 0
+        self.peak = 0      # massimo di handler contemporanei osservato
+        self.processed = 0
+
+    @staticmethod
+    def _key(update):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._key(update)
+        entry = None
+        if key is not None:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+
+        # Update senza utente (es. sondaggi): solo il limite globale
+        lock = entry[0] if entry is not None else contextlib.nullcontext()
+        self.waiting += 1
+        waiting = True
+        try:
+            async with lock, self._slots:
+                self.waiting -= 1
+                waiting = False
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+                try:
+                    await coroutine
+                finally:
+                    self.in_flight -= 1
+                    self.processed += 1
+        finally:
+            if waiting:
+                self.waiting -= 1
+            if entry is not None:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import heapq
+import json
+import logging
+import os
+import threading
+import unicodedata
+
+import brotli
+
+from changelog import marker_key
+from snapshot import atomic_write
+
+NGRAM = 3
+MAX_RESULTS = 10
+
+def fold(text):
+    """Forma normalizzata per la ricerca: minuscole, senza accenti, punteggiatura e spazi multipli.
+
+    'Città-Alta  (BG)' -> 'citta alta bg'. Deve restare identica a fold() in web/pagina.js.
+    """
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    text = ''.join(c if c.isalnum() else ' ' for c in text if not unicodedata.category(c).startswith('M'))
+    return ' '.join(text.split())
+
+def ngrams(folded, n=NGRAM):
+    """N-grammi del nome normalizzato; gli spazi ai lati marcano inizio e fine del nome."""
+    padded = f" {folded} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+def rank(folded, query):
+    """Chiave di ordinamento: nome uguale, poi inizio del nome, inizio di una parola, altrove."""
+    if folded == query:
+        kind = 0
+    elif folded.startswith(query):
+        kind = 1
+    elif f" {query}" in f" {folded}":
+        kind = 2
+    else:
+        kind = 3
+    return (kind, len(folded), folded)
+
+class SearchIndex:
+    """Indice per nome dei marker basato su n-grammi.
+
+    Le voci sono i nomi distinti dopo fold(), ognuna con i suoi marker; per ogni
+    n-gramma l'indice tiene la lista ordinata delle voci che lo contengono. Una
+    ricerca interseca le liste degli n-grammi della query partendo dalla più
+    corta e verifica i candidati, invece di scorrere tutti i nomi.
+
+    L'indice si aggiorna con add() e remove(): una voce rimasta senza marker
+    resta al suo posto (le liste restano valide) e viene ignorata dalle ricerche.
+    """
+
+    def __init__(self, markers, n=NGRAM):
+        self.n = n
+        self.folded = []
+        self.names = []
+        self.markers = []
+        self.entries = {}
+        self.grams = {}
+        for marker in markers:
+            self.add(marker)
+
+    def __len__(self):
+        return len(self.folded)
+
+    def add(self, marker):
+        """Aggiunge un marker alla voce del suo nome, creandola se serve."""
+        folded = fold(marker.get('name', ''))
+        if not folded:
+            return
+        i = self.entries.get(folded)
+        if i is None:
+            i = self.entries[folded] = len(self.folded)
+            self.folded.append(folded)
+            self.names.append(marker['name'])
+            self.markers.append([])
+            # Le voci nuove hanno l'indice più alto, quindi ogni lista resta ordinata
+            for gram in ngrams(folded, self.n):
+                self.grams.setdefault(gram, []).append(i)
+        elif not self.markers[i]:
+            self.names[i] = marker['name']
+        self.markers[i].append(marker)
+
+    def remove(self, marker):
+        """Rimuove un marker (per ID, timestamp e nome) dalla voce del suo nome."""
+        i = self.entries.get(fold(marker.get('name', '')))
+        if i is None:
+            return
+        key = marker_key(marker)
+        self.markers[i] = [m for m in self.markers[i] if marker_key(m) != key]
+
+    def lookup(self, name):
+        """Marker con lo stesso nome normalizzato (senza distinzione di maiuscole e accenti)."""
+        i = self.entries.get(fold(name))
+        return list(self.markers[i]) if i is not None else []
+
+    def candidates(self, query):
+        """Voci che contengono la query normalizzata (in ordine qualsiasi)."""
+        if len(query) >= self.n:
+            postings = [self.grams.get(query[i:i + self.n], []) for i in range(len(query) - self.n + 1)]
+            postings.sort(key=len)
+            result = set(postings[0])
+            for posting in postings[1:]:
+                if not result:
+                    break
+                result.intersection_update(posting)
+        else:
+            # Query più corta di un n-gramma: unione delle liste degli n-grammi che la contengono
+            result = set()
+            for gram, posting in self.grams.items():
+                if query in gram:
+                    result.update(posting)
+        # Gli n-grammi possono coincidere anche se la query non è una sottostringa
+        return [i for i in result if self.markers[i] and query in self.folded[i]]
+
+    def search(self, text, limit=MAX_RESULTS):
+        """Le limit voci migliori per la ricerca, come lista di (nome, marker)."""
+        query = fold(text)
+        if not query:
+            return []
+        best = heapq.nsmallest(limit, self.candidates(query), key=lambda i: rank(self.folded[i], query))
+        return [(self.names[i], list(self.markers[i])) for i in best]
+
+    def to_json(self, version=None):
+        """Indice per la pagina web: nomi, coordinate dei marker e liste degli n-grammi.
+
+        Le liste sono codificate come differenze tra voci consecutive (numeri piccoli,
+        che si comprimono meglio); points[i] contiene lat, lon di ogni marker della voce,
+        con 5 decimali (circa un metro).
+        """
+        points = []
+        for markers in self.markers:
+            flat = []
+            for marker in markers:
+                try:
+                    flat += [round(float(marker['lat']), 5), round(float(marker['lon']), 5)]
+                except (KeyError, ValueError):
+                    continue
+            points.append(flat)
+        grams = {}
+        for gram, posting in self.grams.items():
+            grams[gram] = [posting[0]] + [b - a for a, b in zip(posting, posting[1:])]
+        return {'version': version, 'n': self.n, 'names': self.names, 'points': points, 'grams': grams}
+
+class SearchIndexPublisher:
+    """Pubblica l'indice di ricerca (search.json e varianti .gz/.br) accanto allo snapshot."""
+
+    def __init__(self, directory, name='search.json'):
+        self.path = os.path.join(directory, name)
+
+    def publish(self, markers, version=None):
+        index = SearchIndex(markers)
+        data = json.dumps(index.to_json(version), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        # Come per lo snapshot binario: livelli medi, l'indice viene rigenerato a ogni scrittura
+        atomic_write(self.path + '.gz', gzip.compress(data, compresslevel=6, mtime=0))
+        atomic_write(self.path + '.br', brotli.compress(data, quality=5))
+        atomic_write(self.path, data)
+        logging.info(f"Indice di ricerca v{version} pubblicato ({len(index)} nomi, {len(data)} byte)")
+        return index
+
+class MarkerSearchIndex:
+    """Indice di ricerca dei marker dello store.
+
+    Costruito una volta (rebuild, all'avvio in un thread) e poi aggiornato con le
+    modifiche di ogni scrittura, senza rileggere tutti i marker. Il lock protegge
+    l'indice dalle ricerche di /find eseguite in un thread.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._index = None
+        self._lock = threading.Lock()
+
+    def rebuild(self):
+        index = SearchIndex(self.store.all())
+        with self._lock:
+            self._index = index
+
+    def apply(self, changes):
+        """Aggiorna l'indice dopo una scrittura (listener di MarkerWriter)."""
+        with self._lock:
+            if self._index is None:
+                return
+            for name, args, result in changes:
+                if name in ('delete', 'rename'):
+                    self._index.remove(result)
+                if name == 'add':
+                    self._index.add(dict(result))
+                elif name == 'rename':
+                    self._index.add(dict(result, name=args[2]))
+
+    def _get_locked(self):
+        # Senza rebuild all'avvio l'indice viene costruito alla prima richiesta
+        if self._index is None:
+            self._index = SearchIndex(self.store.all())
+        return self._index
+
+    def search(self, text, limit=MAX_RESULTS):
+        with self._lock:
+            return self._get_locked().search(text, limit)
+
+    def has_name(self, uid, name):
+        """Verifica se l'utente ha già un marker con questo nome (senza distinzione di maiuscole e accenti)."""
+        uid = str(uid)
+        with self._lock:
+            return any(m['ID'] == uid for m in self._get_locked().lookup(name))
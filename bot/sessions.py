@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import math
+import pickle
+import threading
+import time
+
+from snapshot import atomic_write
+
+class Session:
+    __slots__ = ('data', 'tick')
+
+    def __init__(self, data):
+        self.data = data
+        self.tick = None  # tick della ruota in cui è pianificata la scadenza
+
+class SessionStore:
+    """Sessioni delle conversazioni per utente, con scadenza e salvataggio su file.
+
+    Si usa come un dizionario uid -> dati della sessione. Una sessione scade ttl
+    secondi dopo il suo 'timestamp' (senza timestamp è già scaduta, come prima).
+    Le scadenze sono in una ruota temporale con uno slot per tick: expire()
+    guarda solo gli slot trascorsi dall'ultima chiamata invece di scorrere tutte
+    le sessioni. Se il timestamp è stato aggiornato la sessione viene solo
+    ripianificata.
+    Con path le sessioni modificate vengono salvate da save() in uno snapshot
+    pickle e ricaricate all'avvio, così le conversazioni in corso sopravvivono
+    a un riavvio.
+    """
+
+    def __init__(self, ttl, tick=1.0, path=None):
+        self.ttl = ttl
+        self.tick = tick
+        self.path = path
+        self._lock = threading.RLock()
+        self._sessions = {}
+        self._wheel = [[] for _ in range(int(math.ceil(ttl / tick)) + 2)]
+        self._last_tick = int(time.time() // tick)
+        self._dirty = False
+        self.created = 0
+        self.expired = 0
+        self.ended = 0
+        if path:
+            self._load()
+
+    # -------------- INTERFACCIA DIZIONARIO --------------
+
+    def __contains__(self, uid):
+        return uid in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __getitem__(self, uid):
+        # I dati vengono modificati direttamente dagli handler: ogni accesso può essere una modifica
+        self._dirty = True
+        return self._sessions[uid].data
+
+    def __setitem__(self, uid, data):
+        with self._lock:
+            session = Session(data)
+            self._sessions[uid] = session
+            self._schedule(uid, session)
+            self._dirty = True
+            self.created += 1
+
+    def get(self, uid, default=None):
+        return self[uid] if uid in self._sessions else default
+
+    def pop(self, uid, *default):
+        with self._lock:
+            session = self._sessions.pop(uid, None)
+            if session is None:
+                if default:
+                    return default[0]
+                raise KeyError(uid)
+            self._dirty = True
+            self.ended += 1
+            return session.data
+
+    # -------------- SCADENZE --------------
+
+    def _deadline(self, session):
+        return session.data.get('timestamp', 0) + self.ttl
+
+    def _schedule(self, uid, session):
+        # Le scadenze oltre la ruota vengono messe nell'ultimo slot e ripianificate al passaggio
+        tick = max(int(self._deadline(session) // self.tick), self._last_tick + 1)
+        tick = min(tick, self._last_tick + len(self._wheel) - 1)
+        session.tick = tick
+        self._wheel[tick % len(self._wheel)].append(uid)
+
+    def expire(self, now=None):
+        """Rimuove le sessioni scadute. Restituisce gli uid rimossi."""
+        now = time.time() if now is None else now
+        removed = []
+        with self._lock:
+            current = int(now // self.tick)
+            first = max(self._last_tick + 1, current - len(self._wheel) + 1)
+            self._last_tick = current
+            for tick in range(first, current + 1):
+                index = tick % len(self._wheel)
+                slot, keep = self._wheel[index], []
+                for uid in slot:
+                    session = self._sessions.get(uid)
+                    # Voce superata da una pianificazione più recente o sessione già chiusa
+                    if session is None or session.tick % len(self._wheel) != index:
+                        continue
+                    if session.tick > tick:
+                        keep.append(uid)  # dopo una lunga pausa: scadenza in un giro successivo
+                    elif self._deadline(session) <= now:
+                        del self._sessions[uid]
+                        removed.append(uid)
+                    else:
+                        self._schedule(uid, session)
+                self._wheel[index] = keep
+            if removed:
+                self._dirty = True
+                self.expired += len(removed)
+        return removed
+
+    def stats(self):
+        return {'active': len(self), 'created': self.created, 'expired': self.expired, 'ended': self.ended}
+
+    # -------------- PERSISTENZA --------------
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                sessions = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logging.error(f"Snapshot delle sessioni non leggibile, verrà ignorato: {e}")
+            return
+        for uid, data in sessions.items():
+            session = Session(data)
+            self._sessions[uid] = session
+            self._schedule(uid, session)
+        logging.info(f"Ripristinate {len(sessions)} sessioni da {self.path}")
+
+    def save(self):
+        """Scrive lo snapshot delle sessioni se qualcosa è cambiato. Restituisce True se ha scritto."""
+        if not self.path:
+            return False
+        with self._lock:
+            if not self._dirty:
+                return False
+            data = pickle.dumps({uid: s.data for uid, s in self._sessions.items()}, protocol=pickle.HIGHEST_PROTOCOL)
+            self._dirty = False
+        atomic_write(self.path, data)
+        return True
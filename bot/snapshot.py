@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import gzip
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import time
+
+import brotli
+import numpy as np
+
+SNAPSHOT_FIELDS = ['lat', 'lon', 'name', 'desc', 'node_type', 'frequency', 'link', 'ID', 'user', 'timestamp']
+
+def atomic_write(path, data):
+    """Scrive un file binario in modo atomico (file temporaneo + rename)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def build_columns(markers):
+    """Converte i marker in colonne; lat/lon sono numeri e le righe senza coordinate valide vengono scartate."""
+    columns = {field: [] for field in SNAPSHOT_FIELDS}
+    for marker in markers:
+        try:
+            lat, lon = float(marker['lat']), float(marker['lon'])
+        except (KeyError, ValueError):
+            continue
+        columns['lat'].append(lat)
+        columns['lon'].append(lon)
+        for field in SNAPSHOT_FIELDS[2:]:
+            columns[field].append(marker.get(field, ''))
+    return columns
+
+def bucket_counts(columns):
+    """Numero di marker per coppia (frequenza, tipo di nodo), i gruppi in cui la pagina web divide i filtri."""
+    counts = collections.Counter(zip(columns['frequency'], columns['node_type']))
+    return [
+        {'frequency': frequency, 'node_type': node_type, 'count': count}
+        for (frequency, node_type), count in sorted(counts.items())
+    ]
+
+# Snapshot binario (snapshot.bin), decodificato dalla pagina web in un Web Worker
+BINARY_MAGIC = b'LBSB'
+BINARY_FORMAT = 1
+BINARY_HEADER = struct.Struct('<4sHHIIIIII')
+BINARY_STRING_FIELDS = ['name', 'desc', 'link', 'ID', 'user', 'timestamp']
+BINARY_DICT_FIELDS = ['node_type', 'frequency']
+
+def _pad4(data):
+    return data + b'\0' * (-len(data) % 4)
+
+def encode_binary(columns, version, generated):
+    """Codifica le colonne dello snapshot in un formato binario compatto.
+
+    Layout little-endian, ogni sezione allineata a 4 byte (viste TypedArray senza copie):
+      header (32 byte): magic 'LBSB', formato (u16), riservato (u16), versione, generato,
+                        numero di marker n, byte dei dizionari, byte e numero delle stringhe (u32)
+      lat, lon:         float32[n] (precisione di circa mezzo metro)
+      name, desc, link, ID, user, timestamp: uint32[n] ciascuna, indici nella tabella delle stringhe
+      node_type, frequency: uint16[n] ciascuna, indici nei dizionari
+      dizionari:        JSON {"node_type": [...], "frequency": [...], "buckets": bucket_counts()}
+      stringhe:         tabella UTF-8 senza duplicati, separate da \0
+    """
+    count = len(columns['lat'])
+    strings, table = [], {}
+    def index(value):
+        value = str(value).replace('\0', '')
+        i = table.get(value)
+        if i is None:
+            i = table[value] = len(strings)
+            strings.append(value)
+        return i
+
+    parts = [
+        np.asarray(columns['lat'], dtype='<f4').tobytes(),
+        np.asarray(columns['lon'], dtype='<f4').tobytes(),
+    ]
+    for field in BINARY_STRING_FIELDS:
+        parts.append(np.fromiter((index(v) for v in columns[field]), dtype='<u4', count=count).tobytes())
+
+    dictionaries, codes = {}, []
+    for field in BINARY_DICT_FIELDS:
+        values = dictionaries[field] = sorted(set(columns[field]))
+        positions = {value: i for i, value in enumerate(values)}
+        codes.append(np.fromiter((positions[v] for v in columns[field]), dtype='<u2', count=count).tobytes())
+    parts.append(_pad4(b''.join(codes)))
+    dictionaries['buckets'] = bucket_counts(columns)
+
+    dict_bytes = _pad4(json.dumps(dictionaries, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+    string_bytes = '\0'.join(strings).encode('utf-8')
+    header = BINARY_HEADER.pack(
+        BINARY_MAGIC, BINARY_FORMAT, 0, version, generated, count,
+        len(dict_bytes), len(string_bytes), len(strings)
+    )
+    return header + b''.join(parts) + dict_bytes + string_bytes
+
+class SnapshotPublisher:
+    """Pubblica uno snapshot colonnare e versionato dei marker per il frontend web.
+
+    Accanto a <nome>.json vengono scritte le varianti precompresse .gz e .br,
+    servite direttamente da http-server (opzioni -g e -b). Con binary=True viene
+    scritto anche <nome>.bin (encode_binary), con le stesse varianti.
+    """
+
+    def __init__(self, directory, name='snapshot.json', binary=False):
+        self.path = os.path.join(directory, name)
+        self.binary_path = os.path.splitext(self.path)[0] + '.bin' if binary else None
+        self.version = self._load_version()
+        self.etag = None
+
+    def _load_version(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return int(json.load(f).get('version', 0))
+        except (OSError, ValueError, AttributeError):
+            return 0
+
+    def publish(self, markers, version=None):
+        """Genera e scrive un nuovo snapshot. Restituisce la nuova versione.
+
+        version permette di allineare lo snapshot alla versione del changelog.
+        """
+        columns = build_columns(markers)
+        self.version = version if version is not None else self.version + 1
+        generated = int(time.time())
+        snapshot = {
+            'version': self.version,
+            'generated': generated,
+            'count': len(columns['lat']),
+            'buckets': bucket_counts(columns),
+            'columns': columns,
+        }
+        data = json.dumps(snapshot, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.etag = hashlib.sha1(data).hexdigest()
+
+        if self.binary_path:
+            binary = encode_binary(columns, self.version, generated)
+            atomic_write(self.binary_path + '.gz', gzip.compress(binary, compresslevel=6, mtime=0))
+            atomic_write(self.binary_path + '.br', brotli.compress(binary, quality=5))
+            atomic_write(self.binary_path, binary)
+
+        # Prima le varianti compresse, poi il JSON: tutte le versioni servite restano complete.
+        # Livelli medi: lo snapshot viene ricompresso a ogni scrittura e i livelli massimi
+        # (brotli 11) costano secondi per un guadagno di pochi punti percentuali
+        atomic_write(self.path + '.gz', gzip.compress(data, compresslevel=6, mtime=0))
+        atomic_write(self.path + '.br', brotli.compress(data, quality=5))
+        atomic_write(self.path, data)
+        logging.info(f"Snapshot v{self.version} pubblicato ({snapshot['count']} marker, {len(data)} byte)")
+        return self.version
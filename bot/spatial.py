@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG = 111.195
+
+def haversine_km(lat, lon, lats, lons):
+    """Distanza in km da un punto a un array di punti (gradi)."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def radius_bbox(lat, lon, radius_km):
+    """Riquadro (min_lat, min_lon, max_lat, max_lon) che contiene il cerchio di raggio radius_km."""
+    dlat = radius_km / KM_PER_DEG
+    coslat = max(np.cos(np.radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+    dlon = min(radius_km / (KM_PER_DEG * coslat), 180)
+    return lat - dlat, lon - dlon, lat + dlat, lon + dlon
+
+class GridIndex:
+    """Indice spaziale a griglia regolare su lat/lon, interamente vettoriale.
+
+    I punti sono ordinati per cella: le celle di una riga della griglia sono
+    contigue, quindi i candidati di un riquadro si ottengono con una
+    searchsorted per riga invece che con una scansione lineare.
+    """
+
+    def __init__(self, lats, lons, cell_deg=0.25):
+        self.cell_deg = cell_deg
+        self.ncols = int(np.ceil(360 / cell_deg)) + 1
+        self.nrows = int(np.ceil(180 / cell_deg)) + 1
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lons = np.asarray(lons, dtype=np.float64)
+        cell_ids = self._cell_ids(self.lats, self.lons)
+        self._order = np.argsort(cell_ids, kind='stable')
+        self._sorted_ids = cell_ids[self._order]
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _rows_cols(self, lats, lons):
+        rows = np.clip(((np.asarray(lats) + 90) // self.cell_deg).astype(np.int64), 0, self.nrows - 1)
+        cols = np.clip(((np.asarray(lons) + 180) // self.cell_deg).astype(np.int64), 0, self.ncols - 1)
+        return rows, cols
+
+    def _cell_ids(self, lats, lons):
+        rows, cols = self._rows_cols(lats, lons)
+        return rows * self.ncols + cols
+
+    def bbox_candidates(self, min_lat, min_lon, max_lat, max_lon):
+        """Indici dei punti nelle celle che intersecano il riquadro (superinsieme)."""
+        (row0, row1), (col0, col1) = self._rows_cols([min_lat, max_lat], [min_lon, max_lon])
+        rows = np.arange(row0, row1 + 1)
+        starts = np.searchsorted(self._sorted_ids, rows * self.ncols + col0, side='left')
+        ends = np.searchsorted(self._sorted_ids, rows * self.ncols + col1, side='right')
+        if not len(starts):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self._order[s:e] for s, e in zip(starts, ends) if e > s] or [np.empty(0, dtype=np.int64)])
+
+    def within(self, lat, lon, radius_km):
+        """Indici e distanze dei punti entro radius_km, ordinati per distanza."""
+        candidates = self.bbox_candidates(*radius_bbox(lat, lon, radius_km))
+        dist = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        mask = dist <= radius_km
+        candidates, dist = candidates[mask], dist[mask]
+        order = np.argsort(dist, kind='stable')
+        return candidates[order], dist[order]
+
+    def nearest(self, lat, lon, k):
+        """Indici e distanze dei k punti più vicini, ordinati per distanza."""
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        # Allarga il raggio finché il riquadro contiene almeno k punti
+        radius = self.cell_deg * KM_PER_DEG
+        while True:
+            candidates = self.bbox_candidates(*radius_bbox(lat, lon, radius))
+            if len(candidates) >= k or radius > np.pi * EARTH_RADIUS_KM:
+                break
+            radius *= 2
+
+        # Il k-esimo candidato fissa il raggio entro cui stanno sicuramente i k più vicini
+        dist = haversine_km(lat, lon, self.lats[candidates], self.lons[candidates])
+        kth = np.partition(dist, k - 1)[k - 1]
+        if kth > radius:
+            return tuple(a[:k] for a in self.within(lat, lon, kth))
+        top = np.argpartition(dist, k - 1)[:k]
+        top = top[np.argsort(dist[top], kind='stable')]
+        return candidates[top], dist[top]
+
+class MarkerSpatialIndex:
+    """Indice spaziale dei marker dello store.
+
+    rebuild() legge tutti i marker e costruisce la griglia: va eseguita in un thread
+    (all'avvio e dopo le scritture). Le ricerche usano l'ultima griglia completa,
+    sostituita in un solo assegnamento insieme alla sua lista di marker.
+    """
+
+    def __init__(self, store, cell_deg=0.25):
+        self.store = store
+        self.cell_deg = cell_deg
+        self._state = None  # (marker, griglia)
+
+    def rebuild(self):
+        markers, lats, lons = [], [], []
+        for marker in self.store.all():
+            try:
+                lat, lon = float(marker['lat']), float(marker['lon'])
+            except ValueError:
+                continue
+            markers.append(marker)
+            lats.append(lat)
+            lons.append(lon)
+        self._state = (markers, GridIndex(lats, lons, cell_deg=self.cell_deg))
+
+    def _get(self):
+        # Senza rebuild all'avvio la griglia viene costruita alla prima richiesta
+        if self._state is None:
+            self.rebuild()
+        return self._state
+
+    def nearest(self, lat, lon, k):
+        """I k marker più vicini come lista di (marker, distanza in km)."""
+        markers, grid = self._get()
+        indices, dist = grid.nearest(lat, lon, k)
+        return [(markers[i], float(d)) for i, d in zip(indices, dist)]
+
+    def within(self, lat, lon, radius_km):
+        """I marker entro radius_km come lista di (marker, distanza in km)."""
+        markers, grid = self._get()
+        indices, dist = grid.within(lat, lon, radius_km)
+        return [(markers[i], float(d)) for i, d in zip(indices, dist)]
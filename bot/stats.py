@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import heapq
+import json
+import threading
+import time
+
+from snapshot import atomic_write
+
+DAILY_DAYS = 30  # giorni pubblicati in stats.json
+
+def day_key(timestamp):
+    """Data locale (AAAA-MM-GG) di un timestamp, None se non valido."""
+    try:
+        return time.strftime('%Y-%m-%d', time.localtime(int(float(timestamp))))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+
+class MarkerStats:
+    """Statistiche dei marker aggiornate a ogni scrittura invece di essere ricalcolate.
+
+    Conteggi per utente, tipo di nodo, frequenza e giorno di aggiunta, più un heap
+    dei top contributor con voci superate scartate in modo pigro: ogni modifica
+    aggiunge una voce aggiornata e quelle vecchie vengono scartate quando
+    arrivano in cima.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self.rebuild([])
+
+    def rebuild(self, markers):
+        with self._lock:
+            self.total = 0
+            self.with_link = 0
+            self.user_counts = {}
+            self.usernames = {}
+            self.node_types = collections.Counter()
+            self.frequencies = collections.Counter()
+            self.daily = collections.Counter()
+            self._heap = []
+            for marker in markers:
+                self._add(marker)
+
+    def _push(self, uid):
+        count = self.user_counts.get(uid, 0)
+        if count:
+            heapq.heappush(self._heap, (-count, uid))
+        # L'heap viene ricostruito quando le voci superate diventano la maggioranza
+        if len(self._heap) > 2 * len(self.user_counts) + 16:
+            self._heap = [(-c, u) for u, c in self.user_counts.items()]
+            heapq.heapify(self._heap)
+
+    def _add(self, marker, sign=1):
+        uid = str(marker.get('ID', ''))
+        self.total += sign
+        if marker.get('link'):
+            self.with_link += sign
+        self.node_types[marker.get('node_type', '')] += sign
+        self.frequencies[marker.get('frequency', '')] += sign
+        day = day_key(marker.get('timestamp'))
+        if day:
+            self.daily[day] += sign
+
+        self.user_counts[uid] = self.user_counts.get(uid, 0) + sign
+        if self.user_counts[uid] <= 0:
+            del self.user_counts[uid]
+            self.usernames.pop(uid, None)
+        elif sign > 0:
+            self.usernames[uid] = marker.get('user', '')
+        self._push(uid)
+
+    def apply(self, changes):
+        """Aggiorna i contatori con le modifiche del writer (le rinomine non cambiano nulla)."""
+        with self._lock:
+            for name, args, result in changes:
+                if name == 'add':
+                    self._add(result)
+                elif name == 'delete':
+                    self._add(result, sign=-1)
+
+    # -------------- LETTURA --------------
+
+    def top_users(self, n=5):
+        """I primi n utenti per numero di marker come lista di (uid, conteggio)."""
+        with self._lock:
+            top = []
+            while self._heap and len(top) < n:
+                count, uid = heapq.heappop(self._heap)
+                if self.user_counts.get(uid) == -count and (count, uid) not in top:
+                    top.append((count, uid))
+            for entry in top:
+                heapq.heappush(self._heap, entry)
+            return [(uid, -count) for count, uid in top]
+
+    def added_on(self, day=None):
+        return self.daily.get(day or day_key(time.time()), 0)
+
+    def summary(self):
+        with self._lock:
+            days = sorted(self.daily)[-DAILY_DAYS:]
+            return {
+                'generated': int(time.time()),
+                'total': self.total,
+                'users': len(self.user_counts),
+                'with_link': self.with_link,
+                'node_types': {k: v for k, v in self.node_types.items() if v > 0},
+                'frequencies': {k: v for k, v in self.frequencies.items() if v > 0},
+                'daily': {day: self.daily[day] for day in days if self.daily[day] > 0},
+            }
+
+    def publish(self):
+        """Scrive stats.json per la pagina web (banner "Nodi aggiunti oggi")."""
+        if self.path:
+            atomic_write(self.path, json.dumps(self.summary(), ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
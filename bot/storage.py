@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import os
+import sqlite3
+import threading
+
+from marker_store import FIELDNAMES, MarkerStore, read_csv, write_csv
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS markers (
+    marker_id INTEGER PRIMARY KEY,
+    lat REAL NOT NULL,
+    lon REAL NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    "desc" TEXT NOT NULL DEFAULT '',
+    node_type TEXT NOT NULL DEFAULT '',
+    frequency TEXT NOT NULL DEFAULT '',
+    link TEXT NOT NULL DEFAULT '',
+    "ID" TEXT NOT NULL,
+    user TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_markers_user ON markers ("ID");
+CREATE INDEX IF NOT EXISTS idx_markers_user_name ON markers ("ID", name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_markers_name ON markers (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_markers_node_type ON markers (node_type);
+CREATE INDEX IF NOT EXISTS idx_markers_frequency ON markers (frequency);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS markers_rtree USING rtree (
+    marker_id, min_lat, max_lat, min_lon, max_lon
+);
+CREATE TRIGGER IF NOT EXISTS markers_rtree_insert AFTER INSERT ON markers BEGIN
+    INSERT INTO markers_rtree VALUES (new.marker_id, new.lat, new.lat, new.lon, new.lon);
+END;
+CREATE TRIGGER IF NOT EXISTS markers_rtree_update AFTER UPDATE OF lat, lon ON markers BEGIN
+    UPDATE markers_rtree SET min_lat = new.lat, max_lat = new.lat, min_lon = new.lon, max_lon = new.lon
+    WHERE marker_id = new.marker_id;
+END;
+CREATE TRIGGER IF NOT EXISTS markers_rtree_delete AFTER DELETE ON markers BEGIN
+    DELETE FROM markers_rtree WHERE marker_id = old.marker_id;
+END;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+COLUMNS = ', '.join(f'"{field}"' for field in FIELDNAMES)
+M_COLUMNS = ', '.join(f'm."{field}"' for field in FIELDNAMES)
+
+def _row_to_marker(row):
+    return {field: '' if row[field] is None else str(row[field]) for field in FIELDNAMES}
+
+class SqliteMarkerStore:
+    """Store dei marker su SQLite (WAL), con la stessa interfaccia di MarkerStore.
+
+    Limiti per utente e controllo duplicati sono query sugli indici, le ricerche
+    per area usano l'R*Tree. Il CSV per il frontend web viene rigenerato da
+    compact() solo quando ci sono state modifiche dall'ultima esportazione.
+    """
+
+    def __init__(self, db_path, csv_path):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript(SCHEMA)
+        self._dirty = False
+        self.bytes_written = 0  # byte del CSV esportato (le scritture nel database non sono contate)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _get_meta(self, key):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [_row_to_marker(row) for row in self._conn.execute(sql, params)]
+
+    # -------------- MIGRAZIONE / ESPORTAZIONE --------------
+
+    def migrate_from_csv(self, path=None):
+        """Importa una sola volta il CSV esistente. Restituisce il numero di marker importati."""
+        path = path or self.csv_path
+        with self._lock:
+            if self._get_meta('migrated_from_csv'):
+                return 0
+            markers = read_csv(path)
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._insert_many(markers)
+                self._set_meta('migrated_from_csv', path)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            return len(markers)
+
+    def export_csv(self, path=None):
+        """Rigenera il CSV letto dal frontend web."""
+        with self._lock:
+            self.bytes_written += write_csv(path or self.csv_path, self.all())
+            self._dirty = False
+
+    def _insert_many(self, markers):
+        placeholders = ', '.join('?' for _ in FIELDNAMES)
+        self._conn.executemany(
+            f'INSERT INTO markers ({COLUMNS}) VALUES ({placeholders})',
+            ([m.get(field, '') for field in FIELDNAMES] for m in markers)
+        )
+
+    # -------------- LETTURA --------------
+
+    def refresh(self):
+        """Il database è l'unica fonte dei dati: niente da ricaricare."""
+
+    def all(self):
+        return self._query(f'SELECT {COLUMNS} FROM markers ORDER BY marker_id')
+
+    def iter_all(self, batch_size=1000):
+        """Generatore dei marker a blocchi di batch_size righe (paginazione su marker_id)."""
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f'SELECT marker_id, {COLUMNS} FROM markers WHERE marker_id > ? ORDER BY marker_id LIMIT ?',
+                    (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1]['marker_id']
+            for row in rows:
+                yield _row_to_marker(row)
+
+    def by_user(self, uid):
+        return self._query(f'SELECT {COLUMNS} FROM markers WHERE "ID" = ? ORDER BY marker_id', (str(uid),))
+
+    def count_user(self, uid):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM markers WHERE "ID" = ?', (str(uid),)).fetchone()[0]
+
+    def by_name(self, name):
+        return self._query(
+            f'SELECT {COLUMNS} FROM markers WHERE name = ? COLLATE NOCASE ORDER BY marker_id', (name,)
+        )
+
+    def has_name(self, uid, name):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM markers WHERE "ID" = ? AND name = ? COLLATE NOCASE LIMIT 1', (str(uid), name)
+            ).fetchone()
+            return row is not None
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Marker all'interno di un riquadro, tramite l'R*Tree."""
+        return self._query(
+            f'SELECT {M_COLUMNS} FROM markers m '
+            'JOIN markers_rtree r ON r.marker_id = m.marker_id '
+            'WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lon >= ? AND r.max_lon <= ? '
+            'ORDER BY m.marker_id',
+            (min_lat, max_lat, min_lon, max_lon)
+        )
+
+    # -------------- SCRITTURA --------------
+
+    def apply(self, commands):
+        """Applica più modifiche in un'unica transazione. Restituisce i risultati nello stesso ordine."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                results = [getattr(self, '_' + name)(*args) for name, args in commands]
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._dirty = True
+            return results
+
+    def _add(self, marker):
+        marker = {field: str(marker.get(field, '')) for field in FIELDNAMES}
+        self._insert_many([marker])
+        return marker
+
+    def _add_many(self, markers):
+        markers = [{field: str(marker.get(field, '')) for field in FIELDNAMES} for marker in markers]
+        self._insert_many(markers)
+        return markers
+
+    def _select(self, uid, idx):
+        """Restituisce (marker_id, marker) dell'idx-esimo marker dell'utente."""
+        if idx < 0:
+            return None, None
+        row = self._conn.execute(
+            f'SELECT marker_id, {COLUMNS} FROM markers WHERE "ID" = ? ORDER BY marker_id LIMIT 1 OFFSET ?',
+            (str(uid), idx)
+        ).fetchone()
+        if row is None:
+            return None, None
+        return row['marker_id'], _row_to_marker(row)
+
+    def _rename(self, uid, idx, new_name):
+        marker_id, marker = self._select(uid, idx)
+        if marker is None:
+            return None
+        self._conn.execute('UPDATE markers SET name = ? WHERE marker_id = ?', (new_name, marker_id))
+        return marker
+
+    def _delete(self, uid, idx):
+        marker_id, marker = self._select(uid, idx)
+        if marker is None:
+            return None
+        self._conn.execute('DELETE FROM markers WHERE marker_id = ?', (marker_id,))
+        return marker
+
+    def _delete_many(self, markers):
+        removed = []
+        for marker in markers:
+            row = self._conn.execute(
+                f'SELECT marker_id, {COLUMNS} FROM markers WHERE "ID" = ? AND timestamp = ? AND name = ? '
+                'ORDER BY marker_id LIMIT 1',
+                (marker['ID'], marker['timestamp'], marker['name'])
+            ).fetchone()
+            if row is None:
+                continue
+            self._conn.execute('DELETE FROM markers WHERE marker_id = ?', (row['marker_id'],))
+            removed.append(_row_to_marker(row))
+        return removed
+
+    def add(self, marker):
+        return self.apply([('add', (marker,))])[0]
+
+    def rename(self, uid, idx, new_name):
+        before = self.apply([('rename', (uid, idx, new_name))])[0]
+        return before['name'] if before else None
+
+    def delete(self, uid, idx):
+        return self.apply([('delete', (uid, idx))])[0]
+
+    def delete_many(self, markers):
+        return self.apply([('delete_many', (markers,))])[0]
+
+    def replace_all(self, markers):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute('DELETE FROM markers')
+                self._insert_many(markers)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            self.export_csv()
+
+    def compact(self):
+        """Esporta il CSV per il frontend se ci sono state modifiche. Restituisce True se ha scritto."""
+        with self._lock:
+            if not self._dirty:
+                return False
+            self.export_csv()
+            return True
+
+def open_store(backend, csv_path, db_path=None, append_only=False):
+    """Crea lo store dei marker per il backend scelto ('csv' o 'sqlite')."""
+    if backend == 'sqlite':
+        store = SqliteMarkerStore(db_path, csv_path)
+        store.migrate_from_csv()
+        return store
+    if backend == 'csv':
+        return MarkerStore(csv_path, append_only=append_only)
+    raise ValueError(f"Backend di storage sconosciuto: {backend}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrazione ed esportazione del database dei marker")
+    parser.add_argument('command', choices=['migrate', 'export'])
+    parser.add_argument('--db', default='markers.db')
+    parser.add_argument('--csv', default=os.path.join('shared', 'dati.csv'))
+    args = parser.parse_args()
+
+    sqlite_store = SqliteMarkerStore(args.db, args.csv)
+    if args.command == 'migrate':
+        print(f"Importati {sqlite_store.migrate_from_csv()} marker da {args.csv}")
+    else:
+        sqlite_store.export_csv()
+        print(f"Esportati {len(sqlite_store.all())} marker in {args.csv}")
+    sqlite_store.close()
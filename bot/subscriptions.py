@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+import time
+
+from spatial import haversine_km, radius_bbox
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscriptions (
+    sub_id INTEGER PRIMARY KEY,
+    "ID" TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    lat REAL,
+    lon REAL,
+    radius_km REAL,
+    min_lat REAL NOT NULL,
+    min_lon REAL NOT NULL,
+    max_lat REAL NOT NULL,
+    max_lon REAL NOT NULL,
+    created INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions ("ID");
+
+CREATE VIRTUAL TABLE IF NOT EXISTS subscriptions_rtree USING rtree (
+    sub_id, min_lat, max_lat, min_lon, max_lon
+);
+CREATE TRIGGER IF NOT EXISTS subscriptions_rtree_insert AFTER INSERT ON subscriptions BEGIN
+    INSERT INTO subscriptions_rtree VALUES (new.sub_id, new.min_lat, new.max_lat, new.min_lon, new.max_lon);
+END;
+CREATE TRIGGER IF NOT EXISTS subscriptions_rtree_delete AFTER DELETE ON subscriptions BEGIN
+    DELETE FROM subscriptions_rtree WHERE sub_id = old.sub_id;
+END;
+"""
+
+FIELDS = ['sub_id', 'ID', 'kind', 'lat', 'lon', 'radius_km', 'min_lat', 'min_lon', 'max_lat', 'max_lon', 'created']
+COLUMNS = ', '.join(f'"{field}"' for field in FIELDS)
+S_COLUMNS = ', '.join(f's."{field}"' for field in FIELDS)
+
+class SubscriptionStore:
+    """Iscrizioni degli utenti alle notifiche dei nuovi nodi in una zona, su SQLite.
+
+    Una zona è un cerchio (centro + raggio) oppure un riquadro. L'R*Tree contiene
+    il riquadro di ogni zona: la ricerca delle iscrizioni che contengono un nuovo
+    marker è una query puntuale sull'albero, seguita dal controllo della distanza
+    esatta per i cerchi, senza scorrere tutti gli iscritti.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    # -------------- LETTURA --------------
+
+    def by_user(self, uid):
+        return self._query(f'SELECT {COLUMNS} FROM subscriptions WHERE "ID" = ? ORDER BY sub_id', (str(uid),))
+
+    def count_user(self, uid):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM subscriptions WHERE "ID" = ?', (str(uid),)).fetchone()[0]
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM subscriptions').fetchone()[0]
+
+    def match(self, lat, lon, exclude=None):
+        """Iscrizioni la cui zona contiene il punto, al massimo una per utente.
+
+        exclude è l'ID di un utente da non considerare (chi ha aggiunto il marker).
+        Il risultato contiene anche 'distance_km' dal centro per le zone circolari.
+        """
+        candidates = self._query(
+            f'SELECT {S_COLUMNS} FROM subscriptions s '
+            'JOIN subscriptions_rtree r ON r.sub_id = s.sub_id '
+            'WHERE r.min_lat <= ? AND r.max_lat >= ? AND r.min_lon <= ? AND r.max_lon >= ? '
+            'ORDER BY s.sub_id',
+            (lat, lat, lon, lon)
+        )
+
+        # L'R*Tree usa float a 32 bit arrotondati verso l'esterno: si ricontrollano i limiti esatti
+        matches = {}
+        for sub in candidates:
+            if sub['ID'] == str(exclude) or sub['ID'] in matches:
+                continue
+            if not (sub['min_lat'] <= lat <= sub['max_lat'] and sub['min_lon'] <= lon <= sub['max_lon']):
+                continue
+            if sub['kind'] == 'radius':
+                sub['distance_km'] = float(haversine_km(sub['lat'], sub['lon'], lat, lon))
+                if sub['distance_km'] > sub['radius_km']:
+                    continue
+            matches[sub['ID']] = sub
+        return list(matches.values())
+
+    # -------------- SCRITTURA --------------
+
+    def _insert(self, uid, kind, lat, lon, radius_km, min_lat, min_lon, max_lat, max_lon):
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO subscriptions ("ID", kind, lat, lon, radius_km, min_lat, min_lon, max_lat, max_lon, created) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (str(uid), kind, lat, lon, radius_km, min_lat, min_lon, max_lat, max_lon, int(time.time()))
+            )
+            return self._query(f'SELECT {COLUMNS} FROM subscriptions WHERE sub_id = ?', (cursor.lastrowid,))[0]
+
+    def subscribe_radius(self, uid, lat, lon, radius_km):
+        """Iscrive l'utente ai nuovi nodi entro radius_km dal punto indicato."""
+        min_lat, min_lon, max_lat, max_lon = radius_bbox(lat, lon, radius_km)
+        return self._insert(uid, 'radius', lat, lon, radius_km,
+                            max(min_lat, -90), min_lon, min(max_lat, 90), max_lon)
+
+    def subscribe_bbox(self, uid, min_lat, min_lon, max_lat, max_lon):
+        """Iscrive l'utente ai nuovi nodi all'interno del riquadro indicato."""
+        return self._insert(uid, 'bbox', None, None, None, min_lat, min_lon, max_lat, max_lon)
+
+    def remove(self, uid, idx):
+        """Elimina l'idx-esima iscrizione dell'utente. Restituisce l'iscrizione eliminata o None."""
+        with self._lock:
+            subs = self.by_user(uid)
+            if idx < 0 or idx >= len(subs):
+                return None
+            self._conn.execute('DELETE FROM subscriptions WHERE sub_id = ?', (subs[idx]['sub_id'],))
+            return subs[idx]
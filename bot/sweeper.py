@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import sqlite3
+import threading
+import time
+
+from changelog import marker_key
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS confirmations (
+    confirmation_id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    "ID" TEXT NOT NULL,
+    confirmed INTEGER,
+    notified INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_confirmations_user ON confirmations ("ID");
+"""
+
+ACTIVE = 'active'
+NOTIFIED = 'notified'
+
+def is_sweepable(marker):
+    """Solo i marker con un proprietario Telegram (ID numerico) ricevono richieste di conferma."""
+    return str(marker.get('ID', '')).isdigit()
+
+class InactivitySweeper:
+    """Scadenze di conferma dei marker, per la pulizia periodica dei nodi inattivi.
+
+    Un marker resta attivo per inactive_after secondi dall'ultima conferma (o dalla
+    creazione, il suo timestamp); poi il proprietario riceve una richiesta di
+    conferma e, senza risposta entro grace secondi, il marker viene rimosso.
+
+    Le scadenze sono in un min-heap di (scadenza, chiave) con cancellazione pigra:
+    _due tiene la scadenza valida di ogni chiave e le voci dell'heap che non
+    corrispondono (marker confermati, rinominati o eliminati) vengono scartate
+    quando arrivano in cima. Un controllo estrae solo i k marker scaduti, O(k log n),
+    senza scorrere tutti i marker. Conferme e richieste inviate sono su SQLite,
+    così sopravvivono ai riavvii.
+    """
+
+    def __init__(self, db_path, inactive_after, grace):
+        self.db_path = db_path
+        self.inactive_after = inactive_after
+        self.grace = grace
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._heap = []
+        self._due = {}      # chiave -> (scadenza, stato)
+        self._markers = {}  # chiave -> marker
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __len__(self):
+        return len(self._due)
+
+    def awaiting(self):
+        """Marker in attesa di conferma dal proprietario."""
+        return sum(1 for _, state in self._due.values() if state == NOTIFIED)
+
+    def _schedule(self, key, due, state):
+        self._due[key] = (due, state)
+        heapq.heappush(self._heap, (due, key))
+
+    def _deadline(self, marker, row, now):
+        """Scadenza e stato di un marker in base alla sua riga di conferma (o None)."""
+        if row is not None and row['notified'] is not None:
+            return row['notified'] + self.grace, NOTIFIED
+        try:
+            last = float(marker['timestamp'])
+        except (KeyError, ValueError):
+            last = now  # timestamp non valido: si conta dal primo avvio che lo vede
+        if row is not None and row['confirmed'] is not None:
+            last = max(last, row['confirmed'])
+        return last + self.inactive_after, ACTIVE
+
+    def load(self, markers, now=None):
+        """Costruisce l'heap da tutti i marker (una volta, all'avvio): O(n)."""
+        now = now or time.time()
+        with self._lock:
+            rows = {row['key']: row for row in self._conn.execute('SELECT * FROM confirmations')}
+            self._due, self._markers = {}, {}
+            for marker in markers:
+                if not is_sweepable(marker):
+                    continue
+                key = marker_key(marker)
+                self._markers[key] = marker
+                self._due[key] = self._deadline(marker, rows.get(key), now)
+            self._heap = [(due, key) for key, (due, _) in self._due.items()]
+            heapq.heapify(self._heap)
+
+            # Conferme di marker eliminati mentre il bot era spento
+            stale = [(key,) for key in rows if key not in self._markers]
+            if stale:
+                self._conn.executemany('DELETE FROM confirmations WHERE key = ?', stale)
+
+    # -------------- MODIFICHE DEI MARKER --------------
+
+    def apply(self, changes, now=None):
+        """Aggiorna le scadenze dopo una scrittura (listener di MarkerWriter).
+
+        Una rinomina è un'azione del proprietario: vale come conferma.
+        """
+        now = now or time.time()
+        with self._lock:
+            for name, args, result in changes:
+                if not is_sweepable(result):
+                    continue
+                key = marker_key(result)
+                if name == 'add':
+                    self._markers[key] = result
+                    self._schedule(key, *self._deadline(result, None, now))
+                elif name == 'delete':
+                    self._forget(key)
+                elif name == 'rename':
+                    self._forget(key)
+                    marker = dict(result, name=args[2])
+                    new_key = marker_key(marker)
+                    self._markers[new_key] = marker
+                    self._conn.execute(
+                        'INSERT INTO confirmations (key, "ID", confirmed) VALUES (?, ?, ?) '
+                        'ON CONFLICT(key) DO UPDATE SET confirmed = excluded.confirmed, notified = NULL',
+                        (new_key, marker['ID'], int(now))
+                    )
+                    self._schedule(new_key, now + self.inactive_after, ACTIVE)
+
+    def _forget(self, key):
+        self._due.pop(key, None)
+        self._markers.pop(key, None)
+        self._conn.execute('DELETE FROM confirmations WHERE key = ?', (key,))
+
+    def forget(self, markers):
+        """Rimuove i marker dalle scadenze (anche se erano già stati eliminati)."""
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for marker in markers:
+                    self._forget(marker_key(marker))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    # -------------- CONTROLLO PERIODICO --------------
+
+    def pop_due(self, now=None, limit=None):
+        """Estrae i marker scaduti: (da notificare, da rimuovere).
+
+        Al massimo limit marker da notificare; i restanti tornano nell'heap per il
+        controllo successivo, mentre quelli da rimuovere vengono raccolti tutti (il
+        limite sulle richieste non deve ritardare le rimozioni). I marker estratti
+        vanno passati a mark_notified, e quelli da rimuovere a forget dopo
+        l'eliminazione (o a requeue se non è riuscita).
+        """
+        now = now or time.time()
+        notify, remove, deferred = [], [], []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, key = heapq.heappop(self._heap)
+                entry = self._due.get(key)
+                if entry is None or entry[0] != due:
+                    continue  # voce superata da una conferma o un'eliminazione
+                if entry[1] == NOTIFIED:
+                    remove.append(self._markers[key])
+                elif limit is not None and len(notify) >= limit:
+                    deferred.append((due, key))
+                else:
+                    notify.append(self._markers[key])
+            for item in deferred:
+                heapq.heappush(self._heap, item)
+        return notify, remove
+
+    def requeue(self, markers):
+        """Rimette nell'heap marker estratti ma non gestiti, con la loro scadenza."""
+        with self._lock:
+            for marker in markers:
+                key = marker_key(marker)
+                if key in self._due:
+                    heapq.heappush(self._heap, (self._due[key][0], key))
+
+    def mark_notified(self, markers, now=None):
+        """Registra la richiesta di conferma. Restituisce [(confirmation_id, marker)] per i pulsanti."""
+        now = now or time.time()
+        result = []
+        with self._lock:
+            # Una sola transazione per tutte le richieste del controllo
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for marker in markers:
+                    key = marker_key(marker)
+                    if key not in self._markers:
+                        continue
+                    self._conn.execute(
+                        'INSERT INTO confirmations (key, "ID", notified) VALUES (?, ?, ?) '
+                        'ON CONFLICT(key) DO UPDATE SET notified = excluded.notified',
+                        (key, marker['ID'], int(now))
+                    )
+                    confirmation_id = self._conn.execute(
+                        'SELECT confirmation_id FROM confirmations WHERE key = ?', (key,)
+                    ).fetchone()[0]
+                    result.append((confirmation_id, marker))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            for _, marker in result:
+                self._schedule(marker_key(marker), int(now) + self.grace, NOTIFIED)
+        return result
+
+    # -------------- RISPOSTE DEI PROPRIETARI --------------
+
+    def lookup(self, confirmation_id, uid):
+        """Marker della richiesta, solo se appartiene all'utente ed esiste ancora."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT key FROM confirmations WHERE confirmation_id = ? AND "ID" = ?',
+                (confirmation_id, str(uid))
+            ).fetchone()
+            return self._markers.get(row['key']) if row else None
+
+    def confirm(self, confirmation_id, uid, now=None):
+        """Conferma un marker: la scadenza riparte da ora. Restituisce il marker o None."""
+        now = now or time.time()
+        with self._lock:
+            marker = self.lookup(confirmation_id, uid)
+            if marker is None:
+                return None
+            key = marker_key(marker)
+            self._conn.execute(
+                'UPDATE confirmations SET confirmed = ?, notified = NULL WHERE key = ?', (int(now), key)
+            )
+            self._schedule(key, now + self.inactive_after, ACTIVE)
+            return marker
+
+    def pending(self, uid):
+        """Richieste dell'utente ancora senza risposta, come [(confirmation_id, marker)]."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT confirmation_id, key FROM confirmations '
+                'WHERE "ID" = ? AND notified IS NOT NULL ORDER BY confirmation_id',
+                (str(uid),)
+            ).fetchall()
+            return [(row['confirmation_id'], self._markers[row['key']]) for row in rows if row['key'] in self._markers]
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import logging
+import math
+import os
+import shutil
+
+from changelog import delta_row, marker_key
+from snapshot import atomic_write
+
+MAX_LAT = 85.05112878
+
+def tile_coords(lat, lon, z):
+    """Coordinate x/y della tile web mercator che contiene il punto al livello z."""
+    lat = max(min(lat, MAX_LAT), -MAX_LAT)
+    n = 1 << z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+class TileBuilder:
+    """Genera tile JSON statiche z/x/y dei marker, servite da http-server.
+
+    Fino a detail_zoom - 1 le tile contengono cluster calcolati lato server su
+    una griglia di 2^cell_bits x 2^cell_bits celle per tile (le celle con un solo
+    marker vengono inviate come marker). Da detail_zoom in su le tile contengono
+    i singoli marker e il client riusa quelle di detail_zoom.
+    Dopo una modifica vengono riscritte solo le tile che contengono i marker toccati.
+    """
+
+    def __init__(self, directory, detail_zoom=10, cell_bits=3):
+        self.root = os.path.join(directory, 'tiles')
+        self.detail_zoom = detail_zoom
+        self.cell_bits = cell_bits
+        self._reset()
+
+    def _reset(self):
+        self._rows = {}        # chiave marker -> riga
+        self._tiles = {}       # (z, x, y) -> chiavi (dettaglio) o celle (cluster)
+        self._cells = {}       # (z, cx, cy) -> [chiavi, somma lat, somma lon]
+        self._hashes = {z: {} for z in range(self.detail_zoom + 1)}
+
+    def _tiles_of(self, row):
+        """Tile (e celle di cluster) che contengono il marker, a tutti i livelli."""
+        lat, lon = row['lat'], row['lon']
+        result = []
+        for z in range(self.detail_zoom):
+            cx, cy = tile_coords(lat, lon, z + self.cell_bits)
+            result.append(((z, cx >> self.cell_bits, cy >> self.cell_bits), (z, cx, cy)))
+        result.append(((self.detail_zoom,) + tile_coords(lat, lon, self.detail_zoom), None))
+        return result
+
+    def _insert(self, row):
+        key = marker_key(row)
+        self._rows[key] = row
+        touched = set()
+        for tile, cell in self._tiles_of(row):
+            touched.add(tile)
+            if cell is None:
+                self._tiles.setdefault(tile, set()).add(key)
+                continue
+            self._tiles.setdefault(tile, set()).add(cell)
+            agg = self._cells.setdefault(cell, [set(), 0.0, 0.0])
+            agg[0].add(key)
+            agg[1] += row['lat']
+            agg[2] += row['lon']
+        return touched
+
+    def _remove(self, key):
+        row = self._rows.pop(key, None)
+        if row is None:
+            return set()
+        touched = set()
+        for tile, cell in self._tiles_of(row):
+            touched.add(tile)
+            members = self._tiles.get(tile, set())
+            if cell is None:
+                members.discard(key)
+            else:
+                agg = self._cells[cell]
+                agg[0].discard(key)
+                agg[1] -= row['lat']
+                agg[2] -= row['lon']
+                if not agg[0]:
+                    del self._cells[cell]
+                    members.discard(cell)
+            if not members:
+                self._tiles.pop(tile, None)
+        return touched
+
+    def _tile_content(self, tile):
+        z = tile[0]
+        members = self._tiles.get(tile)
+        if not members:
+            return None
+        if z == self.detail_zoom:
+            return {'markers': [self._rows[key] for key in sorted(members)]}
+
+        clusters, markers = [], []
+        for cell in sorted(members):
+            keys, sum_lat, sum_lon = self._cells[cell]
+            if len(keys) == 1:
+                markers.append(self._rows[next(iter(keys))])
+            else:
+                clusters.append({
+                    'lat': round(sum_lat / len(keys), 6),
+                    'lon': round(sum_lon / len(keys), 6),
+                    'count': len(keys),
+                })
+        return {'clusters': clusters, 'markers': markers}
+
+    def _write_tiles(self, tiles, zooms=()):
+        zooms = set(zooms)
+        for tile in tiles:
+            z, x, y = tile
+            path = os.path.join(self.root, str(z), str(x), f'{y}.json')
+            content = self._tile_content(tile)
+            zooms.add(z)
+            if content is None:
+                self._hashes[z].pop(f'{x}/{y}', None)
+                if os.path.exists(path):
+                    os.remove(path)
+                continue
+            content.update({'z': z, 'x': x, 'y': y})
+            data = json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            self._hashes[z][f'{x}/{y}'] = hashlib.sha1(data).hexdigest()[:12]
+            atomic_write(path, data)
+
+        # Indice per livello: tile non vuote e hash del contenuto, per scaricare solo quelle cambiate
+        for z in zooms:
+            index = {'z': z, 'detail_zoom': self.detail_zoom, 'tiles': self._hashes[z]}
+            atomic_write(
+                os.path.join(self.root, str(z), 'index.json'),
+                json.dumps(index, separators=(',', ':')).encode('utf-8')
+            )
+
+    def rebuild(self, markers):
+        """Ricostruisce tutte le tile da zero."""
+        self._reset()
+        for marker in markers:
+            try:
+                self._insert(delta_row(marker))
+            except (KeyError, ValueError):
+                continue
+        shutil.rmtree(self.root, ignore_errors=True)
+        self._write_tiles(list(self._tiles), zooms=range(self.detail_zoom + 1))
+        logging.info(f"Tile ricostruite: {len(self._tiles)} tile per {len(self._rows)} marker")
+
+    def update(self, changes):
+        """Aggiorna solo le tile toccate dalle modifiche del writer."""
+        touched = set()
+        for name, args, result in changes:
+            if name in ('rename', 'delete'):
+                touched |= self._remove(marker_key(result))
+            if name == 'add':
+                touched |= self._insert(delta_row(result))
+            elif name == 'rename':
+                touched |= self._insert(delta_row(dict(result, name=args[2])))
+        self._write_tiles(touched)
+        return len(touched)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import collections
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+MAX_HEADERS = 100
+MAX_LINE = 8192
+MAX_BODY = 1024 * 1024  # byte, gli update di Telegram sono molto più piccoli
+
+STATUS_TEXT = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+    411: 'Length Required', 413: 'Payload Too Large', 503: 'Service Unavailable',
+}
+
+class WebhookReceiver:
+    """Ricevitore HTTP locale per il webhook di Telegram, al posto del long polling.
+
+    Accetta POST sul percorso del webhook, verifica l'header
+    X-Telegram-Bot-Api-Secret-Token, decodifica l'update e lo mette in
+    app.update_queue. Le connessioni restano aperte (keep-alive) e la risposta
+    parte solo quando l'update è in coda: se gli update in attesa superano
+    max_backlog la risposta viene ritardata fino a backlog_timeout secondi e poi
+    rifiutata con 503, così Telegram rallenta e ritenta invece di accumulare
+    update in memoria (le connessioni sono limitate da max_connections di setWebhook).
+    """
+
+    def __init__(self, app, secret, path='/', max_backlog=1024, backlog=None,
+                 backlog_timeout=5, keepalive_timeout=75):
+        self.app = app
+        self.secret = secret.encode('utf-8')
+        self.path = path or '/'
+        self.max_backlog = max_backlog
+        self.backlog = backlog or app.update_queue.qsize
+        self.backlog_timeout = backlog_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.responses = collections.Counter()  # codice di stato -> risposte
+        self._server = None
+        self._connections = set()
+
+    async def _wait_backlog(self):
+        """Attende che la coda scenda sotto max_backlog; False se non succede entro backlog_timeout."""
+        if self.backlog() < self.max_backlog:
+            return True
+        deadline = asyncio.get_running_loop().time() + self.backlog_timeout
+        while self.backlog() >= self.max_backlog:
+            if asyncio.get_running_loop().time() >= deadline:
+                return False
+            await asyncio.sleep(0.01)
+        return True
+
+    async def _accept(self, method, target, headers, body):
+        """Codice di stato per una richiesta; l'update valido viene messo in coda."""
+        if target.split('?')[0] != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        token = headers.get('x-telegram-bot-api-secret-token', '').encode('utf-8')
+        if not hmac.compare_digest(token, self.secret):
+            return 403
+        try:
+            update = Update.de_json(json.loads(body), self.app.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logging.error(f"Update webhook non valido: {e}")
+            return 400
+        if update is None:
+            return 400
+        if not await self._wait_backlog():
+            return 503
+        await self.app.update_queue.put(update)
+        return 200
+
+    # -------------- HTTP --------------
+
+    def _head(self, status, keep_alive):
+        lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", "Content-Length: 0"]
+        if status == 503:
+            lines.append("Retry-After: 1")
+        if not keep_alive:
+            lines.append("Connection: close")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _handle(self, reader, writer):
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    line = await asyncio.wait_for(reader.readline(), self.keepalive_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    writer.write(self._head(400, False))
+                    break
+                headers = {}
+                for _ in range(MAX_HEADERS):
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                # Solo corpi con Content-Length (Telegram non usa il chunked)
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                length = headers.get('content-length')
+                if length is None or not length.isdigit():
+                    status, keep_alive = (411 if method == 'POST' else 405), False
+                elif int(length) > MAX_BODY:
+                    status, keep_alive = 413, False
+                else:
+                    body = await reader.readexactly(int(length))
+                    status = await self._accept(method, target, headers, body)
+
+                self.responses[status] += 1
+                writer.write(self._head(status, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        except Exception as e:
+            logging.error(f"Errore webhook: {e}")
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle, host, port, limit=MAX_LINE)
+        logging.info(f"Webhook in ascolto su {host}:{port}{self.path}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
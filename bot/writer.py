@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import logging
+import time
+
+class MarkerWriter:
+    """Unico task asyncio che scrive sul file dei marker.
+
+    Gli handler inviano le modifiche tramite una coda e ricevono un future che
+    si risolve quando la modifica è su disco. Le modifiche arrivate nella stessa
+    finestra di flush vengono applicate con una sola scrittura, così due utenti
+    concorrenti non si sovrascrivono a vicenda.
+    on_flush(secondi, comandi), se indicata, viene chiamata dopo ogni scrittura riuscita.
+    """
+
+    def __init__(self, store, flush_window=0.05, on_flush=None):
+        self.store = store
+        self.flush_window = flush_window
+        self.on_flush = on_flush
+        self._queue = asyncio.Queue()
+        self._task = None
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Registra una coroutine chiamata dopo ogni scrittura con la lista delle
+        modifiche applicate, come tuple (operazione, argomenti, risultato)."""
+        self._listeners.append(callback)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Scrive le modifiche ancora in coda e ferma il task."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def submit(self, name, *args):
+        """Accoda una modifica e attende che sia stata scritta su disco."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((name, args, future))
+        return await future
+
+    async def add(self, marker):
+        return await self.submit('add', marker)
+
+    async def add_many(self, markers):
+        """Aggiunge più marker con un'unica scrittura. Restituisce i marker aggiunti."""
+        return await self.submit('add_many', list(markers))
+
+    async def rename(self, uid, idx, new_name):
+        """Restituisce il vecchio nome, o None se la selezione non è valida."""
+        before = await self.submit('rename', uid, idx, new_name)
+        return before['name'] if before else None
+
+    async def delete(self, uid, idx):
+        return await self.submit('delete', uid, idx)
+
+    async def delete_many(self, markers):
+        """Elimina più marker (per ID, timestamp e nome) con un'unica scrittura. Restituisce i marker eliminati."""
+        return await self.submit('delete_many', list(markers))
+
+    async def compact(self):
+        return await self.submit('compact')
+
+    async def _run(self):
+        running = True
+        while running:
+            batch = [await self._queue.get()]
+            # Raccoglie tutte le modifiche arrivate nella finestra di flush
+            await asyncio.sleep(self.flush_window)
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+
+            commands = [item for item in batch if item[0] != 'compact']
+            compactions = [item for item in batch if item[0] == 'compact']
+            await self._flush(commands)
+            if compactions:
+                await self._flush_compaction(compactions)
+
+    async def _flush(self, commands):
+        if not commands:
+            return
+        started = time.perf_counter()
+        try:
+            results = await asyncio.to_thread(
+                self.store.apply, [(name, args) for name, args, _ in commands]
+            )
+        except Exception as e:
+            logging.error(f"Errore scrittura marker: {e}")
+            for _, _, future in commands:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), result in zip(commands, results):
+            if not future.done():
+                future.set_result(result)
+        if self.on_flush is not None:
+            self.on_flush(time.perf_counter() - started, len(commands))
+
+        changes = []
+        for (name, args, _), result in zip(commands, results):
+            if result is None:
+                continue
+            if name == 'add_many':
+                # Per i listener un'aggiunta in blocco è una serie di aggiunte
+                changes.extend(('add', (marker,), marker) for marker in result)
+            elif name == 'delete_many':
+                # ...e un'eliminazione in blocco una serie di eliminazioni
+                changes.extend(('delete', (marker['ID'], None), marker) for marker in result)
+            else:
+                changes.append((name, args, result))
+        if not changes:
+            return
+        for callback in self._listeners:
+            try:
+                await callback(changes)
+            except Exception as e:
+                logging.error(f"Errore nel listener delle modifiche marker: {e}")
+
+    async def _flush_compaction(self, compactions):
+        try:
+            result = await asyncio.to_thread(self.store.compact)
+        except Exception as e:
+            logging.error(f"Errore compattazione marker: {e}")
+            for _, _, future in compactions:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for _, _, future in compactions:
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Sicurezza del MarkerStore in modalità append_only rispetto alle interruzioni.
+
+Ogni test simula un crash lasciando i file come li troverebbe il bot al riavvio
+e verifica che un nuovo MarkerStore legga solo le modifiche confermate.
+
+Uso: python -m pytest tests
+"""
+
+import os
+import shutil
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot'))
+
+from marker_store import FIELDNAMES, MarkerStore, write_csv
+
+def make_marker(i, uid='100001', desc="Nodo di prova"):
+    return {
+        'lat': f"45.{i:04d}", 'lon': f"10.{i:04d}", 'name': f"Nodo{i}", 'desc': desc,
+        'node_type': "MeshCore", 'frequency': "868 MHz", 'link': "",
+        'ID': uid, 'user': f"user{uid}", 'timestamp': str(1700000000 + i),
+    }
+
+def names(store):
+    return [m['name'] for m in store.all()]
+
+def open_store(tmp_path, count=3):
+    path = str(tmp_path / 'dati.csv')
+    write_csv(path, [make_marker(i) for i in range(count)])
+    return path, MarkerStore(path, append_only=True)
+
+def row_bytes(marker):
+    return (','.join(marker[field] for field in FIELDNAMES) + '\r\n').encode('utf-8')
+
+# -------------- CRASH TRA AGGIUNTA E COMPATTAZIONE --------------
+
+def test_appended_rows_and_journal_survive_restart(tmp_path):
+    path, store = open_store(tmp_path)
+    store.apply([('add', (make_marker(3),)), ('add', (make_marker(4),))])
+    store.apply([('rename', ('100001', 0, "Rinominato")), ('delete', ('100001', 1))])
+    assert os.path.exists(path + '.journal')
+
+    # Crash prima di compact(): righe accodate al CSV e operazioni nel journal
+    restarted = MarkerStore(path, append_only=True)
+    assert names(restarted) == ["Rinominato", "Nodo2", "Nodo3", "Nodo4"]
+
+    assert restarted.compact()
+    assert not os.path.exists(path + '.journal')
+    assert names(MarkerStore(path)) == ["Rinominato", "Nodo2", "Nodo3", "Nodo4"]
+
+def test_crash_during_compaction_replays_journal_idempotently(tmp_path):
+    path, store = open_store(tmp_path)
+    store.apply([('rename', ('100001', 0, "Rinominato")), ('delete', ('100001', 1))])
+    journal = open(path + '.journal', 'rb').read()
+
+    # Crash dopo la sostituzione del CSV ma prima della rimozione del journal
+    store.compact()
+    with open(path + '.journal', 'wb') as f:
+        f.write(journal)
+
+    assert names(MarkerStore(path, append_only=True)) == ["Rinominato", "Nodo2"]
+
+def test_crash_before_compaction_replace_keeps_old_snapshot(tmp_path):
+    path, store = open_store(tmp_path)
+    store.apply([('delete', ('100001', 0))])
+    snapshot = str(tmp_path / 'copia.csv')
+    shutil.copy(path, snapshot)
+
+    # Crash durante la scrittura del file temporaneo: il CSV resta quello precedente
+    store.compact()
+    shutil.copy(snapshot, path)
+    with open(path + '.journal', 'w', encoding='utf-8') as f:
+        f.write('{"op": "delete", "ID": "100001", "timestamp": "1700000000", "name": "Nodo0"}\n')
+
+    assert names(MarkerStore(path, append_only=True)) == ["Nodo1", "Nodo2"]
+
+# -------------- RIGA CSV TRONCATA --------------
+
+def test_torn_last_row_is_truncated(tmp_path):
+    path, store = open_store(tmp_path)
+    size = os.path.getsize(path)
+    # Riga tagliata nel timestamp: coordinate e ID sono validi ma la riga non è confermata
+    with open(path, 'ab') as f:
+        f.write(row_bytes(make_marker(3))[:-6])
+
+    restarted = MarkerStore(path, append_only=True)
+    assert names(restarted) == ["Nodo0", "Nodo1", "Nodo2"]
+    assert os.path.getsize(path) == size
+
+    # Le aggiunte successive finiscono su una riga nuova
+    restarted.apply([('add', (make_marker(4),))])
+    assert names(MarkerStore(path)) == ["Nodo0", "Nodo1", "Nodo2", "Nodo4"]
+
+def test_torn_row_with_quoted_newline_is_truncated(tmp_path):
+    path = str(tmp_path / 'dati.csv')
+    write_csv(path, [make_marker(0), make_marker(1, desc="prima riga\nseconda riga")])
+    size = os.path.getsize(path)
+    # La riga interrotta contiene a sua volta un ritorno a capo tra virgolette
+    with open(path, 'ab') as f:
+        f.write('45.0002,10.0002,Nodo2,"riga uno\nriga due",MeshCore,868 MHz,,100001,user'.encode('utf-8'))
+
+    store = MarkerStore(path, append_only=True)
+    assert names(store) == ["Nodo0", "Nodo1"]
+    assert store.all()[1]['desc'] == "prima riga\nseconda riga"
+    assert os.path.getsize(path) == size
+
+def test_header_without_newline_is_completed(tmp_path):
+    path = str(tmp_path / 'dati.csv')
+    with open(path, 'wb') as f:
+        f.write(','.join(FIELDNAMES).encode('utf-8'))
+
+    store = MarkerStore(path, append_only=True)
+    store.apply([('add', (make_marker(0),))])
+    assert names(MarkerStore(path)) == ["Nodo0"]
+
+# -------------- RIGA DEL JOURNAL TRONCATA --------------
+
+def test_torn_journal_line_is_ignored_and_removed(tmp_path):
+    path, store = open_store(tmp_path)
+    store.apply([('rename', ('100001', 0, "Rinominato"))])
+    with open(path + '.journal', 'ab') as f:
+        f.write(b'{"op": "delete", "ID": "100001", "timest')
+
+    restarted = MarkerStore(path, append_only=True)
+    assert names(restarted) == ["Rinominato", "Nodo1", "Nodo2"]
+
+    # L'operazione successiva non deve finire sulla riga troncata
+    restarted.apply([('delete', ('100001', 2))])
+    assert names(MarkerStore(path, append_only=True)) == ["Rinominato", "Nodo1"]
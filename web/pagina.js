@@ -3,6 +3,7 @@
 const appStats = {
   totalNodes: 0,
   uniqueUsers: 0,
+  addedToday: null,
   lastUpdate: null
 };
 
@@ -11,12 +12,22 @@ let allMarkersData = []; // Memorizza tutti i dati dei marker
 const searchInput = document.getElementById('searchInput');
 const searchResults = document.getElementById('searchResults');
 
+// Indice di ricerca per nome pubblicato dal bot (n-grammi), scaricato alla prima ricerca
+const SEARCH_INDEX_URL = '/shared/search.json';
+const SEARCH_INDEX_MAX_AGE = 60000; // ms prima di ricontrollare l'indice (richiesta condizionale)
+const SEARCH_DEBOUNCE = 150; // ms di pausa nella digitazione prima di cercare
+const SEARCH_RESULTS = 10;
+let searchIndex = null;
+let searchIndexLoading = null;
+let searchTimer = null;
+
 // Funzione per aggiornare le statistiche nell'header
 function updateHeaderStats() {
   document.getElementById('nodeCount').textContent = appStats.totalNodes;
   document.getElementById('userCount').textContent = appStats.uniqueUsers;
   document.getElementById('lastUpdate').textContent = appStats.lastUpdate ? 
     new Date(appStats.lastUpdate).toLocaleTimeString('it-IT') : 'N/D';
+  document.getElementById('todayCount').textContent = appStats.addedToday ?? 'N/D';
 }
 
 // Inizializzazione mappa con migliori impostazioni predefinite
@@ -59,7 +70,53 @@ let activeFilters = {
   frequency: null,
   node_type: null
 };
+
+// Marker divisi per coppia (frequenza, tipo): cambiando i filtri si aggiungono o tolgono
+// dal cluster solo i gruppi che cambiano stato, senza ricalcolare tutti i cluster
+let markerBuckets = new Map(); // "frequenza|tipo" -> { frequency, node_type, markers, count, visible }
+let publishedBuckets = null; // conteggi per gruppo dallo snapshot del bot (null con il CSV)
 let autoRefreshInterval;
+
+// Snapshot pubblicato dal bot: versione e ETag dell'ultimo caricamento
+const SNAPSHOT_URL = '/shared/snapshot.json';
+const DELTAS_URL = '/shared/deltas/';
+const STATS_URL = '/shared/stats.json';
+let snapshotVersion = null;
+let snapshotEtag = null;
+
+// Snapshot binario (shared/snapshot.bin) decodificato in un Web Worker; senza Worker si usa il JSON
+const SNAPSHOT_BIN_URL = '/shared/snapshot.bin';
+let snapshotWorker = null;
+let binaryEtag = null;
+let workerRequestId = 0;
+const workerRequests = new Map(); // id richiesta -> { resolve, reject }
+let markersByKey = new Map(); // Chiave marker -> marker Leaflet, per applicare i delta
+
+// Caricamento a tile (shared/tiles/z/x/y.json generate dal bot): solo le tile visibili,
+// con cluster calcolati lato server. Pensato per layer molto grandi, con false si usa lo snapshot
+const USE_TILES = false;
+const TILES_URL = '/shared/tiles/';
+const TILE_DETAIL_ZOOM = 10; // Deve corrispondere a TILE_DETAIL_ZOOM del bot
+const tilesLayer = L.layerGroup();
+const loadedTiles = new Map(); // "z/x/y" -> { hash, layers, markers }
+const tileIndexes = new Map(); // z -> { etag, index }
+
+// Layer delle reti esterne pubblicati dal bot (shared/layers/<sorgente>/snapshot.json),
+// caricati solo quando vengono attivati dal controllo dei layer
+const EXTERNAL_LAYERS = {
+  loraitalia: { label: 'LoRa Italia', color: '#2e7d32' },
+  meshcore: { label: 'MeshCore', color: '#6a1b9a' }
+};
+const LAYERS_URL = '/shared/layers/';
+const EXTERNAL_REFRESH_INTERVAL = 300000; // Il bot aggiorna i layer ogni 10 minuti
+const externalLayers = new Map(); // sorgente -> { group, etag, version }
+
+// Copertura stimata dei nodi (shared/coverage/z/x/y.png generate dal bot): vengono
+// richieste solo le tile presenti nell'indice del livello, con l'hash per la cache
+const COVERAGE_URL = '/shared/coverage/';
+const COVERAGE_MIN_ZOOM = 6; // Devono corrispondere a COVERAGE_ZOOMS del bot
+const COVERAGE_MAX_ZOOM = 10;
+const coverageIndexes = new Map(); // z -> { etag, tiles }
 const statusBar = document.getElementById('statusBar');
 const statusText = document.getElementById('statusText');
 const statusIcon = statusBar.querySelector('i');
@@ -183,27 +240,314 @@ function parseCSV(csvText) {
   return results;
 }
 
+// Converte lo snapshot colonnare in righe come quelle del CSV
+function snapshotToRows(snapshot) {
+  const columns = snapshot.columns;
+  const fields = Object.keys(columns);
+  const rows = new Array(snapshot.count);
+  for (let i = 0; i < snapshot.count; i++) {
+    const row = {};
+    fields.forEach(field => {
+      row[field] = columns[field][i];
+    });
+    rows[i] = row;
+  }
+  return rows;
+}
+
+// Worker creato al primo uso; null se il browser non supporta i Web Worker o il worker non parte
+function getSnapshotWorker() {
+  if (snapshotWorker || typeof Worker === 'undefined') return snapshotWorker;
+  try {
+    snapshotWorker = new Worker('snapshot-worker.js');
+  } catch (error) {
+    console.warn('Web Worker non disponibile:', error);
+    return null;
+  }
+  snapshotWorker.onmessage = (event) => {
+    const request = workerRequests.get(event.data.id);
+    if (!request) return;
+    workerRequests.delete(event.data.id);
+    request.resolve(event.data);
+  };
+  snapshotWorker.onerror = (event) => {
+    console.warn('Errore nel worker dello snapshot:', event.message);
+    workerRequests.forEach(request => request.reject(new Error(event.message)));
+    workerRequests.clear();
+    snapshotWorker.terminate();
+    snapshotWorker = false; // Non ritentare: si usa lo snapshot JSON
+  };
+  return snapshotWorker;
+}
+
+// Chiede al worker lo snapshot binario; la risposta contiene gli array tipizzati trasferiti
+function fetchBinarySnapshot(worker) {
+  return new Promise((resolve, reject) => {
+    const id = ++workerRequestId;
+    workerRequests.set(id, { resolve, reject });
+    worker.postMessage({ id, url: new URL(SNAPSHOT_BIN_URL, location.href).href, etag: binaryEtag });
+  });
+}
+
+// Righe come quelle del CSV dallo snapshot binario, senza parsing: lat/lon restano numeri
+function binaryToRows(snapshot) {
+  const { lat, lon, indices, codes, strings } = snapshot;
+  const nodeTypes = snapshot.dictionaries.node_type;
+  const frequencies = snapshot.dictionaries.frequency;
+  const rows = new Array(snapshot.count);
+  for (let i = 0; i < snapshot.count; i++) {
+    rows[i] = {
+      lat: lat[i],
+      lon: lon[i],
+      name: strings[indices.name[i]],
+      desc: strings[indices.desc[i]],
+      node_type: nodeTypes[codes.node_type[i]],
+      frequency: frequencies[codes.frequency[i]],
+      link: strings[indices.link[i]],
+      ID: strings[indices.ID[i]],
+      user: strings[indices.user[i]],
+      timestamp: strings[indices.timestamp[i]]
+    };
+  }
+  return rows;
+}
+
+// Scarica lo snapshot solo se è cambiato (If-None-Match), altrimenti restituisce null.
+// Prima il binario tramite il worker, poi il JSON e infine il CSV
+async function fetchMarkerData() {
+  const worker = getSnapshotWorker();
+  if (worker) {
+    try {
+      const result = await fetchBinarySnapshot(worker);
+      if (result.status === 304) return null;
+      if (result.status === 200) {
+        binaryEtag = result.etag;
+        if (result.snapshot.version === snapshotVersion) return null;
+        snapshotVersion = result.snapshot.version;
+        publishedBuckets = result.snapshot.dictionaries.buckets || null;
+        return binaryToRows(result.snapshot);
+      }
+    } catch (error) {
+      console.warn('Snapshot binario non disponibile:', error);
+    }
+  }
+
+  const headers = snapshotEtag ? { 'If-None-Match': snapshotEtag } : {};
+  const response = await fetch(SNAPSHOT_URL, { headers, cache: 'no-store' });
+  if (response.status === 304) return null;
+
+  if (response.ok) {
+    const snapshot = await response.json();
+    snapshotEtag = response.headers.get('ETag');
+    if (snapshot.version === snapshotVersion) return null;
+    snapshotVersion = snapshot.version;
+    publishedBuckets = snapshot.buckets || null;
+    return snapshotToRows(snapshot);
+  }
+
+  const csvResponse = await fetch('/shared/dati.csv', { cache: 'no-cache' });
+  if (!csvResponse.ok) throw new Error(`Errore HTTP: ${csvResponse.status}`);
+  snapshotVersion = null;
+  publishedBuckets = null;
+  return parseCSV(await csvResponse.text());
+}
+
+// Chiave stabile di un marker, la stessa usata dal bot nei delta
+function markerKey(row) {
+  return `${row.ID}|${row.timestamp}|${row.name}`;
+}
+
+// Coordinate già numeriche (snapshot) o testo (CSV, delta)
+function coordinate(value) {
+  return typeof value === 'number' ? value : parseFloat(value);
+}
+
+function createMarker(row, lat = coordinate(row.lat), lon = coordinate(row.lon)) {
+  return L.marker([lat, lon], {
+    title: row.name || 'Nodo LoRa',
+    riseOnHover: true,
+    data: row
+  }).bindPopup(formatPopupContent(row));
+}
+
+function matchesFilters(data) {
+  return (
+    (!activeFilters.frequency || data.frequency === activeFilters.frequency) &&
+    (!activeFilters.node_type || data.node_type === activeFilters.node_type)
+  );
+}
+
+function getBucket(data) {
+  const key = `${data.frequency}|${data.node_type}`;
+  let bucket = markerBuckets.get(key);
+  if (!bucket) {
+    bucket = { frequency: data.frequency, node_type: data.node_type, markers: [], count: 0, visible: matchesFilters(data) };
+    markerBuckets.set(key, bucket);
+  }
+  return bucket;
+}
+
+// Divide i marker nei gruppi; i conteggi per la barra di stato vengono dallo snapshot se c'è
+function buildBuckets(markers, counts) {
+  markerBuckets = new Map();
+  markers.forEach(marker => getBucket(marker.options.data).markers.push(marker));
+  if (counts) {
+    counts.forEach(published => { getBucket(published).count = published.count; });
+  } else {
+    markerBuckets.forEach(bucket => { bucket.count = bucket.markers.length; });
+  }
+}
+
+function visibleMarkers() {
+  let markers = [];
+  markerBuckets.forEach(bucket => {
+    if (bucket.visible) markers = markers.concat(bucket.markers);
+  });
+  return markers;
+}
+
+function visibleCount() {
+  let count = 0;
+  markerBuckets.forEach(bucket => {
+    if (bucket.visible) count += bucket.count;
+  });
+  return count;
+}
+
+function addToBucket(marker) {
+  const bucket = getBucket(marker.options.data);
+  bucket.markers.push(marker);
+  bucket.count++;
+  if (bucket.visible) markersCluster.addLayer(marker);
+}
+
+function removeFromBucket(marker) {
+  const bucket = getBucket(marker.options.data);
+  const index = bucket.markers.indexOf(marker);
+  if (index === -1) return;
+  bucket.markers.splice(index, 1);
+  bucket.count--;
+  if (bucket.visible) markersCluster.removeLayer(marker);
+}
+
+// Statistiche dell'header calcolate sui dati caricati
+function updateDataStats() {
+  const uniqueUsers = new Set(allMarkersData.map(row => row.user || row.ID));
+  appStats.totalNodes = allMarkersData.length;
+  appStats.uniqueUsers = uniqueUsers.size;
+  appStats.lastUpdate = new Date();
+  updateHeaderStats();
+}
+
+// Nodi aggiunti oggi, dalle statistiche aggregate pubblicate dal bot (nessun calcolo sui marker)
+async function fetchDailyStats() {
+  try {
+    const response = await fetch(STATS_URL, { cache: 'no-store' });
+    if (!response.ok) return;
+    const stats = await response.json();
+    const now = new Date();
+    const today = `${now.getFullYear()}-${String(now.getMonth() + 1).padStart(2, '0')}-${String(now.getDate()).padStart(2, '0')}`;
+    appStats.addedToday = stats.daily[today] || 0;
+    updateHeaderStats();
+  } catch (error) {
+    console.warn('Statistiche non disponibili:', error);
+  }
+}
+
+// Scarica le modifiche dalla versione attuale, un file per versione, e le unisce in ordine.
+// Restituisce null se serve lo snapshot completo (primo caricamento, oppure versione
+// troppo vecchia e delta non più disponibili)
+async function fetchDelta() {
+  if (snapshotVersion === null) return null;
+  const response = await fetch(`${DELTAS_URL}changelog.json`, { cache: 'no-store' });
+  if (!response.ok) return null;
+  const log = await response.json();
+  if (snapshotVersion < log.base || snapshotVersion > log.version) return null;
+  const versions = [];
+  for (let v = snapshotVersion + 1; v <= log.version; v++) versions.push(v);
+  const deltas = await Promise.all(versions.map(async v => {
+    const res = await fetch(`${DELTAS_URL}v-${v}.json`, { cache: 'no-store' });
+    return res.ok ? res.json() : null;
+  }));
+  // Un file mancante: la catena è stata accorciata nel frattempo
+  if (deltas.some(delta => delta === null)) return null;
+  return { from: snapshotVersion, to: log.version, ops: deltas.flatMap(delta => delta.ops) };
+}
+
+// Applica solo aggiunte, rinomine e rimozioni, senza ricostruire il cluster
+function applyDelta(delta) {
+  delta.ops.forEach(op => {
+    if (op.op === 'add') {
+      // Idempotente: un marker già presente (es. già nello snapshot) non viene duplicato
+      if (markersByKey.has(markerKey(op.marker))) return;
+      const marker = createMarker(op.marker);
+      currentMarkers.push(marker);
+      allMarkersData.push(op.marker);
+      markersByKey.set(markerKey(op.marker), marker);
+      addToBucket(marker);
+      return;
+    }
+
+    const marker = markersByKey.get(op.key);
+    if (!marker) return;
+    const row = marker.options.data;
+    markersByKey.delete(op.key);
+
+    if (op.op === 'rename') {
+      row.name = op.name;
+      marker.options.title = op.name;
+      marker.setPopupContent(formatPopupContent(row));
+      markersByKey.set(markerKey(row), marker);
+    } else if (op.op === 'remove') {
+      removeFromBucket(marker);
+      currentMarkers = currentMarkers.filter(m => m !== marker);
+      allMarkersData = allMarkersData.filter(r => r !== row);
+    }
+  });
+
+  snapshotVersion = delta.to;
+  updateDataStats();
+}
+
 async function loadMarkers() {
   const refreshBtn = document.querySelector('.refresh-btn');
   refreshBtn.classList.add('loading');
   updateStatus('loading', 'Caricamento dati in corso...');
   
+  fetchDailyStats();
+
   try {
-    const response = await fetch('/shared/dati.csv?t=' + Date.now());
-    if (!response.ok) throw new Error(`Errore HTTP: ${response.status}`);
-    
-    const csv = await response.text();
-    const data = parseCSV(csv);
+    if (USE_TILES) {
+      const count = await loadVisibleTiles();
+      updateStatus('success', `${count} nodi nell'area visibile`);
+      return;
+    }
+
+    const delta = await fetchDelta();
+    if (delta) {
+      if (delta.ops.length === 0) {
+        appStats.lastUpdate = new Date();
+        updateHeaderStats();
+        updateStatus('success', `Nessuna modifica (${currentMarkers.length} nodi)`);
+      } else {
+        applyDelta(delta);
+        updateStatus('success', `Applicate ${delta.ops.length} modifiche (${currentMarkers.length} nodi)`);
+      }
+      return;
+    }
+
+    const data = await fetchMarkerData();
+    if (data === null) {
+      // Nessuna modifica: niente parsing e niente ricostruzione dei marker
+      appStats.lastUpdate = new Date();
+      updateHeaderStats();
+      updateStatus('success', `Nessuna modifica (${currentMarkers.length} nodi)`);
+      return;
+    }
     allMarkersData = data; // Salva tutti i dati per la ricerca
     
-    // Calcola le statistiche
-    const uniqueUsers = new Set(data.map(row => row.user || row.ID));
-    appStats.totalNodes = data.length;
-    appStats.uniqueUsers = uniqueUsers.size;
-    appStats.lastUpdate = new Date();
-    
-    // Aggiorna l'header
-    updateHeaderStats();
+    // Calcola le statistiche e aggiorna l'header
+    updateDataStats();
     
     // Memorizza la vista corrente prima di aggiornare i marker
     const currentZoom = map.getZoom();
@@ -212,38 +556,31 @@ async function loadMarkers() {
     // Rimuovi i vecchi marker
     markersCluster.clearLayers();
     currentMarkers = [];
+    markersByKey = new Map();
 
-    // Filtra e aggiungi i nuovi marker
-    const validMarkers = data.filter(row => {
-      const lat = parseFloat(row.lat);
-      const lon = parseFloat(row.lon);
-      return !isNaN(lat) && !isNaN(lon);
+    // Aggiungi i nuovi marker, scartando le righe senza coordinate valide
+    data.forEach(row => {
+      const lat = coordinate(row.lat);
+      const lon = coordinate(row.lon);
+      if (isNaN(lat) || isNaN(lon)) return;
+      const marker = createMarker(row, lat, lon);
+      currentMarkers.push(marker);
+      markersByKey.set(markerKey(row), marker);
     });
 
-    if (validMarkers.length === 0) {
+    if (currentMarkers.length === 0) {
       updateStatus('error', 'Nessun dato valido trovato');
       return;
     }
 
-    validMarkers.forEach(row => {
-      const lat = parseFloat(row.lat);
-      const lon = parseFloat(row.lon);
-      
-      const marker = L.marker([lat, lon], {
-        title: row.name || 'Nodo LoRa',
-        riseOnHover: true,
-        data: row
-      }).bindPopup(formatPopupContent(row));
-      
-      currentMarkers.push(marker);
-    });
-
-    markersCluster.addLayers(currentMarkers);
+    // Solo i gruppi che passano i filtri attivi
+    buildBuckets(currentMarkers, publishedBuckets);
+    markersCluster.addLayers(visibleMarkers());
 
     // Ripristina la vista precedente invece di zoommare sui marker
     map.setView(currentCenter, currentZoom);
         
-        updateStatus('success', `Caricati ${validMarkers.length} nodi`);
+        updateStatus('success', `Caricati ${currentMarkers.length} nodi`);
     
   } catch (error) {
     console.error("Errore nel caricamento:", error);
@@ -251,9 +588,184 @@ async function loadMarkers() {
   } finally {
     refreshBtn.classList.remove('loading');
   }
+}
 
-  if (window.initFilters) initFilters();
+// --------------- Caricamento a tile ---------------
+
+// Tile web mercator che contiene il punto, come tile_coords nel bot
+function latLonToTile(lat, lon, z) {
+  const n = 1 << z;
+  const clampedLat = Math.max(Math.min(lat, 85.05112878), -85.05112878);
+  const latRad = clampedLat * Math.PI / 180;
+  const x = Math.floor((lon + 180) / 360 * n);
+  const y = Math.floor((1 - Math.asinh(Math.tan(latRad)) / Math.PI) / 2 * n);
+  return {
+    x: Math.min(Math.max(x, 0), n - 1),
+    y: Math.min(Math.max(y, 0), n - 1)
+  };
+}
 
+// Indice delle tile non vuote di un livello, scaricato solo se cambiato
+async function loadTileIndex(z) {
+  const cached = tileIndexes.get(z);
+  const headers = cached && cached.etag ? { 'If-None-Match': cached.etag } : {};
+  const response = await fetch(`${TILES_URL}${z}/index.json`, { headers, cache: 'no-store' });
+  if (response.status === 304) return cached.index;
+  if (!response.ok) throw new Error(`Errore HTTP: ${response.status}`);
+  const index = await response.json();
+  tileIndexes.set(z, { etag: response.headers.get('ETag'), index });
+  return index;
+}
+
+function createClusterMarker(cluster) {
+  return L.marker([cluster.lat, cluster.lon], {
+    icon: L.divIcon({
+      html: `<div><span>${cluster.count}</span></div>`,
+      className: 'cluster-icon',
+      iconSize: L.point(40, 40)
+    })
+  }).on('click', () => map.setView([cluster.lat, cluster.lon], map.getZoom() + 2));
+}
+
+function removeTile(id) {
+  const tile = loadedTiles.get(id);
+  if (!tile) return;
+  tile.layers.forEach(layer => tilesLayer.removeLayer(layer));
+  loadedTiles.delete(id);
+}
+
+// Carica le tile che intersecano la vista e scarta le altre. Restituisce i nodi caricati
+async function loadVisibleTiles() {
+  const z = Math.min(Math.floor(map.getZoom()), TILE_DETAIL_ZOOM);
+  const index = await loadTileIndex(z);
+  const bounds = map.getBounds();
+  const nw = latLonToTile(bounds.getNorth(), bounds.getWest(), z);
+  const se = latLonToTile(bounds.getSouth(), bounds.getEast(), z);
+
+  const wanted = new Map(); // "z/x/y" -> hash
+  for (let x = nw.x; x <= se.x; x++) {
+    for (let y = nw.y; y <= se.y; y++) {
+      const hash = index.tiles[`${x}/${y}`];
+      if (hash) wanted.set(`${z}/${x}/${y}`, hash);
+    }
+  }
+
+  Array.from(loadedTiles.keys()).forEach(id => {
+    if (!wanted.has(id)) removeTile(id);
+  });
+
+  await Promise.all(Array.from(wanted, async ([id, hash]) => {
+    const loaded = loadedTiles.get(id);
+    if (loaded && loaded.hash === hash) return;
+
+    // L'hash nell'URL rende la tile memorizzabile dal browser finché non cambia
+    const response = await fetch(`${TILES_URL}${id}.json?h=${hash}`);
+    if (!response.ok) return;
+    const tile = await response.json();
+    const layers = (tile.clusters || []).map(createClusterMarker)
+      .concat(tile.markers.filter(matchesFilters).map(createMarker));
+
+    removeTile(id);
+    layers.forEach(layer => tilesLayer.addLayer(layer));
+    loadedTiles.set(id, { hash, layers, markers: tile.markers });
+  }));
+
+  allMarkersData = Array.from(loadedTiles.values()).flatMap(tile => tile.markers);
+  updateDataStats();
+  return allMarkersData.length;
+}
+
+// Scarica il layer di una rete esterna se è cambiato e ne ricrea i marker
+async function loadExternalLayer(source) {
+  const layer = externalLayers.get(source);
+  try {
+    const headers = layer.etag ? { 'If-None-Match': layer.etag } : {};
+    const response = await fetch(`${LAYERS_URL}${source}/snapshot.json`, { headers, cache: 'no-store' });
+    if (response.status === 304) return;
+    if (!response.ok) throw new Error(`Errore HTTP: ${response.status}`);
+    const snapshot = await response.json();
+    layer.etag = response.headers.get('ETag');
+    if (snapshot.version === layer.version) return;
+    layer.version = snapshot.version;
+
+    const color = EXTERNAL_LAYERS[source].color;
+    const markers = snapshotToRows(snapshot).map(row => L.circleMarker([parseFloat(row.lat), parseFloat(row.lon)], {
+      radius: 6,
+      color,
+      fillColor: color,
+      fillOpacity: 0.6,
+      weight: 1
+    }).bindPopup(formatPopupContent(row)));
+    layer.group.clearLayers();
+    layer.group.addLayers(markers);
+  } catch (error) {
+    console.error(`Errore caricamento layer ${source}:`, error);
+  }
+}
+
+const CoverageLayer = L.TileLayer.extend({
+  createTile(coords, done) {
+    const index = coverageIndexes.get(coords.z);
+    if (!index || !index.tiles[`${coords.x}/${coords.y}`]) {
+      const tile = document.createElement('div');
+      setTimeout(() => done(null, tile), 0);
+      return tile;
+    }
+    return L.TileLayer.prototype.createTile.call(this, coords, done);
+  },
+  getTileUrl(coords) {
+    const hash = coverageIndexes.get(coords.z).tiles[`${coords.x}/${coords.y}`];
+    return `${COVERAGE_URL}${coords.z}/${coords.x}/${coords.y}.png?h=${hash}`;
+  }
+});
+
+const coverageLayer = new CoverageLayer('', {
+  minNativeZoom: COVERAGE_MIN_ZOOM,
+  maxNativeZoom: COVERAGE_MAX_ZOOM,
+  opacity: 0.8,
+  attribution: 'Copertura stimata (modello senza orografia)'
+});
+
+// Scarica l'indice delle tile di copertura del livello visibile e ridisegna se è cambiato
+async function loadCoverageIndex() {
+  if (!map.hasLayer(coverageLayer)) return;
+  const z = Math.min(Math.max(map.getZoom(), COVERAGE_MIN_ZOOM), COVERAGE_MAX_ZOOM);
+  const cached = coverageIndexes.get(z);
+  try {
+    const headers = cached?.etag ? { 'If-None-Match': cached.etag } : {};
+    const response = await fetch(`${COVERAGE_URL}${z}/index.json`, { headers, cache: 'no-store' });
+    if (response.status === 304) return;
+    if (!response.ok) throw new Error(`Errore HTTP: ${response.status}`);
+    const index = await response.json();
+    coverageIndexes.set(z, { etag: response.headers.get('ETag'), tiles: index.tiles });
+    coverageLayer.redraw();
+  } catch (error) {
+    console.error('Errore caricamento copertura:', error);
+  }
+}
+
+// Controllo dei layer con una voce per rete esterna e una per la copertura, disattivate all'avvio
+function initExternalLayers() {
+  const overlays = { 'Copertura stimata': coverageLayer };
+  Object.entries(EXTERNAL_LAYERS).forEach(([source, { label }]) => {
+    const group = L.markerClusterGroup({ maxClusterRadius: 60, showCoverageOnHover: false });
+    externalLayers.set(source, { group, etag: null, version: null });
+    overlays[label] = group;
+  });
+  L.control.layers(null, overlays, { position: 'topright' }).addTo(map);
+
+  map.on('overlayadd', (e) => {
+    if (e.layer === coverageLayer) loadCoverageIndex();
+    externalLayers.forEach((layer, source) => {
+      if (layer.group === e.layer) loadExternalLayer(source);
+    });
+  });
+  setInterval(() => {
+    externalLayers.forEach((layer, source) => {
+      if (map.hasLayer(layer.group)) loadExternalLayer(source);
+    });
+  }, EXTERNAL_REFRESH_INTERVAL);
+  map.on('zoomend', loadCoverageIndex);
 }
 
 // Gestione dell'aggiornamento automatico
@@ -261,16 +773,25 @@ function setupAutoRefresh(interval = 30000) {
   if (autoRefreshInterval) {
     clearInterval(autoRefreshInterval);
   }
-  autoRefreshInterval = setInterval(loadMarkers, interval);
+  autoRefreshInterval = setInterval(() => {
+    loadMarkers();
+    loadCoverageIndex();
+  }, interval);
 }
 
 // Al caricamento della pagina, carica i marker e imposta intervallo
 document.addEventListener('DOMContentLoaded', () => {
+  if (USE_TILES) {
+    map.removeLayer(markersCluster);
+    map.addLayer(tilesLayer);
+    map.on('moveend', loadMarkers);
+  }
   loadMarkers();
   setupAutoRefresh();
   setInterval(updateHeaderStats, 60000); // Aggiorna l'orario nell'header ogni minuto
   initSearch(); // Inizializza la ricerca
   initFilters();
+  initExternalLayers();
   initShareButton(); // Inizializza pulsante di condivisione
   loadInitialPosition();
 });
@@ -318,60 +839,222 @@ function initFilters() {
 }
 
 function applyFilters() {
+  if (USE_TILES) {
+    // I filtri si applicano ai marker delle tile: vanno ricaricate
+    Array.from(loadedTiles.keys()).forEach(removeTile);
+    loadMarkers();
+    return;
+  }
+
   if (!currentMarkers.length) return;
 
-  // Se nessun filtro attivo, mostra tutto
-  if (!activeFilters.frequency && !activeFilters.node_type) {
+  // Solo i gruppi che cambiano stato
+  let toAdd = [];
+  let toRemove = [];
+  let staying = 0;
+  markerBuckets.forEach(bucket => {
+    const visible = matchesFilters(bucket);
+    if (visible && bucket.visible) staying += bucket.markers.length;
+    else if (visible) toAdd = toAdd.concat(bucket.markers);
+    else if (bucket.visible) toRemove = toRemove.concat(bucket.markers);
+    bucket.visible = visible;
+  });
+
+  // Se si tolgono più marker di quanti ne restano, svuotare il cluster (operazione rapida)
+  // e riaggiungere i visibili costa meno che rimuoverli uno per uno
+  if (toRemove.length > staying) {
     markersCluster.clearLayers();
-    markersCluster.addLayers(currentMarkers);
-    updateStatus('success', `Mostrati tutti i ${currentMarkers.length} nodi`);
-    return;
+    markersCluster.addLayers(visibleMarkers());
+  } else {
+    if (toRemove.length) markersCluster.removeLayers(toRemove);
+    if (toAdd.length) markersCluster.addLayers(toAdd);
   }
 
-  // Altrimenti applica filtri
-  const filtered = currentMarkers.filter(marker => {
-    const data = marker.options.data || {};
-    return (
-      (!activeFilters.frequency || data.frequency === activeFilters.frequency) &&
-      (!activeFilters.node_type || data.node_type === activeFilters.node_type)
-    );
+  // Conteggi per gruppo, senza scorrere i marker
+  if (!activeFilters.frequency && !activeFilters.node_type) {
+    updateStatus('success', `Mostrati tutti i ${visibleCount()} nodi`);
+  } else {
+    updateStatus('success', `${visibleCount()} nodi visibili`);
+  }
+}
+
+// --------------- Funzioni per gestire la ricerca ---------------
+// Stessa normalizzazione di fold() in bot/search.py: minuscole, senza accenti e punteggiatura
+function fold(text) {
+  return String(text).toLowerCase().normalize('NFKD')
+    .replace(/\p{M}/gu, '')
+    .replace(/[^\p{L}\p{N}]+/gu, ' ')
+    .trim();
+}
+
+// Ordine dei risultati: nome uguale, inizio del nome, inizio di una parola, altrove
+function compareResults(a, b) {
+  return a.kind - b.kind || a.folded.length - b.folded.length || (a.folded < b.folded ? -1 : a.folded > b.folded ? 1 : 0);
+}
+
+function resultKind(folded, query) {
+  if (folded === query) return 0;
+  if (folded.startsWith(query)) return 1;
+  if ((' ' + folded).includes(' ' + query)) return 2;
+  return 3;
+}
+
+function intersectSorted(a, b) {
+  const result = [];
+  let i = 0, j = 0;
+  while (i < a.length && j < b.length) {
+    if (a[i] === b[j]) { result.push(a[i]); i++; j++; }
+    else if (a[i] < b[j]) i++;
+    else j++;
+  }
+  return result;
+}
+
+// Scarica l'indice solo se è cambiato; le liste degli n-grammi vengono decodificate al primo uso
+async function loadSearchIndex() {
+  const stale = !searchIndex
+    || (snapshotVersion !== null && searchIndex.version !== snapshotVersion)
+    || Date.now() - searchIndex.checked > SEARCH_INDEX_MAX_AGE;
+  if (!stale) return searchIndex;
+  if (!searchIndexLoading) {
+    searchIndexLoading = (async () => {
+      try {
+        const headers = searchIndex && searchIndex.etag ? { 'If-None-Match': searchIndex.etag } : {};
+        const response = await fetch(SEARCH_INDEX_URL, { headers, cache: 'no-store' });
+        if (response.status === 304) {
+          searchIndex.checked = Date.now();
+        } else if (response.ok) {
+          const data = await response.json();
+          searchIndex = {
+            version: data.version,
+            etag: response.headers.get('ETag'),
+            checked: Date.now(),
+            n: data.n,
+            names: data.names,
+            folded: new Array(data.names.length),
+            points: data.points,
+            grams: data.grams,
+            decoded: new Map()
+          };
+        } else {
+          searchIndex = null;
+        }
+      } catch (error) {
+        console.warn('Indice di ricerca non disponibile:', error);
+        searchIndex = null;
+      } finally {
+        searchIndexLoading = null;
+      }
+      return searchIndex;
+    })();
+  }
+  return searchIndexLoading;
+}
+
+// Lista ordinata delle voci che contengono un n-gramma (nel file: differenze tra voci consecutive)
+function gramPostings(index, gram) {
+  let postings = index.decoded.get(gram);
+  if (!postings) {
+    const gaps = index.grams[gram] || [];
+    postings = new Array(gaps.length);
+    let value = 0;
+    for (let i = 0; i < gaps.length; i++) postings[i] = value += gaps[i];
+    index.decoded.set(gram, postings);
+  }
+  return postings;
+}
+
+function foldedName(index, i) {
+  return index.folded[i] ?? (index.folded[i] = fold(index.names[i]));
+}
+
+// Voci dell'indice che contengono la query, intersecando le liste degli n-grammi
+function searchCandidates(index, query) {
+  let candidates;
+  if (query.length >= index.n) {
+    const lists = [];
+    for (let i = 0; i + index.n <= query.length; i++) lists.push(gramPostings(index, query.slice(i, i + index.n)));
+    lists.sort((a, b) => a.length - b.length);
+    candidates = lists.reduce((result, list) => result.length ? intersectSorted(result, list) : result);
+  } else {
+    const found = new Set();
+    Object.keys(index.grams).forEach(gram => {
+      if (gram.includes(query)) gramPostings(index, gram).forEach(i => found.add(i));
+    });
+    candidates = Array.from(found);
+  }
+  return candidates.filter(i => foldedName(index, i).includes(query));
+}
+
+// Primi SEARCH_RESULTS risultati come { name, lat, lon }, uno per marker. Le voci migliori
+// vengono scelte con un inserimento ordinato, senza ordinare tutti i candidati
+function querySearchIndex(index, query) {
+  const best = [];
+  searchCandidates(index, query).forEach(i => {
+    if (index.points[i].length === 0) return;
+    const folded = foldedName(index, i);
+    const entry = { i, folded, kind: resultKind(folded, query) };
+    if (best.length === SEARCH_RESULTS && compareResults(entry, best[best.length - 1]) >= 0) return;
+    let k = best.length;
+    while (k > 0 && compareResults(entry, best[k - 1]) < 0) k--;
+    best.splice(k, 0, entry);
+    if (best.length > SEARCH_RESULTS) best.pop();
   });
+  const results = [];
+  for (const { i } of best) {
+    const points = index.points[i];
+    for (let k = 0; k < points.length && results.length < SEARCH_RESULTS; k += 2) {
+      results.push({ name: index.names[i], lat: points[k], lon: points[k + 1] });
+    }
+  }
+  return results;
+}
 
-  markersCluster.clearLayers();
-  markersCluster.addLayers(filtered);
-  
-  // Aggiorna il contatore
-  const statusText = `${filtered.length} nodi visibili`;
-  updateStatus('success', statusText);
+// Senza indice (bot non aggiornato): scansione dei marker caricati
+function scanMarkers(query) {
+  return allMarkersData
+    .filter(marker => marker.name && fold(marker.name).includes(query))
+    .map(marker => ({ name: marker.name, lat: marker.lat, lon: marker.lon, folded: fold(marker.name) }))
+    .map(result => ({ ...result, kind: resultKind(result.folded, query) }))
+    .sort(compareResults)
+    .slice(0, SEARCH_RESULTS);
 }
 
-// --------------- Funzioni per gestire la ricerca ---------------
-function handleSearch() {
-  const searchTerm = searchInput.value.toLowerCase().trim();
-  searchResults.innerHTML = '';
-  
-  if (searchTerm.length < 2) {
+function renderSearchResults(results) {
+  if (results.length === 0) {
+    searchResults.replaceChildren();
     searchResults.style.display = 'none';
     return;
   }
-  
-  const results = allMarkersData.filter(marker => 
-    marker.name && marker.name.toLowerCase().includes(searchTerm))
-    .slice(0, 10); // Limita a 10 risultati
-  
-  if (results.length > 0) {
-    results.forEach(marker => {
-      const resultItem = document.createElement('div');
-      resultItem.className = 'search-result-item';
-      resultItem.textContent = marker.name;
-      resultItem.dataset.lat = marker.lat;
-      resultItem.dataset.lon = marker.lon;
-      searchResults.appendChild(resultItem);
-    });
-    searchResults.style.display = 'block';
-  } else {
-    searchResults.style.display = 'none';
+  const fragment = document.createDocumentFragment();
+  results.forEach(result => {
+    const resultItem = document.createElement('div');
+    resultItem.className = 'search-result-item';
+    resultItem.textContent = result.name;
+    resultItem.dataset.lat = result.lat;
+    resultItem.dataset.lon = result.lon;
+    fragment.appendChild(resultItem);
+  });
+  searchResults.replaceChildren(fragment);
+  searchResults.style.display = 'block';
+}
+
+// Cerca solo dopo una pausa nella digitazione
+function handleSearch() {
+  clearTimeout(searchTimer);
+  searchTimer = setTimeout(runSearch, SEARCH_DEBOUNCE);
+}
+
+async function runSearch() {
+  const term = searchInput.value;
+  const query = fold(term);
+  if (query.length < 2) {
+    renderSearchResults([]);
+    return;
   }
+  const index = await loadSearchIndex();
+  if (searchInput.value !== term) return; // testo cambiato durante il download dell'indice
+  renderSearchResults(index ? querySearchIndex(index, query) : scanMarkers(query));
 }
 
 // Funzione per gestire il click su un risultato
@@ -381,8 +1064,9 @@ function handleSearchResultClick(e) {
     const lon = parseFloat(e.target.dataset.lon);
     
     map.setView([lat, lon], 16); // Zoom a livello 16
+    // Tolleranza: l'indice ha 5 decimali, lo snapshot binario coordinate float32
     markersCluster.getLayers().forEach(layer => {
-      if (layer.getLatLng().lat === lat && layer.getLatLng().lng === lon) {
+      if (Math.abs(layer.getLatLng().lat - lat) < 1e-5 && Math.abs(layer.getLatLng().lng - lon) < 1e-5) {
         layer.openPopup();
       }
     });
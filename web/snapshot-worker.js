@@ -0,0 +1,72 @@
+// Web Worker: scarica e decodifica lo snapshot binario dei marker (shared/snapshot.bin,
+// scritto da encode_binary nel bot) fuori dal thread principale. Gli array tipizzati
+// condividono un solo ArrayBuffer, trasferito alla pagina senza copie
+
+const BINARY_MAGIC = 'LBSB';
+const BINARY_FORMAT = 1;
+const HEADER_SIZE = 32;
+const STRING_FIELDS = ['name', 'desc', 'link', 'ID', 'user', 'timestamp'];
+const DICT_FIELDS = ['node_type', 'frequency'];
+
+function decodeSnapshot(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+  if (magic !== BINARY_MAGIC || view.getUint16(4, true) !== BINARY_FORMAT) {
+    throw new Error('Formato dello snapshot binario non supportato');
+  }
+  const version = view.getUint32(8, true);
+  const generated = view.getUint32(12, true);
+  const count = view.getUint32(16, true);
+  const dictBytes = view.getUint32(20, true);
+  const stringBytes = view.getUint32(24, true);
+
+  let offset = HEADER_SIZE;
+  const lat = new Float32Array(buffer, offset, count);
+  offset += count * 4;
+  const lon = new Float32Array(buffer, offset, count);
+  offset += count * 4;
+
+  // Indici nella tabella delle stringhe e nei dizionari
+  const indices = {};
+  STRING_FIELDS.forEach(field => {
+    indices[field] = new Uint32Array(buffer, offset, count);
+    offset += count * 4;
+  });
+  const codes = {};
+  DICT_FIELDS.forEach(field => {
+    codes[field] = new Uint16Array(buffer, offset, count);
+    offset += count * 2;
+  });
+  offset += (4 - offset % 4) % 4;
+
+  const decoder = new TextDecoder();
+  const dictionaries = JSON.parse(decoder.decode(new Uint8Array(buffer, offset, dictBytes)).replace(/\0+$/, ''));
+  offset += dictBytes;
+  const strings = decoder.decode(new Uint8Array(buffer, offset, stringBytes)).split('\0');
+
+  return { version, generated, count, lat, lon, indices, codes, dictionaries, strings };
+}
+
+if (typeof importScripts === 'function') {
+  self.onmessage = async (event) => {
+    const { id, url, etag } = event.data;
+    try {
+      const headers = etag ? { 'If-None-Match': etag } : {};
+      const response = await fetch(url, { headers, cache: 'no-store' });
+      if (!response.ok) {
+        self.postMessage({ id, status: response.status });
+        return;
+      }
+      const buffer = await response.arrayBuffer();
+      const started = performance.now();
+      const snapshot = decodeSnapshot(buffer);
+      snapshot.decodeMs = performance.now() - started;
+      self.postMessage({ id, status: 200, etag: response.headers.get('ETag'), snapshot }, [buffer]);
+    } catch (error) {
+      self.postMessage({ id, status: 0, error: error.message });
+    }
+  };
+}
+
+// Usato anche dal benchmark in Node (bench/decode_formats.js)
+if (typeof module !== 'undefined') module.exports = { decodeSnapshot };